@@ -1,36 +1,110 @@
 import os
 from functools import wraps
-
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from uuid import uuid4
+
+import click
+from flask import (Flask, Blueprint, Response, render_template, request,
+                   flash, redirect, session, g, get_flashed_messages,
+                   stream_with_context, current_app, abort, jsonify)
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.middleware.proxy_fix import ProxyFix
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
 
+from assets import Assets
+from availability import Availability, availability, check_form
+from compression import Compressor
+from config import PROFILES, current_profile
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message
+from gather import QueryExecutor, QueryTimeout, Task, gather
+from idempotency import valid_key
+from images import IMMUTABLE_CACHE_CONTROL, ImageProxy
+from likes_schema import migrate_likes
+from message_ids import upgrade_schema, legacy_count, renumber_legacy_ids
+from models import db, connect_db, Follows, User
+from node_leases import NodeLeaser
+from pagecache import PageCache, cache_page
+from partitions import (load_archived, live_months,
+                        read_manifest, archive_before, parse_month)
+from ratelimit import RateLimiter
+from realtime import Realtime, realtime
+from recommendations import refresh_recommendations
+from shards import (MessageShards, message_shards, user_messages, home_messages,
+                    post_message, find_message, delete_message,
+                    delete_user_messages, toggle_like as toggle_message_like,
+                    liked_messages)
+from snowflake import make_generator
+from tags import backfill_tags, link_tags, mention_messages, tag_messages
+from timeline import backfill, unfollow, rebuild_timelines
+from trending import Trending, trending
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+bp = Blueprint('warbler', __name__)
+
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgres:///warbler'))
+def create_app(profile=None):
+    """Build the Warbler app for a configuration profile (see config.py).
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+    Nothing here touches the database schema except the node_leases table,
+    when a node has to be leased (see node_leases.py), and debug-only
+    extensions are only imported when the profile asks for them.
+    """
 
-connect_db(app)
+    app = Flask(__name__)
+    app.config.from_object(PROFILES[profile or current_profile()])
+
+    hops = app.config['PROXY_HOPS']
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+    if app.config['DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    if app.config['TEMPLATE_CACHE_DIR']:
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            app.config['TEMPLATE_CACHE_DIR'])
+
+    connect_db(app)
+    lease = None
+    if app.config['NODE_ID'] is None:
+        lease = NodeLeaser(app)
+        lease.start()
+    app.extensions['message_ids'] = make_generator(
+        app.config['MESSAGE_ID_GENERATOR'], app.config['NODE_ID'], lease=lease)
+    MessageShards(app)
+    QueryExecutor(app)
+    PageCache(app)
+    Availability(app)
+    Trending(app)
+    Realtime(app)
+    Assets(app)
+    ImageProxy(app)
+    Compressor(app)
+    app.add_template_filter(link_tags)
+    app.register_blueprint(bp)
+    RateLimiter(app)
+
+    app.cli.add_command(recommend_command)
+    app.cli.add_command(compile_templates_command)
+    app.cli.add_command(partitions_command)
+    app.cli.add_command(timeline_command)
+    app.cli.add_command(ids_command)
+    app.cli.add_command(shards_command)
+    app.cli.add_command(likes_command)
+    app.cli.add_command(assets_command)
+    app.cli.add_command(tags_command)
+
+    return app
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
@@ -53,6 +127,34 @@ def do_logout():
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
 
+def stream_template(template_name, **context):
+    """Render a template as a streamed response.
+
+    The first chunks are sent before the whole page is built. Flashed
+    messages are read up front so that removing them from the session
+    still makes it into the response cookie.
+    """
+
+    get_flashed_messages(with_categories=True)
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+
+    stream = template.stream(context)
+    buffer_size = current_app.config['STREAM_BUFFER_SIZE']
+    if buffer_size > 1:
+        stream.enable_buffering(buffer_size)
+
+    return Response(stream_with_context(stream))
+
+
+def render_list(template_name, **context):
+    """Render a list-heavy page, streamed if STREAM_TEMPLATES is on."""
+
+    if current_app.config['STREAM_TEMPLATES']:
+        return stream_template(template_name, **context)
+    return render_template(template_name, **context)
+
+
 def checkuser(func):
     """Wrapper function checks if user logged in else redirects to home with flash warning"""
     @wraps(func)
@@ -64,7 +166,7 @@ def checkuser(func):
     return wrapper
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -79,6 +181,12 @@ def signup():
     form = UserAddForm()
 
     if form.validate_on_submit():
+        # taken names are caught before hashing the password; the
+        # constraint still catches anyone who took one since
+        if not check_form(form):
+            flash("Username already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
         try:
             user = User.signup(
                 username=form.username.data,
@@ -100,7 +208,7 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
@@ -120,7 +228,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -129,10 +237,23 @@ def logout():
     return redirect('/login')
 
 
+@bp.route('/users/available')
+def users_available():
+    """Whether a username or email is free, e.g. ?username=bob, as JSON."""
+
+    for field in ('username', 'email'):
+        value = request.args.get(field)
+        if value:
+            return jsonify({field: value,
+                            'available': not availability().is_taken(field, value)})
+    abort(400)
+
+
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+@bp.route('/users')
+@cache_page(lambda: {'users'})
 def list_users():
     """Page with listing of users.
 
@@ -146,59 +267,131 @@ def list_users():
     else:
         users = User.query.filter(User.username.like(f"%{search}%")).all()
 
-    return render_template('users/index.html', users=users)
+    following_ids = g.user.following_ids_among(users) if g.user else set()
+
+    return render_list('users/index.html', users=users,
+                       following_ids=following_ids)
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
+@cache_page(lambda user_id: {f'user:{user_id}'})
 def users_show(user_id):
     """Show user profile."""
 
     user = User.query.get_or_404(user_id)
 
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
-
-@app.route('/users/<int:user_id>/following')
+    # snagging messages in order from the database, newest months first;
+    # user.messages won't be in order by default. The counts run alongside.
+    queries = user.count_queries()
+    queries['feed'] = feed_query(
+        lambda limit, before: user_messages(user_id, limit, before))
+    results = gather(queries)
+
+    messages, next_before = feed_page(results.pop('feed'))
+    return render_list('users/show.html', user=user, messages=messages,
+                       next_before=next_before, counts=results)
+
+@bp.route('/users/<int:user_id>/following')
 @checkuser
 def show_following(user_id):
-    """Show list of people this user is following."""
+    """Show a page of people this user is following.
+
+    Pages are ordered by user id; pass 'after' in the querystring
+    to get the page following that id.
+    """
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    return render_follow_page('users/following.html', user,
+                              user.following_page)
 
 
-@app.route('/users/<int:user_id>/followers')
+@bp.route('/users/<int:user_id>/followers')
 @checkuser
 def users_followers(user_id):
-    """Show list of followers of this user."""
+    """Show a page of followers of this user (paginated like following)."""
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    return render_follow_page('users/followers.html', user,
+                              user.followers_page)
+
+
+def feed_query(get_messages):
+    """Query for one page of a newest-first message feed.
+
+    Pass 'before' in the querystring to get the messages older than that id.
+    One extra message is fetched to tell if there is a next page.
+    """
+
+    before = request.args.get('before', type=int)
+    limit = current_app.config['FEED_PAGE_SIZE'] + 1
+    return lambda: get_messages(limit, before)
+
+
+def feed_page(messages):
+    """A feed page's messages, and the cursor for the next page (or None)."""
+
+    page_size = current_app.config['FEED_PAGE_SIZE']
+    next_before = messages[page_size - 1].id if len(messages) > page_size else None
+    return messages[:page_size], next_before
+
+
+def render_follow_page(template_name, user, get_page):
+    """Render one id-ordered page of a follow list.
+
+    Whether the viewer follows each listed user is looked up in one query
+    rather than once per card.
+    """
+
+    after = request.args.get('after', 0, type=int)
+    page_size = current_app.config['FOLLOW_PAGE_SIZE']
+
+    users = get_page(after=after, limit=page_size + 1)
+    next_after = users[page_size - 1].id if len(users) > page_size else None
+    users = users[:page_size]
 
+    return render_list(template_name,
+                       user=user,
+                       users=users,
+                       following_ids=g.user.following_ids_among(users),
+                       next_after=next_after,
+                       counts=user.counts())
 
-@app.route('/users/<int:user_id>/likes')
+
+@bp.route('/users/<int:user_id>/likes')
 @checkuser
 def users_likes(user_id):
     """Show list of warbles liked by this user"""
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user)
+    return render_list('users/likes.html', user=user,
+                       messages=liked_messages(user),
+                       counts=user.counts())
+
+
+@bp.route('/users/<int:user_id>/mentions')
+@checkuser
+def users_mentions(user_id):
+    """Show warbles mentioning this user, newest first (paged like profiles)."""
+
+    user = User.query.get_or_404(user_id)
+    queries = user.count_queries()
+    queries['feed'] = feed_query(
+        lambda limit, before: mention_messages(user_id, limit, before))
+    results = gather(queries)
 
+    messages, next_before = feed_page(results.pop('feed'))
+    return render_list('users/mentions.html', user=user, messages=messages,
+                       next_before=next_before, counts=results)
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+
+@bp.route('/users/follow/<int:follow_id>', methods=['POST'])
 @checkuser
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
     followed_user = User.query.get_or_404(follow_id)
     g.user.following.append(followed_user)
+    backfill(g.user.id, followed_user.id)
     db.session.commit()
 
     url_redirect = request.form.get('url_redirect')
@@ -206,13 +399,14 @@ def add_follow(follow_id):
     return redirect(url_redirect)
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@bp.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 @checkuser
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
+    unfollow(g.user.id, followed_user.id)
     db.session.commit()
 
     url_redirect = request.form.get('url_redirect')
@@ -220,33 +414,33 @@ def stop_following(follow_id):
     return redirect(url_redirect)
 
 
-@app.route('/users/add-like/<int:msg_id>', methods=['POST'])
+@bp.route('/users/add-like/<int:msg_id>', methods=['POST'])
 @checkuser
 def toggle_like(msg_id):
     """Toggle whether current user likes specified message."""
     
-    message = Message.query.get_or_404(msg_id)
-    if message in g.user.likes:
-        flash('Message unliked', 'secondary')
-        g.user.likes.remove(message)
-    else:
+    message = find_message(msg_id)
+    if message is None:
+        abort(404)
+
+    if toggle_message_like(g.user, message):
         flash('Message liked', 'success')
-        g.user.likes.append(message)
-    db.session.commit()
+    else:
+        flash('Message unliked', 'secondary')
 
     url_redirect = request.form.get('url-redirect')
 
     return redirect(url_redirect)
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 @checkuser
 def profile():
     """Update profile for current user."""
 
     form = UserEditForm(obj=g.user)
 
-    if form.validate_on_submit():
+    if form.validate_on_submit() and check_form(form, g.user):
         user = User.authenticate(g.user.username,
                                  form.password.data)
         if not user:
@@ -268,13 +462,14 @@ def profile():
 
     return render_template('/users/edit.html', form=form)
 
-@app.route('/users/delete', methods=["POST"])
+@bp.route('/users/delete', methods=["POST"])
 @checkuser
 def delete_user():
     """Delete user."""
 
     do_logout()
 
+    delete_user_messages(g.user)
     db.session.delete(g.user)
     db.session.commit()
 
@@ -284,7 +479,7 @@ def delete_user():
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 @checkuser
 def messages_add():
     """Add a message:
@@ -295,63 +490,333 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
-        db.session.commit()
+        key = request.headers.get('Idempotency-Key')
+        if key and not valid_key(key):
+            abort(400)
+        key = key or form.idempotency_key.data
+        message_id, created = post_message(g.user, form.text.data, key)
+        if created:
+            trending().ingest(form.text.data)
+            realtime().publish_message(g.user, message_id, form.text.data)
 
         return redirect(f"/users/{g.user.id}")
 
+    if not form.idempotency_key.data:
+        form.idempotency_key.data = uuid4().hex
+
     return render_template('messages/new.html', form=form)
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
+@bp.route('/messages/<int:message_id>', methods=["GET"])
 @checkuser
 def messages_show(message_id):
-    """Show a message."""
+    """Show a message, from the archive if its month has been archived."""
+
+    msg = find_message(message_id) or load_archived(message_id)
+    if msg is None:
+        abort(404)
 
-    msg = Message.query.get(message_id)
     return render_template('messages/show.html', message=msg)
 
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@bp.route('/messages/<int:message_id>/delete', methods=["POST"])
 @checkuser
 def messages_destroy(message_id):
     """Delete a message."""
 
-    msg = Message.query.get(message_id)
-    db.session.delete(msg)
-    db.session.commit()
+    msg = find_message(message_id)
+    if msg is None:
+        abort(404)
+    delete_message(msg)
 
     return redirect(f"/users/{g.user.id}")
 
 
+@bp.route('/tags/<tag>')
+@checkuser
+def tags_show(tag):
+    """Show warbles with a #tag, newest first (paged like profiles)."""
+
+    messages, next_before = feed_page(feed_query(
+        lambda limit, before: tag_messages(tag, limit, before))())
+    return render_list('tags/show.html', tag=tag.lower(), messages=messages,
+                       next_before=next_before)
+
+
+##############################################################################
+# Built static assets (see assets.py) and the image proxy (see images.py)
+
+@bp.route('/assets/<path:filename>')
+def assets_show(filename):
+    """A fingerprinted static file, precompressed if the client accepts it."""
+
+    response = current_app.extensions['assets'].response(filename)
+    if response is None:
+        abort(404)
+    return response
+
+
+@bp.route('/images/<size>/<token>')
+def images_show(size, token):
+    """Thumbnail of a user's external image, or a redirect to the default."""
+
+    response = current_app.extensions['images'].response(size, token)
+    if response is None:
+        abort(404)
+    if isinstance(response, str):
+        return redirect(response)
+    return response.make_conditional(request)
+
+
 ##############################################################################
 # Homepage and error pages
 
 
-@app.route('/')
+@bp.route('/')
+@cache_page()
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: newest messages of followed_users, a page at a time
     """
 
     if g.user:
-        messages = (Message
-                    .query
-                    .filter((Message.user == g.user) | 
-                            (Message.user_id.in_(f.id for f in g.user.following)))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        user = g.user
+        queries = user.count_queries()
+        queries['feed'] = feed_query(
+            lambda limit, before: home_messages(user, limit, before))
+        queries['suggestions'] = Task(user.who_to_follow, default=[])
+        results = gather(queries)
+
+        messages, next_before = feed_page(results.pop('feed'))
+        suggestions = results.pop('suggestions')
 
-        return render_template('home.html', messages=messages)
+        return render_list('home.html', messages=messages,
+                           next_before=next_before, suggestions=suggestions,
+                           topics=trending().topics(), counts=results)
 
     else:
         return render_template('home-anon.html')
 
 
+@bp.route('/stream')
+@checkuser
+def stream():
+    """New warbles for the home page, as Server-Sent Events (see realtime.py)."""
+
+    # each stream would pin a sync worker; only serve_async.py serves them
+    if not current_app.config['REALTIME_STREAMS_ENABLED']:
+        abort(404)
+
+    followed = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == g.user.id))
+    events = realtime().stream([g.user.id] + [user_id for user_id, in followed])
+    if events is None:
+        return Response("Too many live connections, please try again shortly.",
+                        503, {'Retry-After': '30'})
+
+    # proxies (nginx) would otherwise hold events back to fill a buffer
+    return Response(events, mimetype='text/event-stream',
+                    headers={'X-Accel-Buffering': 'no'})
+
+
+@bp.app_errorhandler(QueryTimeout)
+def query_timeout(error):
+    """A query the page needs took too long (see gather.py)."""
+
+    return Response("The site is busy, please try again shortly.", 503,
+                    {'Retry-After': '1'})
+
+
+##############################################################################
+# Offline jobs (run with `flask <command>`)
+
+
+@click.command('recommend')
+@click.option('--top', default=10, help='Suggestions to keep per user.')
+@click.option('--max-fanout', default=100,
+              help='Cap on edges expanded per intermediate user or message.')
+@with_appcontext
+def recommend_command(top, max_fanout):
+    """Recompute "who to follow" suggestions for every user."""
+
+    written = refresh_recommendations(top_n=top, max_fanout=max_fanout)
+    click.echo(f"Wrote {written} recommendations.")
+
+
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates_command():
+    """Compile every template into the bytecode cache."""
+
+    if not current_app.config['TEMPLATE_CACHE_DIR']:
+        raise click.UsageError("Set TEMPLATE_CACHE_DIR to compile templates.")
+
+    names = warm_templates()
+    click.echo(f"Compiled {len(names)} templates "
+               f"into {current_app.config['TEMPLATE_CACHE_DIR']}.")
+
+
+def warm_templates():
+    """Load every template into the environment's cache.
+
+    Templates come from the bytecode cache when one is configured, so this
+    only compiles what is missing or stale. Returns the template names.
+    """
+
+    names = current_app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        current_app.jinja_env.get_template(name)
+    return names
+
+
+@click.group('partitions')
+def partitions_command():
+    """Inspect and archive monthly message partitions."""
+
+
+@partitions_command.command('list')
+@with_appcontext
+def list_partitions_command():
+    """Show live and archived months."""
+
+    for month, count in live_months():
+        click.echo(f"{month}  live      {count:>8} messages")
+    for month, ids in sorted(read_manifest().items()):
+        click.echo(f"{month}  archived  {len(ids):>8} messages")
+
+
+@partitions_command.command('archive')
+@click.option('--before', required=True, metavar='YYYY-MM',
+              help='Archive every month before this one.')
+@with_appcontext
+def archive_partitions_command(before):
+    """Move old months of messages to compressed archive files."""
+
+    try:
+        parse_month(before)
+    except ValueError:
+        raise click.BadParameter("expected YYYY-MM", param_hint='--before')
+
+    archived = archive_before(before)
+    for month, count in archived.items():
+        click.echo(f"Archived {count} messages from {month}.")
+    if not archived:
+        click.echo("Nothing to archive.")
+
+
+@click.group('timeline')
+def timeline_command():
+    """Manage pushed home timelines."""
+
+
+@timeline_command.command('rebuild')
+@with_appcontext
+def rebuild_timeline_command():
+    """Recompute every pushed timeline from follows and messages."""
+
+    rows = rebuild_timelines()
+    click.echo(f"Wrote {rows} timeline entries.")
+
+
+@click.group('ids')
+def ids_command():
+    """Manage time-ordered message ids."""
+
+
+@ids_command.command('migrate')
+@click.option('--batch-size', default=1000, help='Messages renumbered per transaction.')
+@with_appcontext
+def migrate_ids_command(batch_size):
+    """Move messages with old serial ids to time-ordered ids."""
+
+    if upgrade_schema():
+        click.echo("Upgraded id columns to BIGINT.")
+
+    click.echo(f"{legacy_count()} messages have serial ids.")
+    moved = renumber_legacy_ids(batch_size=batch_size)
+    click.echo(f"Renumbered {moved} messages.")
+
+
+@click.group('shards')
+def shards_command():
+    """Manage message shards (see shards.py)."""
+
+
+@shards_command.command('init')
+@with_appcontext
+def init_shards_command():
+    """Create the messages and likes tables on every shard."""
+
+    shards = message_shards()
+    if shards is None:
+        raise click.ClickException("MESSAGE_SHARDS is not set.")
+    shards.create_all()
+    click.echo(f"Created tables on {len(shards.engines)} shards.")
+
+
+@click.group('assets')
+def assets_command():
+    """Manage built static assets."""
+
+
+@assets_command.command('build')
+@with_appcontext
+def build_assets_command():
+    """Fingerprint, minify and precompress everything under static/."""
+
+    assets = current_app.extensions['assets']
+    manifest = assets.build()
+    click.echo(f"Built {len(manifest)} assets into {assets.build_dir}.")
+
+
+@assets_command.command('prune')
+@with_appcontext
+def prune_assets_command():
+    """Delete built files the current manifest no longer names.
+
+    Run once every worker has restarted after `flask assets build`.
+    """
+
+    removed = current_app.extensions['assets'].prune()
+    click.echo(f"Removed {removed} old asset files.")
+
+
+@click.group('likes')
+def likes_command():
+    """Manage the likes table."""
+
+
+@likes_command.command('migrate')
+@with_appcontext
+def migrate_likes_command():
+    """Move the likes table to its (user_id, message_id) primary key."""
+
+    kept = migrate_likes()
+    if kept is None:
+        click.echo("Likes are already keyed by user and message.")
+    else:
+        click.echo(f"Rebuilt likes with {kept} likes.")
+
+
+@click.group('tags')
+def tags_command():
+    """Manage the #tag and @mention index (see tags.py)."""
+
+
+@tags_command.command('backfill')
+@click.option('--chunk-size', default=5000, help='Messages indexed per transaction.')
+@click.option('--workers', default=4, help='Chunks indexed at once.')
+@with_appcontext
+def backfill_tags_command(chunk_size, workers):
+    """Index the tags and mentions of every message."""
+
+    messages, rows = backfill_tags(chunk_size=chunk_size, workers=workers)
+    click.echo(f"Indexed {rows} tags and mentions in {messages} messages.")
+
+
 ##############################################################################
 # Turn off all caching in Flask
 #   (useful for dev; in production, this kind of stuff is typically
@@ -359,10 +824,15 @@ def homepage():
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
-@app.after_request
+@bp.after_app_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers on every request.
+
+    Responses that can be cached forever (image thumbnails) keep theirs.
+    """
 
+    if req.headers.get('Cache-Control') == IMMUTABLE_CACHE_CONTROL:
+        return req
     req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     req.headers["Pragma"] = "no-cache"
     req.headers["Expires"] = "0"
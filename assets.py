@@ -0,0 +1,211 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask assets build` copies everything under static/ into
+ASSET_BUILD_DIR with a hash of its content in its name
+(stylesheets/style.3f2a9c1d0b7e.css), minifying CSS and pointing its
+url(/static/...) references at the built files. Compressible files also
+get .gz and, with the optional `brotli` package, .br variants, written
+once at build time at the highest levels. manifest.json maps each source
+path to its built name.
+
+A build never removes files, so workers still on the previous manifest
+keep serving the files it names; each file and the manifest are written
+under a temporary name and renamed into place. Once every worker has
+restarted on the new manifest, `flask assets prune` deletes the built
+files it doesn't name.
+
+Templates link assets with `asset_url('stylesheets/style.css')`, which
+gives /assets/<built name> once a manifest exists, and the plain /static
+URL before (e.g. in development). As a built name changes whenever its
+content does, /assets responses are cached forever
+(IMMUTABLE_CACHE_CONTROL); each is sent in the best encoding the client
+accepts that was built for it.
+"""
+
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import request, send_file
+from werkzeug.security import safe_join
+
+from compression import ENCODINGS, SUFFIXES, choose_encoding, compress, compressible
+from images import IMMUTABLE_CACHE_CONTROL
+
+MANIFEST = 'manifest.json'
+STATIC_PREFIX = '/static/'
+FINGERPRINT_LENGTH = 12
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s+')
+CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+# only after colons: a space before one can be a descendant selector
+CSS_COLON = re.compile(r':\s+')
+CSS_URL = re.compile(r'''url\(\s*(['"]?)(/static/[^'")]+)\1\s*\)''')
+
+
+def minify_css(css):
+    """`css` without comments and unneeded whitespace."""
+
+    css = CSS_COMMENT.sub('', css)
+    css = CSS_SPACE.sub(' ', css)
+    css = CSS_PUNCTUATION.sub(r'\1', css)
+    css = CSS_COLON.sub(':', css)
+    return css.replace(';}', '}').strip()
+
+
+def fingerprinted(path, data):
+    """`path` with a hash of `data` before its extension."""
+
+    root, ext = os.path.splitext(path)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]}{ext}'
+
+
+def source_files(static_dir):
+    """Paths under `static_dir`, relative and with '/' separators, CSS last.
+
+    CSS goes last so the files it refers to have been named.
+    """
+
+    paths = []
+    for root, _, names in os.walk(static_dir):
+        for name in names:
+            path = os.path.relpath(os.path.join(root, name), static_dir)
+            paths.append(path.replace(os.sep, '/'))
+    return sorted(paths, key=lambda path: (path.endswith('.css'), path))
+
+
+def write_file(path, data):
+    """Write `data` to `path` so readers only ever see the whole file."""
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def build_assets(static_dir, build_dir):
+    """Write the built assets and manifest; returns the manifest."""
+
+    manifest = {}
+    for path in source_files(static_dir):
+        with open(os.path.join(static_dir, path), 'rb') as f:
+            data = f.read()
+
+        if path.endswith('.css'):
+            css = CSS_URL.sub(
+                lambda match: f'url({asset_path(manifest, match.group(2))})',
+                data.decode())
+            data = minify_css(css).encode()
+
+        built = fingerprinted(path, data)
+        manifest[path] = built
+
+        variants = {'': data}
+        if compressible(mimetypes.guess_type(path)[0]):
+            for encoding in ENCODINGS:
+                encoded = compress(data, encoding)
+                if len(encoded) < len(data):
+                    variants[SUFFIXES[encoding]] = encoded
+
+        target = os.path.join(build_dir, built)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        for suffix, content in variants.items():
+            write_file(target + suffix, content)
+
+    write_file(os.path.join(build_dir, MANIFEST),
+               json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def prune_assets(build_dir, manifest):
+    """Delete built files `manifest` doesn't name; returns how many."""
+
+    keep = {MANIFEST}
+    for built in manifest.values():
+        keep.add(built)
+        keep.update(built + suffix for suffix in SUFFIXES.values())
+
+    removed = 0
+    for root, _, names in os.walk(build_dir, topdown=False):
+        for name in names:
+            path = os.path.relpath(os.path.join(root, name), build_dir)
+            if path.replace(os.sep, '/') not in keep:
+                os.remove(os.path.join(root, name))
+                removed += 1
+        if root != build_dir and not os.listdir(root):
+            os.rmdir(root)
+    return removed
+
+
+def asset_path(manifest, url):
+    """The URL of the built file for a /static URL, or the URL itself."""
+
+    if not url.startswith(STATIC_PREFIX):
+        return url
+    built = manifest.get(url[len(STATIC_PREFIX):])
+    return f'/assets/{built}' if built else url
+
+
+class Assets:
+    """Flask extension serving built assets and linking to them."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.build_dir = os.path.join(app.root_path, app.config['ASSET_BUILD_DIR'])
+        self.static_dir = app.static_folder
+        self.load_manifest()
+        app.add_template_global(self.url_for, 'asset_url')
+        app.extensions['assets'] = self
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.build_dir, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def build(self):
+        self.manifest = build_assets(self.static_dir, self.build_dir)
+        return self.manifest
+
+    def prune(self):
+        self.load_manifest()
+        return prune_assets(self.build_dir, self.manifest)
+
+    def url_for(self, path):
+        """URL of the static file at `path` (relative to static/)."""
+
+        return asset_path(self.manifest, STATIC_PREFIX + path)
+
+    def static_url(self, url):
+        """The built file's URL for a /static URL; other URLs unchanged."""
+
+        return asset_path(self.manifest, url)
+
+    def response(self, filename):
+        """The built file, in the best encoding the request accepts, or None."""
+
+        path = safe_join(self.build_dir, filename)
+        if path is None or filename == MANIFEST or not os.path.isfile(path):
+            return None
+
+        available = [encoding for encoding in ENCODINGS
+                     if os.path.isfile(path + SUFFIXES[encoding])]
+        encoding = choose_encoding(request.accept_encodings, available)
+
+        response = send_file(path + SUFFIXES[encoding] if encoding else path,
+                             mimetype=mimetypes.guess_type(filename)[0]
+                             or 'application/octet-stream',
+                             conditional=True)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if available:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
@@ -0,0 +1,204 @@
+"""Username and email availability, checked against a Bloom filter first.
+
+Signing up or renaming to a taken username or email used to be found out
+by the unique constraints, after hashing the password and trying the
+commit. Now each worker keeps a Bloom filter of every username and email
+in use. A value the filter doesn't contain is certainly free (as of the
+filter's last update), with no query at all; one it may contain is
+confirmed with an indexed lookup, since about
+AVAILABILITY_FALSE_POSITIVE_RATE of free values also look taken.
+
+The filter is built from the users table on first use (or by preload.py
+before workers fork), sized for twice the current users. Users inserted,
+renamed or deleted through the ORM in this process are applied straight
+away (see the mapper events at the bottom). A Bloom filter can't forget,
+so old names of renamed and deleted users stay in it until the filter is
+rebuilt; that happens after AVAILABILITY_REBUILD_SECONDS, when they make
+up a tenth of its entries, or when it fills up. Signups by other workers
+are picked up every AVAILABILITY_SYNC_SECONDS by reading users with
+higher ids; renames in other workers only at the next rebuild. In those
+windows the unique constraints still catch a duplicate, as before.
+"""
+
+import hashlib
+import math
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, inspect
+
+from models import db, User
+
+FIELDS = ('username', 'email')
+
+
+class BloomFilter:
+    """Set membership with false positives but no false negatives."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, value):
+        # double hashing: position i is h1 + i * h2
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.array[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(value))
+
+
+def key(field, value):
+    return f'{field}:{value}'
+
+
+class Availability:
+    """Flask extension holding this worker's filter of names in use."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.error_rate = config['AVAILABILITY_FALSE_POSITIVE_RATE']
+        self.sync_seconds = config['AVAILABILITY_SYNC_SECONDS']
+        self.rebuild_seconds = config['AVAILABILITY_REBUILD_SECONDS']
+        self.lock = threading.RLock()
+        self.filter = None
+        self.stale = 0
+        self.stats = {'checks': 0, 'queries': 0, 'false_positives': 0}
+        app.extensions['availability'] = self
+
+    def build(self):
+        """Fill a new filter from the users table."""
+
+        with self.lock:
+            rows = db.session.query(User.id, User.username, User.email).all()
+            bloom = BloomFilter(max(1024, 2 * len(rows) * len(FIELDS)), self.error_rate)
+            for _, username, email in rows:
+                bloom.add(key('username', username))
+                bloom.add(key('email', email))
+
+            self.filter = bloom
+            self.last_id = max((row.id for row in rows), default=0)
+            self.stale = 0
+            self.built_at = self.synced_at = time.monotonic()
+
+    def sync(self):
+        """Build or rebuild the filter if due, or add other workers' signups."""
+
+        with self.lock:
+            now = time.monotonic()
+            if (self.filter is None
+                    or now - self.built_at > self.rebuild_seconds
+                    or self.stale > self.filter.count / 10
+                    or self.filter.count > self.filter.capacity):
+                self.build()
+            elif now - self.synced_at > self.sync_seconds:
+                new = (db.session.query(User.id, User.username, User.email)
+                       .filter(User.id > self.last_id))
+                for user_id, username, email in new:
+                    self.add(username, email)
+                    self.last_id = max(self.last_id, user_id)
+                self.synced_at = now
+
+    def add(self, username=None, email=None):
+        with self.lock:
+            if self.filter is None:
+                return
+            if username is not None:
+                self.filter.add(key('username', username))
+            if email is not None:
+                self.filter.add(key('email', email))
+
+    def forget(self, entries):
+        """Count `entries` values as no longer in use, towards a rebuild."""
+
+        with self.lock:
+            self.stale += entries
+
+    def is_taken(self, field, value):
+        """Is `value` in use as some user's `field` ('username' or 'email')?"""
+
+        self.sync()
+        self.stats['checks'] += 1
+        if key(field, value) not in self.filter:
+            return False
+
+        self.stats['queries'] += 1
+        column = getattr(User, field)
+        taken = db.session.query(db.session.query(User.id)
+                                 .filter(column == value).exists()).scalar()
+        if not taken:
+            self.stats['false_positives'] += 1
+        return taken
+
+
+def availability():
+    return current_app.extensions['availability']
+
+
+def check_form(form, user=None):
+    """Add errors to `form` for a username or email already in use.
+
+    `user` is the one being edited, whose own values are fine. Returns
+    True if both are available.
+    """
+
+    available = True
+    for field in FIELDS:
+        value = getattr(form, field).data
+        if user is not None and value == getattr(user, field):
+            continue
+        if availability().is_taken(field, value):
+            getattr(form, field).errors.append(f"That {field} is already taken.")
+            available = False
+    return available
+
+
+##############################################################################
+# Keeping the filter current
+
+
+def current_availability():
+    return db.get_app().extensions.get('availability')
+
+
+@event.listens_for(User, 'after_insert')
+def user_added(mapper, connection, user):
+    index = current_availability()
+    if index is not None:
+        index.add(user.username, user.email)
+
+
+@event.listens_for(User, 'after_update')
+def user_changed(mapper, connection, user):
+    index = current_availability()
+    if index is None:
+        return
+    state = inspect(user)
+    for field in FIELDS:
+        history = state.attrs[field].history
+        if history.has_changes():
+            index.add(**{field: getattr(user, field)})
+            index.forget(len(history.deleted or ()))
+
+
+@event.listens_for(User, 'after_delete')
+def user_deleted(mapper, connection, user):
+    index = current_availability()
+    if index is not None:
+        index.forget(len(FIELDS))
@@ -0,0 +1,98 @@
+"""Compare one sync worker with one cooperative (gevent) worker.
+
+Run from the project root, against a seeded Postgres database:
+
+    DATABASE_URL=postgresql:///warbler python benchmarks/bench_async.py
+
+Starts each server in its own process on a local port, then fires GET
+requests at the read routes from N concurrent clients and reports
+throughput and latency percentiles per concurrency level. The sync server
+handles one request at a time, like a sync gunicorn worker; the async one
+is serve_async.py.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, islice
+from urllib.error import URLError
+from urllib.request import urlopen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SYNC_SERVER = """
+import sys
+from werkzeug.serving import run_simple
+from wsgi import app
+run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=False)
+"""
+
+PATHS = ['/users', '/users/1', '/users/2', '/users?q=a']
+REQUESTS_PER_LEVEL = 400
+CONCURRENCY = (1, 10, 50, 100)
+
+
+def start(mode, port):
+    env = dict(os.environ, WARBLER_ENV='production')
+    if mode == 'sync':
+        cmd = [sys.executable, '-c', SYNC_SERVER, str(port)]
+    else:
+        cmd = [sys.executable, 'serve_async.py', '--port', str(port)]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    for _ in range(100):
+        try:
+            urlopen(f'http://127.0.0.1:{port}/users', timeout=1).read()
+            return proc
+        except (URLError, ConnectionError):
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def fetch(url):
+    start = time.perf_counter()
+    try:
+        urlopen(url, timeout=30).read()
+        ok = True
+    except (URLError, ConnectionError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def load(port, concurrency):
+    urls = [f'http://127.0.0.1:{port}{path}'
+            for path in islice(cycle(PATHS), REQUESTS_PER_LEVEL)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(fetch, urls))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(seconds for seconds, ok in results if ok)
+    errors = sum(1 for _, ok in results if not ok)
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+    return (len(latencies) / elapsed,
+            statistics.median(latencies) if latencies else 0, p99, errors)
+
+
+def main():
+    print(f"{'mode':<7}{'clients':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for port, mode in ((5101, 'sync'), (5102, 'async')):
+        proc = start(mode, port)
+        try:
+            for concurrency in CONCURRENCY:
+                rps, p50, p99, errors = load(port, concurrency)
+                print(f"{mode:<7}{concurrency:>8}{rps:>9.0f}"
+                      f"{p50 * 1000:>9.1f}{p99 * 1000:>9.1f}{errors:>8}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""CPU cost vs bytes saved when compressing our typical pages.
+
+Run from the project root:
+
+    python benchmarks/bench_compression.py
+
+Uses DATABASE_URL if set, otherwise a throwaway SQLite file with synthetic
+users, messages and likes. Renders the home page, the user listing and a
+likes page (100 messages / 300 users) uncompressed, then compresses each
+body with gzip at several levels, gzip the way streamed pages are sent
+(flushed every 4 KiB), and brotli if the `brotli` package is installed.
+Reports compressed size, bytes saved and CPU time per page.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+import gzip
+
+from app import create_app, CURR_USER_KEY
+from compression import brotli, gzip_chunks
+from models import db, User, Message, Follows, Likes
+from timeline import rebuild_timelines
+
+app = create_app()
+app.config.update(RATE_LIMIT_ENABLED=False, PAGE_CACHE_ENABLED=False,
+                  COMPRESS_ENABLED=False)
+
+N_USERS = 300
+N_MESSAGES = 3000
+ROUNDS = 50
+PATHS = ['/', '/users', '/users/1/likes']
+CHUNK = 4096
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    db.session.bulk_insert_mappings(User, [
+        dict(id=n, email=f"user{n}@bench.test", username=f"user{n}", password="x",
+             image_url=f"https://randomuser.me/api/portraits/men/{n % 100}.jpg",
+             bio=f"Bio of user {n}")
+        for n in range(1, N_USERS + 1)
+    ])
+    db.session.bulk_insert_mappings(Message, [
+        dict(text=f"Warble number {n}, about nothing much", user_id=n % 50 + 1)
+        for n in range(N_MESSAGES)
+    ])
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_being_followed_id=n, user_following_id=1) for n in range(2, 51)
+    ])
+    db.session.commit()
+    ids = [message_id for message_id, in db.session.query(Message.id).limit(100)]
+    db.session.bulk_insert_mappings(Likes, [
+        dict(user_id=1, message_id=message_id) for message_id in ids
+    ])
+    db.session.commit()
+    rebuild_timelines()
+
+
+def streamed_gzip(data, level):
+    chunks = (data[i:i + CHUNK] for i in range(0, len(data), CHUNK))
+    return b''.join(gzip_chunks(chunks, level))
+
+
+METHODS = [
+    ('gzip 1', lambda data: gzip.compress(data, 1, mtime=0)),
+    ('gzip 6', lambda data: gzip.compress(data, 6, mtime=0)),
+    ('gzip 9', lambda data: gzip.compress(data, 9, mtime=0)),
+    ('gzip 6 streamed', lambda data: streamed_gzip(data, 6)),
+]
+if brotli is not None:
+    METHODS += [
+        ('brotli 5', lambda data: brotli.compress(data, quality=5)),
+        ('brotli 11', lambda data: brotli.compress(data, quality=11)),
+    ]
+
+
+def main():
+    with app.app_context():
+        seed()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = 1
+
+    for path in PATHS:
+        data = client.get(path).get_data()
+        print(f"{path}: {len(data):,} bytes")
+        for label, method in METHODS:
+            start = time.process_time()
+            for _ in range(ROUNDS):
+                compressed = method(data)
+            cpu = (time.process_time() - start) / ROUNDS
+            saved = 1 - len(compressed) / len(data)
+            print(f"  {label:<16} {len(compressed):>8,} bytes  "
+                  f"{saved:6.1%} saved  {cpu * 1000:6.2f} ms CPU")
+
+
+if __name__ == '__main__':
+    main()
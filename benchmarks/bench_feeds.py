@@ -0,0 +1,117 @@
+"""CPU and allocations per feed page: ORM instances vs read models.
+
+Run from the project root:
+
+    python benchmarks/bench_feeds.py
+
+Uses DATABASE_URL if set, otherwise a throwaway SQLite file, fills it with
+synthetic users and messages, then loads and renders a 100-message page
+(`message_list`) two ways:
+
+- orm: Message instances with their User joined in, as feeds used to
+- read model: a Core query into FeedMessages (feeds.py)
+
+reporting CPU time per page, and the memory allocated while building the
+page (tracemalloc peak) and still held by its messages afterwards.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+from flask import g
+from sqlalchemy.orm import joinedload
+
+from app import create_app
+from feeds import feed_select, load_feed
+from models import db, User, Message
+
+app = create_app()
+
+N_USERS = 50
+N_MESSAGES = 5000
+PAGE_SIZE = 100
+N_PAGES = 200
+
+MESSAGE_LIST = """
+{% import 'macros.html' as macros %}
+{{ macros.message_list(messages, '/') }}
+"""
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    db.session.bulk_insert_mappings(User, [
+        dict(id=n, email=f"user{n}@bench.test", username=f"user{n}", password="x")
+        for n in range(1, N_USERS + 1)
+    ])
+    db.session.bulk_insert_mappings(Message, [
+        dict(text=f"Warble number {n}", user_id=n % N_USERS + 1)
+        for n in range(N_MESSAGES)
+    ])
+    db.session.commit()
+
+
+def orm_page():
+    return (Message
+            .query
+            .options(joinedload(Message.user))
+            .order_by(Message.id.desc())
+            .limit(PAGE_SIZE)
+            .all())
+
+
+def read_model_page():
+    return load_feed(feed_select().order_by(Message.id.desc()).limit(PAGE_SIZE))
+
+
+def measure(load, template):
+    def page():
+        messages = load()
+        template.render(messages=messages)
+        db.session.remove()
+        return messages
+
+    page()
+
+    start = time.process_time()
+    for _ in range(N_PAGES):
+        page()
+    cpu = (time.process_time() - start) / N_PAGES
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    messages = load()
+    template.render(messages=messages)
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.remove()
+
+    return cpu, peak - base, held - base
+
+
+def main():
+    with app.app_context():
+        seed()
+        template = app.jinja_env.from_string(MESSAGE_LIST)
+
+        with app.test_request_context('/'):
+            g.user = None
+            for label, load in (('orm', orm_page), ('read model', read_model_page)):
+                cpu, peak, held = measure(load, template)
+                print(f"{label:<11} {cpu * 1000:7.2f} ms CPU/page  "
+                      f"{peak / 1024:8.1f} KiB allocated  "
+                      f"{held / 1024:8.1f} KiB held")
+
+
+if __name__ == '__main__':
+    main()
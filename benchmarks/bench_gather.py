@@ -0,0 +1,104 @@
+"""Profile and home page latency with queries run serially and in parallel.
+
+Run from the project root:
+
+    python benchmarks/bench_gather.py [round trip ms]
+
+Uses DATABASE_URL if set, otherwise a throwaway SQLite file, fills it with
+synthetic users and messages, then requests the profile and home pages
+with PARALLEL_QUERIES off and on, reporting median and 95th percentile
+latency. A local database answers in microseconds, which hides what
+overlapping queries saves; the optional argument adds that many
+milliseconds to every statement, like a database across a network.
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+from sqlalchemy import event
+
+from app import create_app, CURR_USER_KEY
+from models import db, User, Message, Follows
+from timeline import rebuild_timelines
+
+app = create_app()
+app.config['RATE_LIMIT_ENABLED'] = False
+
+N_USERS = 500
+N_MESSAGES = 5000
+N_REQUESTS = 50
+PATHS = ['/users/1', '/']
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    db.session.bulk_insert_mappings(User, [
+        dict(id=n, email=f"user{n}@bench.test", username=f"user{n}", password="x")
+        for n in range(1, N_USERS + 1)
+    ])
+    db.session.bulk_insert_mappings(Message, [
+        dict(text=f"Warble number {n}", user_id=n % 50 + 1)
+        for n in range(N_MESSAGES)
+    ])
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_being_followed_id=n, user_following_id=1)
+        for n in range(2, 51)
+    ] + [
+        dict(user_being_followed_id=1, user_following_id=n)
+        for n in range(2, N_USERS + 1)
+    ])
+    db.session.commit()
+    rebuild_timelines()
+
+
+def add_round_trip(seconds):
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def delay(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(seconds)
+
+
+def measure(client, path):
+    times = []
+    for _ in range(N_REQUESTS):
+        start = time.perf_counter()
+        resp = client.get(path)
+        times.append(time.perf_counter() - start)
+        assert resp.status_code == 200, resp.status_code
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.95) - 1]
+
+
+def main():
+    round_trip = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0
+
+    with app.app_context():
+        seed()
+        if round_trip:
+            add_round_trip(round_trip)
+
+    print(f"{'page':<12}{'mode':<10}{'p50 ms':>9}{'p95 ms':>9}")
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+        for path in PATHS:
+            for parallel in (False, True):
+                app.config['PARALLEL_QUERIES'] = parallel
+                client.get(path)
+                p50, p95 = measure(client, path)
+                mode = 'parallel' if parallel else 'serial'
+                print(f"{path:<12}{mode:<10}{p50 * 1000:>9.1f}{p95 * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Throughput of in-process message ids against a database sequence.
+
+Run from the project root:
+
+    python benchmarks/bench_ids.py
+
+Reports ids per second from one SnowflakeGenerator called from 1, 4 and 16
+threads, from four generators (separate nodes) called from four threads,
+and, for comparison, from inserting rows into a table with an
+autoincrementing key (DATABASE_URL if set, otherwise a throwaway SQLite
+file), which is what a serial id costs.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine
+
+from snowflake import SnowflakeGenerator
+
+N_IDS = 400_000
+N_ROWS = 5_000
+
+
+def threaded(generators, n_threads, n_ids):
+    """Ids per second with n_threads sharing the generators round-robin."""
+
+    per_thread = n_ids // n_threads
+    ids = [None] * n_threads
+
+    def work(slot):
+        next_id = generators[slot % len(generators)].next_id
+        ids[slot] = [next_id() for _ in range(per_thread)]
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(n_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    unique = len({i for chunk in ids for i in chunk})
+    assert unique == per_thread * n_threads, "duplicate ids"
+    return unique / elapsed
+
+
+def database_sequence():
+    url = os.environ.get(
+        'DATABASE_URL',
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    engine = create_engine(url)
+    metadata = MetaData()
+    table = Table('bench_ids', metadata, Column('id', Integer, primary_key=True))
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    try:
+        with engine.connect() as connection:
+            start = time.perf_counter()
+            for _ in range(N_ROWS):
+                connection.execute(table.insert()).inserted_primary_key
+            return N_ROWS / (time.perf_counter() - start)
+    finally:
+        metadata.drop_all(engine)
+
+
+def main():
+    print(f"{'source':<34}{'ids/sec':>14}")
+    one = SnowflakeGenerator(node_id=1)
+    for n_threads in (1, 4, 16):
+        rate = threaded([one], n_threads, N_IDS)
+        print(f"{f'snowflake, {n_threads} thread(s)':<34}{rate:>14,.0f}")
+
+    nodes = [SnowflakeGenerator(node_id=n) for n in range(4)]
+    rate = threaded(nodes, 4, N_IDS)
+    print(f"{'snowflake, 4 nodes x 1 thread':<34}{rate:>14,.0f}")
+
+    print(f"{'database autoincrement insert':<34}{database_sequence():>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
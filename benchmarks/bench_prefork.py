@@ -0,0 +1,131 @@
+"""Per-worker memory of forked workers, with and without preloading.
+
+Run from the project root (Linux only, it reads /proc):
+
+    python benchmarks/bench_prefork.py
+
+Uses DATABASE_URL if set, otherwise a throwaway SQLite file with synthetic
+users and messages. For each mode a fresh master process forks WORKERS
+workers, like a pre-fork server:
+
+- lazy: each worker builds the app itself after the fork (no --preload)
+- preload: the master builds it with WARBLER_PRELOAD=1 (see preload.py)
+  and workers inherit it
+
+Each worker then serves REQUESTS profile and home page requests, and the
+master reports the workers' average RSS, PSS (shared pages split between
+the processes sharing them) and private memory from smaps_rollup.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKERS = 4
+REQUESTS = 20
+FIELDS = ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty')
+
+
+def seed():
+    from app import create_app
+    from models import db, User, Message
+    from timeline import rebuild_timelines
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.bulk_insert_mappings(User, [
+            dict(id=n, email=f"user{n}@bench.test", username=f"user{n}", password="x")
+            for n in range(1, 101)
+        ])
+        db.session.bulk_insert_mappings(Message, [
+            dict(text=f"Warble number {n}", user_id=n % 100 + 1)
+            for n in range(2000)
+        ])
+        db.session.commit()
+        rebuild_timelines()
+
+
+def smaps(pid):
+    """{field: kB} from /proc/<pid>/smaps_rollup."""
+
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in FIELDS:
+                values[name] = int(rest.split()[0])
+    return values
+
+
+def serve(app):
+    from app import CURR_USER_KEY
+
+    app.config['RATE_LIMIT_ENABLED'] = False
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = 1
+    for _ in range(REQUESTS):
+        client.get('/users/1')
+        client.get('/')
+
+
+def master(mode):
+    """Fork the workers, serve, and print their average memory."""
+
+    app = None
+    if mode == 'preload':
+        os.environ['WARBLER_PRELOAD'] = '1'
+        from wsgi import app
+
+    workers = []
+    for _ in range(WORKERS):
+        ready_r, ready_w = os.pipe()
+        done_r, done_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            if app is None:
+                from wsgi import app
+            serve(app)
+            os.write(ready_w, b'.')
+            os.read(done_r, 1)
+            os._exit(0)
+        workers.append((pid, ready_r, done_w))
+
+    usage = []
+    for pid, ready_r, _ in workers:
+        os.read(ready_r, 1)
+    for pid, _, _ in workers:
+        usage.append(smaps(pid))
+    for pid, _, done_w in workers:
+        os.write(done_w, b'.')
+        os.waitpid(pid, 0)
+
+    average = {field: sum(u[field] for u in usage) / len(usage) / 1024
+               for field in FIELDS}
+    private = average['Private_Clean'] + average['Private_Dirty']
+    print(f"{mode:<8} RSS {average['Rss']:6.1f} MiB  PSS {average['Pss']:6.1f} MiB  "
+          f"private {private:6.1f} MiB  per worker, {WORKERS} workers")
+
+
+def main():
+    os.environ.setdefault(
+        'DATABASE_URL',
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    os.environ['WARBLER_ENV'] = 'production'
+    seed()
+
+    for mode in ('lazy', 'preload'):
+        subprocess.run([sys.executable, __file__, mode], cwd=ROOT, check=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        master(sys.argv[1])
+    else:
+        main()
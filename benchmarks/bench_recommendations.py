@@ -0,0 +1,46 @@
+"""Time the who-to-follow scoring on synthetic graphs of growing size.
+
+Run from the project root:
+
+    python benchmarks/bench_recommendations.py
+
+Follows are drawn from a skewed (Zipf-like) distribution, so a few accounts
+have very large follower counts. With the per-row fan-out cap the time per
+edge should stay roughly flat as the graph grows.
+"""
+
+import os
+import sys
+import time
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recommendations import compute_recommendations
+
+
+def skewed_edges(rng, n_users, n_edges):
+    """(src, dst) pairs where dst is biased towards low ids (celebrities)."""
+
+    return [(rng.randrange(n_users), int(n_users * rng.random() ** 3))
+            for _ in range(n_edges)]
+
+
+def main():
+    rng = Random(0)
+    print(f"{'edges':>10} {'seconds':>10} {'us/edge':>10}")
+
+    for n_edges in (10_000, 50_000, 100_000, 200_000, 400_000):
+        n_users = n_edges // 10
+        follows = skewed_edges(rng, n_users, n_edges)
+        likes = skewed_edges(rng, n_users, n_edges // 2)
+
+        start = time.perf_counter()
+        compute_recommendations(follows, likes, top_n=10, max_fanout=50)
+        elapsed = time.perf_counter() - start
+
+        print(f"{n_edges:>10} {elapsed:>10.3f} {elapsed / n_edges * 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""How many open /stream subscribers one cooperative worker holds.
+
+Run from the project root (Linux only, it reads /proc):
+
+    python benchmarks/bench_sse.py
+
+Needs the optional `gevent` and `psycogreen` packages, like
+serve_async.py. Uses DATABASE_URL if set, otherwise a throwaway SQLite
+file, with one author followed by LEVELS[-1] readers. For each level the
+benchmark serves the app from serve_async.py on gevent in this process,
+connects that many readers to /stream (each from its own greenlet), then
+publishes MESSAGES messages by the author and reports:
+
+- memory held per open stream (RSS growth over connecting them all);
+- how long each message took to reach every stream (median and slowest).
+
+Connecting and reading happen in the same process as the server, so the
+numbers are a floor for a worker that also does the clients' share.
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the benchmark posts in the same process that holds the streams
+os.environ.setdefault('REALTIME_SINGLE_PROCESS', '1')
+os.environ.setdefault(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+from app import CURR_USER_KEY
+from models import db, User, Follows
+from serve_async import create_async_app
+
+LEVELS = (100, 1000, 5000)
+MESSAGES = 20
+
+app = create_async_app()
+app.config.update(RATE_LIMIT_ENABLED=False, PAGE_CACHE_ENABLED=False)
+app.logger.disabled = True
+
+
+def seed(readers):
+    db.drop_all()
+    db.create_all()
+    db.session.bulk_insert_mappings(User, [
+        dict(id=n, email=f"user{n}@bench.test", username=f"user{n}", password="x")
+        for n in range(1, readers + 2)
+    ])
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_being_followed_id=1, user_following_id=n)
+        for n in range(2, readers + 2)
+    ])
+    db.session.commit()
+
+
+def rss_kib():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+class Reader:
+    """One browser tab with the home page open."""
+
+    def __init__(self, port, user_id, cookie):
+        self.received = {}
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.sendall((f"GET /stream HTTP/1.1\r\nHost: bench\r\n"
+                           f"Cookie: session={cookie}\r\n\r\n").encode())
+        self.buffer = b''
+        while b'retry:' not in self.buffer:
+            self.read()
+        self.status = self.buffer.split(b' ', 2)[1]
+
+    def read(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("stream closed")
+        self.buffer += data
+        return data
+
+    def listen(self):
+        while True:
+            data = self.read()
+            now = time.perf_counter()
+            for line in data.split(b'\n'):
+                if line.startswith(b'id: '):
+                    self.received[int(line[4:])] = now
+
+
+def run(level, port):
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookies = {n: serializer.dumps({CURR_USER_KEY: n}) for n in range(2, level + 2)}
+
+    before = rss_kib()
+    readers = [Reader(port, n, cookie) for n, cookie in cookies.items()]
+    assert all(reader.status == b'200' for reader in readers), "stream refused"
+    listeners = [gevent.spawn(reader.listen) for reader in readers]
+    gevent.sleep(0.5)
+    per_stream = (rss_kib() - before) / level
+
+    realtime = app.extensions['realtime']
+    with app.app_context():
+        author = User.query.get(1)
+        sent = {}
+        for n in range(1, MESSAGES + 1):
+            message_id = n << 22
+            sent[message_id] = time.perf_counter()
+            realtime.publish_message(author, message_id, f"Message {n} #bench")
+            gevent.sleep(0.05)
+
+    deadline = time.perf_counter() + 30
+    while (time.perf_counter() < deadline
+           and any(len(reader.received) < MESSAGES for reader in readers)):
+        gevent.sleep(0.1)
+
+    latencies = [max(reader.received.get(message_id, float('inf')) for reader in readers)
+                 - sent_at
+                 for message_id, sent_at in sent.items()]
+    missing = sum(MESSAGES - len(reader.received) for reader in readers)
+
+    gevent.killall(listeners)
+    for reader in readers:
+        reader.sock.close()
+    while realtime.hub.count:
+        gevent.sleep(0.1)
+
+    print(f"{level:>6} streams: {per_stream:6.1f} KiB each, "
+          f"to every stream in {statistics.median(latencies) * 1000:7.1f} ms median, "
+          f"{max(latencies) * 1000:7.1f} ms slowest"
+          + (f", {missing} events missing" if missing else ""))
+
+
+def main():
+    with app.app_context():
+        seed(LEVELS[-1])
+    app.extensions['realtime'].hub.max_subscribers = LEVELS[-1]
+
+    server = WSGIServer(('127.0.0.1', 0), app, log=None, error_log=None)
+    server.start()
+    try:
+        for level in LEVELS:
+            run(level, server.server_port)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
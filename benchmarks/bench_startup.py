@@ -0,0 +1,58 @@
+"""Measure worker boot time for each configuration profile.
+
+Run from the project root:
+
+    python benchmarks/bench_startup.py
+
+Each sample starts a fresh interpreter that imports `wsgi` (which builds
+the app) and exits, so the numbers include interpreter start, imports and
+create_app(), i.e. what a newly autoscaled worker pays before serving.
+No database connection is made while booting.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 10
+
+
+def boot_seconds(profile):
+    env = dict(os.environ, WARBLER_ENV=profile)
+    env.setdefault('DATABASE_URL', 'sqlite://')
+
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import wsgi'],
+                       cwd=ROOT, env=env, check=True)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def boot_seconds_python():
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    baseline = boot_seconds_python()
+    print(f"{'profile':<14}{'median ms':>10}{'min ms':>10}")
+    print(f"{'(bare python)':<14}{statistics.median(baseline) * 1000:>10.0f}"
+          f"{min(baseline) * 1000:>10.0f}")
+
+    for profile in ('production', 'development'):
+        samples = boot_seconds(profile)
+        print(f"{profile:<14}{statistics.median(samples) * 1000:>10.0f}"
+              f"{min(samples) * 1000:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Compare buffered and streamed rendering of the list-heavy pages.
+
+Run from the project root:
+
+    python benchmarks/bench_streaming.py
+
+Uses DATABASE_URL if set, otherwise a throwaway SQLite file, fills it with
+synthetic users and messages, then requests each page with
+STREAM_TEMPLATES off and on. For each it reports time to first byte, total
+time and the peak Python allocation while serving the request.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+from app import create_app, CURR_USER_KEY
+from models import db, User, Message, Follows
+
+app = create_app()
+
+N_USERS = 3000
+N_MESSAGES = 2000
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    db.session.bulk_insert_mappings(User, [
+        dict(id=n, email=f"user{n}@bench.test", username=f"user{n}",
+             password="x", bio="Bench user " * 5)
+        for n in range(1, N_USERS + 1)
+    ])
+    db.session.bulk_insert_mappings(Message, [
+        dict(text=f"Warble number {n} " * 4, user_id=n % 50 + 1)
+        for n in range(N_MESSAGES)
+    ])
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_being_followed_id=n, user_following_id=1)
+        for n in range(2, 51)
+    ])
+    db.session.commit()
+
+
+def measure(client, path):
+    """(seconds to first chunk, total seconds, peak bytes allocated)"""
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    resp = client.get(path, buffered=False)
+    chunks = iter(resp.response)
+    next(chunks, b'')
+    first = time.perf_counter() - start
+    for _ in chunks:
+        pass
+    resp.close()
+
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first, total, peak
+
+
+def main():
+    seed()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = 1
+
+    paths = ['/users', '/', '/users/2', '/users/1/likes']
+
+    print(f"{'page':<16}{'mode':<10}{'ttfb ms':>10}{'total ms':>10}{'peak KiB':>10}")
+    for path in paths:
+        for streamed in (False, True):
+            app.config['STREAM_TEMPLATES'] = streamed
+            measure(client, path)
+            first, total, peak = measure(client, path)
+            mode = 'stream' if streamed else 'buffered'
+            print(f"{path:<16}{mode:<10}{first * 1000:>10.1f}"
+                  f"{total * 1000:>10.1f}{peak / 1024:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
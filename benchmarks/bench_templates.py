@@ -0,0 +1,108 @@
+"""Template compile and render microbenchmarks.
+
+Run from the project root:
+
+    python benchmarks/bench_templates.py
+
+- compile: load every template into a fresh environment, with and without
+  a warm bytecode cache directory
+- render: a 100-message `message_list`, comparing the previous version
+  (a `like_button` macro call and a scan of `g.user.likes` per message)
+  with the current inlined version (one liked-ids lookup per list)
+
+No database is needed; messages and the viewer are plain stand-ins.
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from flask import g
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from app import create_app
+
+app = create_app()
+
+TEMPLATE_DIR = os.path.join(app.root_path, 'templates')
+
+PREVIOUS_MESSAGE_LIST = """
+{% import 'macros.html' as macros %}
+{% for message in messages %}
+<li class="list-group-item">
+  <a href="/messages/{{ message.id }}" class="message-link"/>
+  <a href="/users/{{ message.user_id }}">
+    <img src="{{ message.user.image_url }}" alt="user image" class="timeline-image">
+  </a>
+  <div class="message-area">
+    <a href="/users/{{ message.user.id }}">@{{ message.user.username }}</a>
+    <span class="text-muted">{{ message.timestamp.strftime('%d %B %Y') }}</span>
+    <p>{{ message.text }}</p>
+  </div>
+  {{ macros.like_button(message, '/') }}
+</li>
+{% endfor %}
+"""
+
+CURRENT_MESSAGE_LIST = """
+{% import 'macros.html' as macros %}
+{{ macros.message_list(messages, '/') }}
+"""
+
+
+def load_all(bytecode_cache=None):
+    env = Environment(loader=FileSystemLoader(TEMPLATE_DIR),
+                      bytecode_cache=bytecode_cache)
+    # templates use the app's filters (e.g. link_tags) when compiled
+    env.filters.update(app.jinja_env.filters)
+    env.globals.update(app.jinja_env.globals)
+    for name in env.list_templates(extensions=['html']):
+        env.get_template(name)
+
+
+def bench_compile():
+    cache_dir = tempfile.mkdtemp()
+    load_all(FileSystemBytecodeCache(cache_dir))
+
+    cold = min(timeit.repeat(load_all, number=5, repeat=3)) / 5
+    warm = min(timeit.repeat(
+        lambda: load_all(FileSystemBytecodeCache(cache_dir)),
+        number=5, repeat=3)) / 5
+
+    print(f"compile all templates, no cache:   {cold * 1000:8.2f} ms")
+    print(f"compile all templates, warm cache: {warm * 1000:8.2f} ms")
+
+
+def bench_render():
+    author = SimpleNamespace(id=2, username='author',
+                             image_url='/static/images/default-pic.png')
+    messages = [SimpleNamespace(id=n, user_id=2, user=author,
+                                text=f"Warble {n}", timestamp=datetime.utcnow())
+                for n in range(100)]
+    liked = messages[::3] + [SimpleNamespace(id=-n) for n in range(200)]
+    viewer = SimpleNamespace(
+        id=1, likes=liked,
+        liked_ids_among=lambda msgs: {m.id for m in liked} & {m.id for m in msgs})
+
+    previous = app.jinja_env.from_string(PREVIOUS_MESSAGE_LIST)
+    current = app.jinja_env.from_string(CURRENT_MESSAGE_LIST)
+
+    with app.test_request_context('/'):
+        g.user = viewer
+        for label, template in (('previous', previous), ('current', current)):
+            seconds = min(timeit.repeat(
+                lambda: template.render(messages=messages),
+                number=50, repeat=5)) / 50
+            print(f"render message_list x100, {label:<8} {seconds * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    bench_compile()
+    bench_render()
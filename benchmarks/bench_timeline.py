@@ -0,0 +1,108 @@
+"""Write and read cost of home timelines at different fan-out thresholds.
+
+Run from the project root:
+
+    python benchmarks/bench_timeline.py
+
+Uses DATABASE_URL if set, otherwise a throwaway SQLite file. Follows are
+drawn from a Zipf-like distribution (a few accounts have most of the
+followers, as on real networks) and posts are likewise skewed towards
+popular authors. For each FANOUT_FOLLOWER_THRESHOLD it reports the time and
+rows to post every message, then the mean time to read a home timeline and
+the merge counters from timeline_stats().
+
+A threshold above every follower count is pure push; 0 is pure pull.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+from app import create_app
+from models import db, User, Message, Follows
+from timeline import clear_celebrity_cache, home_timeline, stats, timeline_stats
+
+app = create_app()
+
+N_USERS = 2000
+FOLLOWS_PER_USER = 20
+N_MESSAGES = 3000
+N_READS = 300
+
+
+def zipf_choice(rng, n, s=1.1):
+    """Index in range(n), with index i about 1/(i+1)**s as likely as 0."""
+
+    # inverse transform on the continuous approximation of the distribution
+    u = rng.random()
+    return min(n - 1, int((u * ((n + 1) ** (1 - s) - 1) + 1) ** (1 / (1 - s))) - 1)
+
+
+def seed(rng):
+    db.drop_all()
+    db.create_all()
+    db.session.bulk_insert_mappings(User, [
+        dict(id=n, email=f"user{n}@bench.test", username=f"user{n}", password="x")
+        for n in range(1, N_USERS + 1)
+    ])
+    follows = set()
+    for follower in range(1, N_USERS + 1):
+        for _ in range(FOLLOWS_PER_USER):
+            followed = zipf_choice(rng, N_USERS) + 1
+            if followed != follower:
+                follows.add((followed, follower))
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_being_followed_id=a, user_following_id=b) for a, b in follows
+    ])
+    db.session.commit()
+
+
+def run(threshold):
+    rng = Random(0)
+    seed(rng)
+    app.config['FANOUT_FOLLOWER_THRESHOLD'] = threshold
+    clear_celebrity_cache()
+    stats.clear()
+
+    start = time.perf_counter()
+    t0 = datetime(2020, 1, 1)
+    for n in range(N_MESSAGES):
+        db.session.add(Message(text=f"Warble {n}",
+                               user_id=zipf_choice(rng, N_USERS, 0.8) + 1,
+                               timestamp=t0 + timedelta(seconds=n)))
+        if n % 100 == 99:
+            db.session.commit()
+    db.session.commit()
+    write = time.perf_counter() - start
+    pushed = stats['pushed_rows']
+
+    readers = [User.query.get(rng.randrange(N_USERS) + 1) for _ in range(N_READS)]
+    start = time.perf_counter()
+    for reader in readers:
+        home_timeline(reader)
+    read = (time.perf_counter() - start) / N_READS
+
+    merge = timeline_stats()
+    print(f"{threshold:>10}{write:>9.2f}{pushed:>10}{read * 1000:>9.2f}"
+          f"{merge.get('avg_merge_sources', 0):>9.1f}{merge.get('avg_merge_ms', 0):>10.3f}")
+
+
+def main():
+    print(f"{'threshold':>10}{'write s':>9}{'rows':>10}{'read ms':>9}"
+          f"{'sources':>9}{'merge ms':>10}")
+    with app.app_context():
+        for threshold in (10 ** 9, 500, 100, 0):
+            run(threshold)
+
+
+if __name__ == '__main__':
+    main()
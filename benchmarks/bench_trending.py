@@ -0,0 +1,79 @@
+"""Ingest rate and accuracy of the trending sketch.
+
+Run from the project root:
+
+    python benchmarks/bench_trending.py
+
+Feeds synthetic warbles (words drawn from a Zipf-like vocabulary of
+20,000, one rare word each, and some #tags) to a Trending extension, and
+reports messages ingested per second, the size of its state, and how the
+top 10 it reports compare with exact counts. For comparison, the same top 10 from a
+Counter of every token, whose memory grows with the vocabulary.
+Checkpoints go to a throwaway directory.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from trending import tokens
+
+N_MESSAGES = 100_000
+VOCABULARY = 20_000
+WORDS_PER_MESSAGE = 8
+
+app = create_app()
+app.config['TRENDING_CHECKPOINT_DIR'] = tempfile.mkdtemp()
+
+
+def messages(n, seed=1):
+    rng = random.Random(seed)
+    words = [f'word{i}' for i in range(VOCABULARY)]
+    for _ in range(n):
+        picked = [words[min(int(rng.paretovariate(1.1)) - 1, VOCABULARY - 1)]
+                  for _ in range(WORDS_PER_MESSAGE)]
+        # and a word hardly anyone else uses
+        picked.append(f'rare{rng.randrange(1_000_000)}')
+        if rng.random() < 0.3:
+            picked.append(f'#tag{int(rng.paretovariate(1.3))}')
+        yield ' '.join(picked)
+
+
+def main():
+    texts = list(messages(N_MESSAGES))
+    trending = app.extensions['trending']
+    trending.directory = app.config['TRENDING_CHECKPOINT_DIR']
+    now = time.time()
+
+    start = time.perf_counter()
+    for text in texts:
+        trending.ingest(text, now=now)
+    elapsed = time.perf_counter() - start
+    print(f"sketch:  {N_MESSAGES / elapsed:10,.0f} messages/s  "
+          f"state {len(trending.sketch.counters) * 8 // 1024} KiB counters "
+          f"+ {len(trending.top)} tracked tokens")
+
+    exact = Counter()
+    start = time.perf_counter()
+    for text in texts:
+        exact.update(tokens(text))
+    elapsed = time.perf_counter() - start
+    print(f"Counter: {N_MESSAGES / elapsed:10,.0f} messages/s  "
+          f"state {len(exact):,} distinct tokens")
+
+    reported = trending.topics(10, now=now)
+    print("\ntop 10: token, sketch count, exact count")
+    for token, count in reported:
+        print(f"  {token:<10} {count:10,.0f} {exact[token]:10,}")
+    overlap = {token for token, _ in reported} & {token for token, _ in exact.most_common(10)}
+    print(f"{len(overlap)}/10 of the exact top 10")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""gzip and brotli encoding of response bodies.
+
+Brotli needs the optional `brotli` package; without it only gzip is
+offered. ENCODINGS lists what this process can produce, best first.
+
+Static assets are compressed once, at build time (see assets.py). Pages
+are compressed as they are sent by the Compressor extension, in the
+client's preferred encoding, at the cheaper COMPRESS_GZIP_LEVEL and
+COMPRESS_BROTLI_QUALITY, unless:
+
+- the body is smaller than COMPRESS_MIN_SIZE, where the saving doesn't
+  pay for the CPU;
+- its type isn't in COMPRESSIBLE_TYPES (images are compressed already);
+- it already has a Content-Encoding, or is a file being passed through,
+  or says Cache-Control: no-transform.
+
+Streamed pages (STREAM_TEMPLATES) have no size up front; they are always
+compressed, chunk by chunk, each chunk flushed so the browser can start
+rendering it as before. Responses that could be compressed get
+`Vary: Accept-Encoding` either way, for caches in between.
+"""
+
+import gzip
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+# What the build step (assets.py) writes next to each file, per encoding.
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Types worth compressing; images and fonts are compressed already.
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+    'application/javascript', 'application/json', 'application/xml',
+    'image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon',
+}
+
+
+def compressible(mimetype):
+    return mimetype in COMPRESSIBLE_TYPES
+
+
+def compress(data, encoding):
+    """`data` encoded with 'br' or 'gzip', as small as it gets."""
+
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def choose_encoding(accept_encodings, available):
+    """The client's preferred encoding among `available`, or None."""
+
+    best = accept_encodings.best_match(available)
+    if best is None or accept_encodings[best] == 0:
+        return None
+    return best
+
+
+def gzip_chunks(chunks, level):
+    """Stream of gzip data for a stream of bytes, flushed per chunk."""
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def brotli_chunks(chunks, quality):
+    """Stream of brotli data for a stream of bytes, flushed per chunk."""
+
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in chunks:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class Compressor:
+    """Flask extension compressing responses as they are sent."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['COMPRESS_ENABLED']
+        self.min_size = config['COMPRESS_MIN_SIZE']
+        self.gzip_level = config['COMPRESS_GZIP_LEVEL']
+        self.brotli_quality = config['COMPRESS_BROTLI_QUALITY']
+        app.after_request(self.after_request)
+        app.extensions['compression'] = self
+
+    def after_request(self, response):
+        if (not self.enabled
+                or request.method == 'HEAD'
+                or response.status_code in (204, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or not compressible(response.mimetype)
+                or 'no-transform' in response.headers.get('Cache-Control', '')):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings, ENCODINGS)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self.compress_stream(response.iter_encoded(), encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(self.compress(data, encoding))
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak)
+        return response
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def compress_stream(self, chunks, encoding):
+        if encoding == 'br':
+            return brotli_chunks(chunks, self.brotli_quality)
+        return gzip_chunks(chunks, self.gzip_level)
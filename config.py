@@ -0,0 +1,211 @@
+"""Configuration profiles for Warbler.
+
+Pick one with the WARBLER_ENV environment variable (falling back to
+FLASK_ENV): 'development', 'testing' or 'production' (the default).
+"""
+
+import os
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    # Get DB_URI from environ variable (useful for production) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgres:///warbler')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    # Flask-DebugToolbar is only imported and set up when this is on.
+    DEBUG_TOOLBAR = False
+
+    # Followers/following pages are paginated by user id in pages of this size.
+    FOLLOW_PAGE_SIZE = 50
+
+    # Message feeds are paginated by (time-ordered) message id.
+    FEED_PAGE_SIZE = 100
+
+    # Send list pages as they render instead of building the whole string first.
+    # Streamed output is grouped into chunks of STREAM_BUFFER_SIZE template
+    # pieces (1 sends each piece as soon as it is rendered).
+    STREAM_TEMPLATES = os.environ.get('STREAM_TEMPLATES', '') == '1'
+    STREAM_BUFFER_SIZE = int(os.environ.get('STREAM_BUFFER_SIZE', 40))
+
+    # Compiled templates are kept here across restarts; fill it ahead of time
+    # with `flask compile-templates`.
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+
+    # Warm the app and freeze its heap when it is built, for servers that
+    # load it once before forking workers (see preload.py).
+    PRELOAD = os.environ.get('WARBLER_PRELOAD', '') == '1'
+
+    # Archived months of messages are written here (see partitions.py).
+    MESSAGE_ARCHIVE_DIR = os.environ.get('MESSAGE_ARCHIVE_DIR', 'archive')
+
+    # Authors with at least this many followers are not fanned out on write;
+    # their messages are merged into followers' timelines at read time.
+    FANOUT_FOLLOWER_THRESHOLD = int(os.environ.get('FANOUT_FOLLOWER_THRESHOLD', 1000))
+
+    # Message ids are generated in-process (see snowflake.py). NODE_ID
+    # (0-1023) must differ between processes; unset, each process leases
+    # one from the database for NODE_LEASE_SECONDS at a time, renewing it
+    # as it goes (see node_leases.py).
+    MESSAGE_ID_GENERATOR = 'snowflake'
+    NODE_ID = (int(os.environ['WARBLER_NODE_ID'])
+               if os.environ.get('WARBLER_NODE_ID') else None)
+    NODE_LEASE_SECONDS = 60
+
+    # Database URLs to shard messages and likes across by user id (see
+    # shards.py); empty keeps them in the main database.
+    MESSAGE_SHARDS = [url for url in os.environ.get('MESSAGE_SHARDS', '').split(',')
+                      if url]
+
+    # Pages run their independent read queries concurrently on a pool of
+    # this many threads, each query cancelled after QUERY_TIMEOUT seconds
+    # (see gather.py). Off, they run one after another.
+    PARALLEL_QUERIES = os.environ.get('PARALLEL_QUERIES', '1') == '1'
+    QUERY_POOL_SIZE = int(os.environ.get('QUERY_POOL_SIZE', 16))
+    QUERY_TIMEOUT = float(os.environ.get('QUERY_TIMEOUT', 5))
+
+    # Anonymous visitors' pages are cached for PAGE_CACHE_TTL seconds, then
+    # served stale for up to PAGE_CACHE_STALE more while being refreshed
+    # (see pagecache.py). Requests waiting on another's render give up
+    # after PAGE_CACHE_WAIT seconds and render it themselves.
+    PAGE_CACHE_ENABLED = os.environ.get('PAGE_CACHE_ENABLED', '1') == '1'
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 30))
+    PAGE_CACHE_STALE = int(os.environ.get('PAGE_CACHE_STALE', 300))
+    PAGE_CACHE_MAX_ENTRIES = 10_000
+    PAGE_CACHE_WAIT = 5
+
+    # Pages of at least COMPRESS_MIN_SIZE bytes are gzip/brotli compressed
+    # on the fly, at these levels (see compression.py).
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') == '1'
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 5
+
+    # `flask assets build` writes fingerprinted, precompressed copies of
+    # static/ here (relative to the app), served from /assets (see assets.py).
+    ASSET_BUILD_DIR = os.environ.get('ASSET_BUILD_DIR', 'static-build')
+
+    # Users' external avatar and header images are served as thumbnails
+    # through /images, cached in IMAGE_CACHE_DIR up to IMAGE_CACHE_MAX_BYTES
+    # (see images.py). Originals larger than IMAGE_MAX_BYTES are refused,
+    # and a failed URL isn't fetched again for IMAGE_FAILURE_TTL seconds
+    # (remembering at most IMAGE_FAILURE_MAX of them).
+    IMAGE_PROXY_ENABLED = os.environ.get('IMAGE_PROXY_ENABLED', '1') == '1'
+    IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', 'image-cache')
+    IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    IMAGE_MAX_BYTES = 5 * 1024 * 1024
+    IMAGE_FETCH_TIMEOUT = 5
+    IMAGE_FAILURE_TTL = 300
+    IMAGE_FAILURE_MAX = 10_000
+
+    # Username/email availability is checked against a Bloom filter with
+    # this false positive rate first (see availability.py); each worker adds
+    # other workers' signups every AVAILABILITY_SYNC_SECONDS and rebuilds it
+    # every AVAILABILITY_REBUILD_SECONDS.
+    AVAILABILITY_FALSE_POSITIVE_RATE = 0.01
+    AVAILABILITY_SYNC_SECONDS = 5
+    AVAILABILITY_REBUILD_SECONDS = 600
+
+    # The trending panel counts words and #tags of new messages in a
+    # count-min sketch of TRENDING_SKETCH_DEPTH x TRENDING_SKETCH_WIDTH
+    # counters, tracking the TRENDING_TRACKED most frequent by name, with
+    # counts halving every TRENDING_HALF_LIFE seconds. Each worker saves
+    # its counts to TRENDING_CHECKPOINT_DIR (relative to the app) every
+    # TRENDING_CHECKPOINT_SECONDS, and reads the other workers' from there.
+    TRENDING_SKETCH_WIDTH = 4096
+    TRENDING_SKETCH_DEPTH = 4
+    TRENDING_TRACKED = 100
+    TRENDING_HALF_LIFE = 60 * 60
+    TRENDING_CHECKPOINT_DIR = os.environ.get('TRENDING_CHECKPOINT_DIR', 'trending')
+    TRENDING_CHECKPOINT_SECONDS = 60
+
+    # Open home pages get new warbles over /stream (see realtime.py), through
+    # REALTIME_BACKEND: 'local' (this process only), 'redis' (the server at
+    # REALTIME_REDIS_URL) or a broker object. Only the cooperative server
+    # turns REALTIME_STREAMS_ENABLED on, and it needs a shared backend
+    # unless REALTIME_SINGLE_PROCESS says it is the only process posting.
+    # Each worker holds at most REALTIME_MAX_SUBSCRIBERS streams, each
+    # buffering up to REALTIME_QUEUE_SIZE events for its client.
+    REALTIME_BACKEND = os.environ.get('REALTIME_BACKEND', 'local')
+    REALTIME_REDIS_URL = os.environ.get('REALTIME_REDIS_URL', 'redis://localhost:6379/0')
+    REALTIME_STREAMS_ENABLED = False
+    REALTIME_SINGLE_PROCESS = os.environ.get('REALTIME_SINGLE_PROCESS') == '1'
+    REALTIME_MAX_SUBSCRIBERS = 5000
+    REALTIME_QUEUE_SIZE = 100
+    REALTIME_HEARTBEAT_SECONDS = 15
+    REALTIME_STREAM_SECONDS = 5 * 60
+
+    # Seconds a message post's idempotency key is remembered for replays.
+    IDEMPOTENCY_TTL = 24 * 60 * 60
+
+    # Number of proxies in front of the app whose X-Forwarded-For and
+    # X-Forwarded-Proto headers are trusted. Logged-out clients are rate
+    # limited by address, which behind a proxy is the forwarded one.
+    PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 0))
+
+    # Per-endpoint budgets, per user (or IP when logged out); GETs only
+    # count for GET-only endpoints (see ratelimit.py). /users/available
+    # tells anyone whether an email has an account, so it is kept slow.
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMITS = {
+        'warbler.login': '10/minute',
+        'warbler.signup': '5/minute',
+        'warbler.users_available': '20/minute',
+        'warbler.messages_add': '30/minute',
+        'warbler.toggle_like': '60/minute',
+        'warbler.add_follow': '30/minute',
+        'warbler.stop_following': '30/minute',
+    }
+
+
+class DevelopmentConfig(Config):
+    """Local development: debug toolbar on."""
+
+    DEBUG_TOOLBAR = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+
+class TestingConfig(Config):
+    """Test runs, against their own database."""
+
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'TEST_DATABASE_URL', 'postgresql:///warbler-test')
+
+    # Don't have WTForms use CSRF at all, since it's a pain to test
+    WTF_CSRF_ENABLED = False
+
+    # Tests post far faster than any real client
+    RATE_LIMIT_ENABLED = False
+
+    # Tests clear tables in bulk, which the page cache doesn't see
+    PAGE_CACHE_ENABLED = False
+
+    # Tests run in one process, so one fixed node and broker will do
+    NODE_ID = 0
+    REALTIME_SINGLE_PROCESS = True
+
+
+class ProductionConfig(Config):
+    """Production workers: no debug-only extensions."""
+
+    # Production runs behind the front proxy (see serve_async.py)
+    PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 1))
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def current_profile():
+    """Name of the profile selected by the environment."""
+
+    return os.environ.get('WARBLER_ENV') or os.environ.get('FLASK_ENV', 'production')
@@ -0,0 +1,95 @@
+"""Read models for rendering message feeds.
+
+Feed pages (home, profiles, likes) show up to FEED_PAGE_SIZE messages, and
+the template only reads each message's id, text and timestamp and its
+author's id, username and image. Loading those as Message and User
+instances pays for the identity map, attribute instrumentation and
+relationship loading on every row, and keeps the instances tied to a
+session.
+
+So feeds are read with Core queries (`feed_select`) straight into
+FeedMessage records with an Author each; one Author is shared by all of
+a page's messages from the same user. They are plain values, safe to
+pass between threads (see gather.py) and to render after the session is
+gone, and read-only: views that change a message, or need more of it,
+load the Message itself.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from models import db, Message, User
+
+Author = namedtuple('Author', 'id username image_url')
+
+messages = Message.__table__
+users = User.__table__
+
+COLUMNS = [messages.c.id, messages.c.text, messages.c.timestamp,
+           messages.c.user_id, users.c.username, users.c.image_url]
+
+
+class FeedMessage:
+    """A message as a feed shows it."""
+
+    __slots__ = ('id', 'text', 'timestamp', 'user_id', 'user')
+
+    def __init__(self, id, text, timestamp, user_id, user):
+        self.id = id
+        self.text = text
+        self.timestamp = timestamp
+        self.user_id = user_id
+        self.user = user
+
+    def __repr__(self):
+        return f"<FeedMessage #{self.id} by {self.user_id}>"
+
+
+def feed_select(source=messages):
+    """SELECT of COLUMNS for messages joined to their authors; add filters.
+
+    `source` is the messages table, or a join to it from the table that
+    picks the messages (timeline entries, likes).
+    """
+
+    return select(COLUMNS).select_from(
+        source.join(users, users.c.id == messages.c.user_id))
+
+
+def feed_messages(rows):
+    """FeedMessages for rows of COLUMNS, in the same order."""
+
+    authors = {}
+    found = []
+    for id, text, timestamp, user_id, username, image_url in rows:
+        author = authors.get(user_id)
+        if author is None:
+            author = authors[user_id] = Author(user_id, username, image_url)
+        found.append(FeedMessage(id, text, timestamp, user_id, author))
+    return found
+
+
+def load_feed(query):
+    """Run a `feed_select` query; returns FeedMessages."""
+
+    return feed_messages(db.session.execute(query))
+
+
+def with_authors(rows):
+    """FeedMessages for message rows without author columns.
+
+    For messages read where users can't be joined (shards); the authors
+    are looked up in one query. Messages by deleted users are left out.
+    """
+
+    user_ids = {row.user_id for row in rows}
+    if not user_ids:
+        return []
+    query = (select([users.c.id, users.c.username, users.c.image_url])
+             .where(users.c.id.in_(user_ids)))
+    authors = {row.id: Author(*row) for row in db.session.execute(query)}
+
+    return [FeedMessage(row.id, row.text, row.timestamp, row.user_id,
+                        authors[row.user_id])
+            for row in rows if row.user_id in authors]
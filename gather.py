@@ -0,0 +1,127 @@
+"""Run a page's independent read queries concurrently.
+
+A view hands `gather` a dict of {name: callable}; each callable runs on a
+shared thread pool in its own app context, so it gets its own session and
+pooled connection, and `gather` returns {name: result} once all are done.
+The page then takes as long as its slowest query instead of the sum.
+
+Each query has a timeout (QUERY_TIMEOUT, or per task via Task). A query
+that overruns is cancelled: dropped if it hasn't started, otherwise its
+statement is cancelled on the database connection (psycopg2's cancel, or
+sqlite3's interrupt). Its result is then the task's default, or, with no
+default, QueryTimeout is raised and the page answers 503.
+
+Results are detached from any session when returned, so callables must
+eager-load whatever the template reads, and must not use `g` or `request`
+(pass in plain values instead).
+
+With PARALLEL_QUERIES off, tasks run one after another in the calling
+thread, as views did before.
+"""
+
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app
+
+from models import db
+
+RAISE = object()
+
+Task = namedtuple('Task', 'fn timeout default')
+Task.__new__.__defaults__ = (None, RAISE)
+
+
+class QueryTimeout(Exception):
+    """A query needed for the page didn't finish in time."""
+
+
+class Running:
+    """A task's database connection, so another thread can cancel it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connection = None
+        self.done = False
+
+    def cancel(self):
+        with self.lock:
+            if self.done or self.connection is None:
+                return
+            raw = self.connection.connection
+            cancel = getattr(raw, 'cancel', None) or getattr(raw, 'interrupt', None)
+            if cancel is not None:
+                cancel()
+
+
+class QueryExecutor:
+    """Flask extension with the thread pool for `gather`."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.pool = ThreadPoolExecutor(max_workers=app.config['QUERY_POOL_SIZE'],
+                                       thread_name_prefix='query')
+        app.extensions['queries'] = self
+
+    def run(self, app, fn, running):
+        with app.app_context():
+            try:
+                with running.lock:
+                    running.connection = db.session.connection().connection
+                return fn()
+            finally:
+                with running.lock:
+                    running.done = True
+                db.session.remove()
+
+    def gather(self, tasks):
+        """{name: result} for {name: callable or Task}."""
+
+        tasks = {name: task if isinstance(task, Task) else Task(task)
+                 for name, task in tasks.items()}
+
+        if not current_app.config['PARALLEL_QUERIES']:
+            return {name: task.fn() for name, task in tasks.items()}
+
+        app = current_app._get_current_object()
+        default_timeout = current_app.config['QUERY_TIMEOUT']
+        started = time.monotonic()
+
+        running = {name: Running() for name in tasks}
+        futures = {name: self.pool.submit(self.run, app, task.fn, running[name])
+                   for name, task in tasks.items()}
+
+        results = {}
+        for name, task in tasks.items():
+            timeout = task.timeout or default_timeout
+            remaining = max(0, started + timeout - time.monotonic())
+            try:
+                results[name] = futures[name].result(timeout=remaining)
+            except TimeoutError:
+                if not futures[name].cancel():
+                    running[name].cancel()
+                if task.default is RAISE:
+                    cancel_all(futures, running)
+                    raise QueryTimeout(name)
+                results[name] = task.default
+            except Exception:
+                cancel_all(futures, running)
+                raise
+        return results
+
+
+def cancel_all(futures, running):
+    for name, future in futures.items():
+        if not future.cancel():
+            running[name].cancel()
+
+
+def gather(tasks):
+    """Run {name: callable or Task} with the app's QueryExecutor."""
+
+    return current_app.extensions['queries'].gather(tasks)
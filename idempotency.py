@@ -0,0 +1,89 @@
+"""Idempotency keys for posting messages.
+
+The new-message form carries a random key (clients may instead send an
+Idempotency-Key header). The key is stored with the message it created,
+in the same transaction, so a retried POST with the same key finds the
+original message instead of inserting a second one. If two copies of a
+request race, the primary key on (user_id, key) lets only one commit;
+the other rolls back and replays the winner's result.
+
+Header keys must be 1-64 visible ASCII characters (form keys are checked
+by the form); anything else is refused with a 400 rather than reaching
+the key column.
+
+Keys expire after IDEMPOTENCY_TTL seconds; a user's expired keys are
+deleted whenever they post, so the table only holds recent posts.
+"""
+
+import re
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from models import db, IdempotencyKey, Message
+
+# as long as IdempotencyKey.key holds, printable and without spaces
+KEY_PATTERN = re.compile(r'[!-~]{1,64}')
+
+
+def valid_key(key):
+    return KEY_PATTERN.fullmatch(key) is not None
+
+
+def expiry_cutoff():
+    ttl = current_app.config['IDEMPOTENCY_TTL']
+    return datetime.utcnow() - timedelta(seconds=ttl)
+
+
+def find_replay(user_id, key):
+    """The message already created with this key, or None."""
+
+    if not key:
+        return None
+
+    stored = (IdempotencyKey
+              .query
+              .filter(IdempotencyKey.user_id == user_id,
+                      IdempotencyKey.key == key,
+                      IdempotencyKey.created_at >= expiry_cutoff())
+              .first())
+    return stored and Message.query.get(stored.message_id)
+
+
+def add_message_once(user, text, key=None):
+    """Post a message unless `key` was already used.
+
+    Returns (message, created): `created` is False when the message is the
+    one an earlier post with this key made. Without a key this always
+    posts, as before.
+    """
+
+    replay = find_replay(user.id, key)
+    if replay is not None:
+        return replay, False
+
+    msg = Message(text=text)
+    user.messages.append(msg)
+
+    if key:
+        (IdempotencyKey
+         .query
+         .filter(IdempotencyKey.user_id == user.id,
+                 IdempotencyKey.created_at < expiry_cutoff())
+         .delete(synchronize_session=False))
+        db.session.flush()
+        db.session.add(IdempotencyKey(user_id=user.id, key=key,
+                                      message_id=msg.id))
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent copy of this request committed first
+        db.session.rollback()
+        replay = find_replay(user.id, key)
+        if replay is None:
+            raise
+        return replay, False
+
+    return msg, True
@@ -0,0 +1,400 @@
+"""Image proxy: thumbnails of users' external avatar and header images.
+
+`image_url` and `header_image_url` can be any URL, and used to be
+hot-linked full size into every message and user card. Templates now call
+`thumbnail(url, size)`, which for an http(s) URL returns
+/images/<size>/<token>, the token being the URL signed with SECRET_KEY, so
+only URLs the app itself rendered can be fetched. Other URLs (the default
+images under /static) are returned as they are, or as their built,
+fingerprinted copies (see assets.py).
+
+The first request for an image fetches it (IMAGE_FETCH_TIMEOUT, at most
+IMAGE_MAX_BYTES, never from private or local addresses), and each size is
+cut from it once, with Pillow: scaled and center-cropped to SIZES. Without
+Pillow installed, every size is the original image. Failures send the
+default image instead, and the URL isn't retried for IMAGE_FAILURE_TTL
+seconds (for up to IMAGE_FAILURE_MAX URLs at a time).
+
+Every connection, redirects included, resolves its host once, checks the
+addresses and connects to the one it checked, so a host can't pass the
+check with a public address and then resolve to a private one.
+
+Everything is kept in a content-addressed disk cache (DiskCache) in
+IMAGE_CACHE_DIR: each URL refers to the hash of its image, so one image
+behind many URLs is stored and thumbnailed once. When the cache grows past
+IMAGE_CACHE_MAX_BYTES the least recently used files are deleted. A URL
+whose image changes upstream keeps its old thumbnail until evicted, so
+responses are cacheable forever (IMMUTABLE_CACHE_CONTROL).
+"""
+
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+from functools import lru_cache
+from urllib.error import URLError
+from urllib.parse import urlsplit
+
+from flask import Response, current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+
+# (width, height), matching the CSS each is shown at
+SIZES = {
+    'timeline': (48, 48),
+    'card': (70, 70),
+    'profile': (200, 200),
+    'card-header': (400, 200),
+    'header': (1200, 360),
+}
+
+# Shown when an image can't be fetched or read.
+DEFAULTS = {
+    'timeline': '/static/images/default-pic.png',
+    'card': '/static/images/default-pic.png',
+    'profile': '/static/images/default-pic.png',
+    'card-header': '/static/images/warbler-hero.jpg',
+    'header': '/static/images/warbler-hero.jpg',
+}
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# leading bytes -> content type, for the formats browsers show everywhere
+# (not SVG, which can carry scripts)
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+
+class ImageError(Exception):
+    """An image couldn't be fetched, or isn't one we serve."""
+
+
+def content_type(data):
+    """The image type of `data` from its first bytes, or None."""
+
+    for signature, mimetype in SIGNATURES:
+        if data.startswith(signature):
+            return mimetype
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def public_address(host, port):
+    """The address to connect to for `host`, if all of its are public.
+
+    Raises ImageError otherwise.
+    """
+
+    try:
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as error:
+        raise ImageError(f"Can't resolve {host}: {error}")
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split('%')[0])
+        if not address.is_global:
+            raise ImageError(f"{host} is not a public address")
+    return addresses[0][4][0]
+
+
+def check_host(url):
+    """Raise ImageError unless `url` is http(s) to a public address."""
+
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageError(f"Not an http(s) URL: {url}")
+    public_address(parts.hostname,
+                   parts.port or (443 if parts.scheme == 'https' else 80))
+
+
+def connect_public(connection):
+    """A socket to a checked public address of `connection`'s host."""
+
+    address = public_address(connection.host, connection.port)
+    return socket.create_connection((address, connection.port), connection.timeout,
+                                    connection.source_address)
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    def connect(self):
+        self.sock = connect_public(self)
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    def connect(self):
+        # certificates are still checked against the host name
+        self.sock = self._context.wrap_socket(connect_public(self),
+                                              server_hostname=self.host)
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+class CheckedRedirects(urllib.request.HTTPRedirectHandler):
+    """Follow redirects only to public addresses."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_host(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+# no proxies: they would resolve the host themselves
+opener = urllib.request.build_opener(urllib.request.ProxyHandler({}),
+                                     PublicHTTPHandler, PublicHTTPSHandler,
+                                     CheckedRedirects)
+
+
+def fetch_http(url, timeout, max_bytes):
+    """The body of `url`, checked to be a public http(s) URL."""
+
+    check_host(url)
+    request = urllib.request.Request(url, headers={'User-Agent': 'warbler-images'})
+    try:
+        with opener.open(request, timeout=timeout) as response:
+            data = response.read(max_bytes + 1)
+    except (URLError, OSError, ValueError) as error:
+        raise ImageError(f"Fetching {url} failed: {error}")
+    if len(data) > max_bytes:
+        raise ImageError(f"{url} is larger than {max_bytes} bytes")
+    return data
+
+
+def make_thumbnail(data, size):
+    """`data` scaled and cropped to `size`, as PNG or JPEG bytes.
+
+    Returns `data` unchanged if Pillow isn't installed.
+    """
+
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return data
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # let the JPEG decoder skip detail we'd throw away
+            image.draft('RGB', (size[0] * 2, size[1] * 2))
+            image = ImageOps.fit(image, size, Image.LANCZOS)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        raise ImageError(f"Can't read image: {error}")
+
+    out = io.BytesIO()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image.convert('RGBA').save(out, 'PNG', optimize=True)
+    else:
+        image.convert('RGB').save(out, 'JPEG', quality=85, optimize=True,
+                                  progressive=True)
+    return out.getvalue()
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def url_key(url):
+    """Cache key of the reference from `url` to its image's hash."""
+
+    return 'u' + digest(url.encode())
+
+
+class DiskCache:
+    """Files named by key under `directory`, at most about `max_bytes`.
+
+    Reads refresh a file's mtime, and eviction deletes the oldest files
+    until the total is back under 90% of `max_bytes`. Writes are atomic
+    renames, so processes can share a directory; the total is counted
+    per process, and recounted from disk before evicting.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total = None
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def read(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def write(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+        with self.lock:
+            if self.total is None:
+                self.total = sum(size for _, size, _ in self.files())
+            else:
+                self.total += len(data)
+            if self.total > self.max_bytes:
+                self.evict()
+
+    def files(self):
+        """(path, size, mtime) of every cached file."""
+
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        files = sorted(self.files(), key=lambda file: file[2])
+        self.total = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self.total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total -= size
+
+
+class ImageProxy:
+    """Flask extension serving thumbnails of external images.
+
+    `fetch(url)` returns an image's bytes or raises ImageError; tests
+    replace it with a stub.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['IMAGE_PROXY_ENABLED']
+        self.cache = DiskCache(config['IMAGE_CACHE_DIR'],
+                               config['IMAGE_CACHE_MAX_BYTES'])
+        self.fetch = lambda url: fetch_http(url, config['IMAGE_FETCH_TIMEOUT'],
+                                            config['IMAGE_MAX_BYTES'])
+        self.failure_ttl = config['IMAGE_FAILURE_TTL']
+        self.max_failures = config['IMAGE_FAILURE_MAX']
+        # url -> retry after; in that order, as the TTL is fixed
+        self.failures = {}
+        self.serializer = URLSafeSerializer(app.secret_key, salt='image-proxy')
+        assets = app.extensions.get('assets')
+        self.local_url = assets.static_url if assets else (lambda url: url)
+        self.sign = lru_cache(maxsize=10_000)(self.serializer.dumps)
+        app.add_template_global(self.url_for, 'thumbnail')
+        app.extensions['images'] = self
+
+    def url_for(self, url, size):
+        """Where templates load `url` at `size` from."""
+
+        if not url:
+            return url
+        if not self.enabled or not url.startswith(('http://', 'https://')):
+            return self.local_url(url)
+        return f'/images/{size}/{self.sign(url)}'
+
+    def original(self, url):
+        """(hash, bytes) of the image at `url`.
+
+        The bytes are None unless the image had to be fetched.
+        """
+
+        ref = self.cache.read(url_key(url))
+        if ref is not None:
+            return ref.decode(), None
+
+        failed_until = self.failures.get(url)
+        if failed_until is not None and failed_until > time.monotonic():
+            raise ImageError(f"{url} failed recently")
+        try:
+            data = self.fetch(url)
+            if content_type(data) is None:
+                raise ImageError(f"{url} is not a PNG, JPEG, GIF or WebP image")
+        except ImageError:
+            self.remember_failure(url)
+            raise
+
+        key = digest(data)
+        self.cache.write(key, data)
+        self.cache.write(url_key(url), key.encode())
+        return key, data
+
+    def remember_failure(self, url):
+        now = time.monotonic()
+        self.failures.pop(url, None)
+        self.failures[url] = now + self.failure_ttl
+        # drop expired entries, and the oldest ones past the limit
+        for old, until in list(self.failures.items()):
+            if until > now and len(self.failures) <= self.max_failures:
+                break
+            self.failures.pop(old, None)
+
+    def thumbnail(self, url, size):
+        """(key, bytes) of `url` at `size`."""
+
+        original, source = self.original(url)
+        data = self.cache.read(f'{original}-{size}')
+        if data is None:
+            if source is None:
+                source = self.cache.read(original)
+            if source is None:
+                # evicted since the URL's reference was written
+                self.cache.delete(url_key(url))
+                original, source = self.original(url)
+            data = make_thumbnail(source, SIZES[size])
+            self.cache.write(f'{original}-{size}', data)
+        return f'{original}-{size}', data
+
+    def response(self, size, token):
+        """The thumbnail response, None for a bad request, or a default URL."""
+
+        if size not in SIZES:
+            return None
+        try:
+            url = self.serializer.loads(token)
+        except BadSignature:
+            return None
+
+        try:
+            key, data = self.thumbnail(url, size)
+        except ImageError as error:
+            current_app.logger.info("Image proxy: %s", error)
+            return self.local_url(DEFAULTS[size])
+
+        response = Response(data, mimetype=content_type(data))
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.set_etag(key)
+        return response
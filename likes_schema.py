@@ -0,0 +1,58 @@
+"""Moving the likes table to a composite primary key.
+
+Likes used to have a serial `id` key and a unique constraint on
+message_id alone, so a message could only ever be liked by one user, and
+"does X like Y" or "who likes Y" had no index to use. Now the key is
+(user_id, message_id), with a reverse index on (message_id, user_id).
+
+`flask likes migrate` rebuilds an old table in one transaction: create the
+new table alongside, copy each distinct (user_id, message_id) pair across
+(dropping rows missing either), drop the old table and rename the new one
+into place. A table that no longer has an `id` column is left alone, so it
+can be rerun.
+"""
+
+from sqlalchemy import MetaData, Table, func, inspect, select
+
+from models import db, Likes, Message, User
+
+NEW_TABLE = 'likes_new'
+
+
+def needs_migration():
+    columns = inspect(db.engine).get_columns(Likes.__tablename__)
+    return any(column['name'] == 'id' for column in columns)
+
+
+def migrate_likes():
+    """Rebuild an old likes table; returns the pairs kept, or None if done."""
+
+    if not needs_migration():
+        return None
+
+    with db.engine.begin() as connection:
+        old = Table(Likes.__tablename__, MetaData(), autoload_with=connection)
+        # index names are per schema, so the old table must go before
+        # the new one's reverse index is created
+        metadata = MetaData()
+        for table in (User.__table__, Message.__table__):
+            table.tometadata(metadata)  # so the copied foreign keys resolve
+        new = Likes.__table__.tometadata(metadata, name=NEW_TABLE)
+        new.indexes = set()
+        new.create(connection)
+
+        pairs = (select([old.c.user_id, old.c.message_id])
+                 .where(old.c.user_id.isnot(None) & old.c.message_id.isnot(None))
+                 .distinct())
+        connection.execute(new.insert().from_select(['user_id', 'message_id'], pairs))
+        kept = connection.execute(select([func.count()]).select_from(new)).scalar()
+
+        old.drop(connection)
+        connection.execute(f"ALTER TABLE {NEW_TABLE} RENAME TO {Likes.__tablename__}")
+        if connection.dialect.name == 'postgresql':
+            connection.execute(f"ALTER TABLE {Likes.__tablename__} RENAME CONSTRAINT "
+                               f"{NEW_TABLE}_pkey TO {Likes.__tablename__}_pkey")
+        for index in Likes.__table__.indexes:
+            index.create(connection)
+
+    return kept
@@ -0,0 +1,103 @@
+"""Moving existing messages from serial ids to time-ordered ids.
+
+Databases created before message ids came from snowflake.py have INTEGER
+ids from a sequence. `flask ids migrate` upgrades them in place:
+
+1. On Postgres, widen messages.id and every column referencing it to
+   BIGINT, drop the sequence default, and bring indexes up to date
+   (other databases are only used for tests and are created fresh).
+2. Renumber each message whose id is below LEGACY_ID_LIMIT with an id for
+   its timestamp: copy the row under the new id, point likes, timeline
+   entries etc. at it, then delete the old row.
+
+Renumbering goes in batches, each its own transaction, so it can be
+stopped and rerun; rows already moved are no longer below the limit.
+Archived months keep their old ids, which can't clash with new ones.
+"""
+
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, select
+
+from models import db, Message
+from snowflake import EPOCH, first_id
+
+# Serial ids are all far below the first id for a real time.
+LEGACY_ID_LIMIT = first_id(EPOCH + timedelta(days=1))
+
+POSTGRES_UPGRADE = [
+    "ALTER TABLE messages ALTER COLUMN id DROP DEFAULT",
+    "ALTER TABLE messages ALTER COLUMN id TYPE BIGINT",
+    'ALTER TABLE messages ALTER COLUMN "timestamp" '
+    "SET DEFAULT TIMEZONE('utc', CURRENT_TIMESTAMP)",
+    "DROP INDEX IF EXISTS ix_messages_timestamp",
+    "DROP INDEX IF EXISTS ix_messages_user_id_timestamp",
+    "CREATE INDEX IF NOT EXISTS ix_messages_user_id_id ON messages (user_id, id)",
+    "DROP INDEX IF EXISTS ix_timeline_entries_user_id_timestamp",
+    'ALTER TABLE timeline_entries DROP COLUMN IF EXISTS "timestamp"',
+]
+
+
+def referencing_columns():
+    """Every column with a foreign key to messages.id."""
+
+    return [fk.parent
+            for table in db.metadata.sorted_tables
+            for fk in table.foreign_keys
+            if fk.column is Message.__table__.c.id]
+
+
+def upgrade_schema():
+    """Apply the id column changes; returns False if not on Postgres."""
+
+    if db.engine.dialect.name != 'postgresql':
+        return False
+
+    statements = POSTGRES_UPGRADE + [
+        f"ALTER TABLE {column.table.name} ALTER COLUMN {column.name} TYPE BIGINT"
+        for column in referencing_columns()]
+    for statement in statements:
+        db.session.execute(statement)
+    db.session.commit()
+    return True
+
+
+def legacy_count():
+    return Message.query.filter(Message.id < LEGACY_ID_LIMIT).count()
+
+
+def renumber_legacy_ids(batch_size=1000):
+    """Give every serial-id message a time-ordered id; returns the count."""
+
+    generator = current_app.extensions['message_ids']
+    messages = Message.__table__
+    old, new = bindparam('old'), bindparam('new', type_=messages.c.id.type)
+
+    copy = messages.insert().from_select(
+        [messages.c.id, messages.c.text, messages.c.timestamp, messages.c.user_id],
+        select([new, messages.c.text, messages.c.timestamp, messages.c.user_id])
+        .where(messages.c.id == old))
+    repoint = [column.table.update()
+               .where(column == old)
+               .values({column.name: new})
+               for column in referencing_columns()]
+    delete = messages.delete().where(messages.c.id == old)
+
+    moved = 0
+    while True:
+        batch = (db.session
+                 .query(Message.id, Message.timestamp)
+                 .filter(Message.id < LEGACY_ID_LIMIT)
+                 .order_by(Message.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            return moved
+
+        params = [dict(old=old_id, new=generator.next_id(timestamp))
+                  for old_id, timestamp in batch]
+        for statement in [copy] + repoint + [delete]:
+            db.session.execute(statement, params)
+        db.session.commit()
+        moved += len(batch)
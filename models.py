@@ -4,7 +4,12 @@ from datetime import datetime
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import backref
+from sqlalchemy.sql.expression import FunctionElement
+
+from snowflake import id_time
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
@@ -27,26 +32,67 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key serves "followers of X" in id order;
+    # this serves "X is following" the same way
+    __table_args__ = (
+        db.Index('ix_follows_following_followed',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
-    __tablename__ = 'likes' 
+    __tablename__ = 'likes'
 
-    id = db.Column(
+    user_id = db.Column(
         db.Integer,
-        primary_key=True
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
     )
 
+    # the primary key serves "liked by X" in message id order;
+    # this serves "who liked message Y" (liked_by) the same way
+    __table_args__ = (
+        db.Index('ix_likes_message_id_user_id', 'message_id', 'user_id'),
+    )
+
+
+class Recommendation(db.Model):
+    """Precomputed "who to follow" suggestion for a user.
+
+    Rows are written in bulk by the offline job in recommendations.py;
+    nothing here is computed per request.
+    """
+
+    __tablename__ = 'recommendations'
+
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
-    message_id = db.Column(
+    recommended_user_id = db.Column(
         db.Integer,
-        db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    rank = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
     )
 
 
@@ -132,6 +178,105 @@ class User(db.Model):
         found_user_list = [user for user in self.following if user == other_user]
         return len(found_user_list) == 1
 
+    def followers_page(self, after=0, limit=50):
+        """Up to `limit` followers with id greater than `after`, by id."""
+
+        return (User
+                .query
+                .join(Follows, Follows.user_following_id == User.id)
+                .filter(Follows.user_being_followed_id == self.id,
+                        User.id > after)
+                .order_by(User.id)
+                .limit(limit)
+                .all())
+
+    def following_page(self, after=0, limit=50):
+        """Up to `limit` followed users with id greater than `after`, by id."""
+
+        return (User
+                .query
+                .join(Follows, Follows.user_being_followed_id == User.id)
+                .filter(Follows.user_following_id == self.id,
+                        User.id > after)
+                .order_by(User.id)
+                .limit(limit)
+                .all())
+
+    def following_ids_among(self, users):
+        """Ids of those `users` this user follows, in a single query."""
+
+        ids = [user.id for user in users]
+        if not ids:
+            return set()
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id,
+                        Follows.user_being_followed_id.in_(ids)))
+        return {followed_id for followed_id, in rows}
+
+    def liked_ids_among(self, messages):
+        """Ids of those `messages` this user likes, in a single query."""
+
+        ids = [message.id for message in messages]
+        if not ids:
+            return set()
+
+        shards = db.get_app().extensions.get('shards')
+        if shards is not None:
+            return shards.liked_ids(self.id, ids)
+
+        rows = (db.session
+                .query(Likes.message_id)
+                .filter(Likes.user_id == self.id,
+                        Likes.message_id.in_(ids)))
+        return {message_id for message_id, in rows}
+
+    def count_queries(self):
+        """{name: callable} for each profile header count.
+
+        Each is a COUNT query, so large collections are never loaded, and
+        they can run in parallel (see gather.py).
+        """
+
+        user_id = self.id
+
+        def count(column):
+            return lambda: (db.session.query(func.count())
+                            .filter(column == user_id).scalar())
+
+        queries = {
+            'following': count(Follows.user_following_id),
+            'followers': count(Follows.user_being_followed_id),
+        }
+
+        # messages and likes may be sharded (see shards.py)
+        shards = db.get_app().extensions.get('shards')
+        if shards is not None:
+            queries['messages'] = lambda: shards.message_count(user_id)
+            queries['likes'] = lambda: shards.like_count(user_id)
+        else:
+            queries['messages'] = count(Message.user_id)
+            queries['likes'] = count(Likes.user_id)
+        return queries
+
+    def counts(self):
+        """Messages/following/followers/likes counts for the profile header."""
+
+        return {name: query() for name, query in self.count_queries().items()}
+
+    def who_to_follow(self, limit=5):
+        """Precomputed suggestions for this user, best first."""
+
+        return (User
+                .query
+                .join(Recommendation,
+                      Recommendation.recommended_user_id == User.id)
+                .filter(Recommendation.user_id == self.id)
+                .order_by(Recommendation.rank)
+                .limit(limit)
+                .all())
+
     def update(self, form):
         hashed_pwd = self.password
         form.populate_obj(self)
@@ -177,14 +322,55 @@ class User(db.Model):
         return False
 
 
+class utcnow(FunctionElement):
+    """The database's current UTC time, for server-side defaults."""
+
+    type = db.DateTime()
+
+
+@compiles(utcnow)
+def compile_utcnow(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'postgresql')
+def compile_utcnow_postgresql(element, compiler, **kw):
+    # now() is in the session time zone; columns hold naive UTC
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+def message_id_default(context):
+    """Id from the message's timestamp if it was given, else from now.
+
+    Ids come from the app's generator (see snowflake.py), not the database.
+    """
+
+    timestamp = context.get_current_parameters().get('timestamp')
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return db.get_app().extensions['message_ids'].next_id(timestamp)
+
+
+def message_timestamp_default(context):
+    """The time encoded in the message's id, so the two always agree."""
+
+    return id_time(context.get_current_parameters()['id'])
+
+
 class Message(db.Model):
-    """An individual message ("warble")."""
+    """An individual message ("warble").
+
+    Ids are time-ordered (see snowflake.py), so "newest first" is
+    "highest id first" and feeds page on the primary key.
+    """
 
     __tablename__ = 'messages'
 
     id = db.Column(
-        db.Integer,
+        db.BigInteger,
         primary_key=True,
+        autoincrement=False,
+        default=message_id_default,
     )
 
     text = db.Column(
@@ -195,7 +381,8 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=message_timestamp_default,
+        server_default=utcnow(),
     )
 
     user_id = db.Column(
@@ -206,6 +393,131 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    # ArchivedMessage (partitions.py) sets this to True
+    archived = False
+
+    __table_args__ = (
+        db.Index('ix_messages_user_id_id', 'user_id', 'id'),
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message pushed into a follower's home timeline (see timeline.py)."""
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # message ids are time-ordered, so the primary key index
+    # (user_id, message_id) reads a timeline newest first
+
+
+class MessageTag(db.Model):
+    """A #tag used in a message (see tags.py)."""
+
+    __tablename__ = 'message_tags'
+
+    tag = db.Column(
+        db.String(140),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # the primary key (tag, message_id) reads a tag's messages newest first
+
+
+class Mention(db.Model):
+    """A user @mentioned in a message (see tags.py)."""
+
+    __tablename__ = 'mentions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # the primary key (user_id, message_id) reads a user's mentions
+    # newest first
+
+
+class IdempotencyKey(db.Model):
+    """Client-supplied key for a message post, so retries don't duplicate it.
+
+    Keys expire after IDEMPOTENCY_TTL seconds (see idempotency.py).
+    """
+
+    __tablename__ = 'idempotency_keys'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    key = db.Column(
+        db.String(64),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+
+class NodeLease(db.Model):
+    """A message id node held by one app process until it expires.
+
+    Processes without a configured NODE_ID lease one (see node_leases.py).
+    """
+
+    __tablename__ = 'node_leases'
+
+    node_id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    holder = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    expires_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -0,0 +1,169 @@
+"""Leasing message id nodes from the database.
+
+Every process making message ids needs a node id (0-1023, see
+snowflake.py) that no other running process has. With NODE_ID set that is
+up to whoever starts the process; otherwise each process leases one from
+the node_leases table when the app is created (creating the table if need
+be), or failing that the first time it makes an id:
+
+- it takes the lowest node whose lease has expired, or the next one never
+  used, with a conditional UPDATE (or an INSERT) so only one process can
+  win it;
+- a background thread renews it every NODE_LEASE_SECONDS / 3. Once half
+  the lease has passed unrenewed the process stops using the node and
+  leases again, so a stalled process never makes ids with a node another
+  one has taken over, even if their hosts' clocks differ a little;
+- a forked child leases a node of its own when it first makes an id, and
+  a process hands its node back when it exits.
+
+Leasing runs in its own transactions, apart from whatever session is
+making the id. Leasing from inside a flush, as a forked child's first id
+does, holds a second connection meanwhile, and on SQLite waits for the
+session's own write lock, so make ids in a fresh process before forking
+only with Postgres.
+"""
+
+import atexit
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from sqlalchemy import exc, func, select
+
+from models import db, NodeLease
+from snowflake import MAX_NODE_ID
+
+leases = NodeLease.__table__
+
+
+class NodeLeaser:
+    """This process's lease on a node id, for SnowflakeGenerator(lease=...)."""
+
+    def __init__(self, app):
+        self.app = app
+        self.seconds = app.config['NODE_LEASE_SECONDS']
+        self.pid = None
+        self.node = None
+        self.renewing = None
+        self.lock = threading.Lock()
+        atexit.register(self.release)
+
+    def start(self):
+        """Lease a node now, outside any session's transaction."""
+
+        try:
+            NodeLease.__table__.create(db.get_engine(self.app), checkfirst=True)
+            with self.lock:
+                self.acquire()
+        except exc.SQLAlchemyError as error:
+            self.app.logger.warning("Leasing a message id node when first needed: %s",
+                                    error)
+
+    def node_id(self):
+        """The leased node id, leasing it first if this process has none."""
+
+        with self.lock:
+            if self.pid != os.getpid() or time.monotonic() >= self.expires:
+                self.acquire()
+            return self.node
+
+    def held(self, since):
+        self.expires = since + self.seconds / 2
+
+    def keep_renewed(self, pid):
+        while True:
+            time.sleep(self.seconds / 3)
+            with self.lock:
+                if self.pid != pid or self.node is None:
+                    self.renewing = None
+                    return
+                try:
+                    self.renew()
+                except (exc.SQLAlchemyError, RuntimeError) as error:
+                    # leased again when the next id is made
+                    self.app.logger.warning("Lost message id node: %s", error)
+                    self.pid = self.renewing = None
+                    return
+
+    def acquire(self):
+        self.pid = os.getpid()
+        self.node = None
+        self.holder = f'{socket.gethostname()}:{self.pid}:{uuid4().hex[:8]}'
+        # others may win each free node first; give up once they all have
+        for _ in range(MAX_NODE_ID + 1):
+            started = time.monotonic()
+            node = self.claim()
+            if node is not None:
+                self.node = node
+                self.held(started)
+                if self.renewing != self.pid:
+                    self.renewing = self.pid
+                    threading.Thread(target=self.keep_renewed, args=(self.pid,),
+                                     daemon=True).start()
+                return
+        raise RuntimeError("Couldn't lease a message id node; set NODE_ID instead.")
+
+    def claim(self):
+        """Take a free node in one transaction; None if another process got it."""
+
+        now = datetime.utcnow()
+        values = dict(holder=self.holder, expires_at=now + timedelta(seconds=self.seconds))
+        try:
+            with db.get_engine(self.app).begin() as connection:
+                node = connection.execute(
+                    select([func.min(leases.c.node_id)])
+                    .where(leases.c.expires_at < now)).scalar()
+                if node is not None:
+                    taken = connection.execute(
+                        leases.update()
+                        .where((leases.c.node_id == node) & (leases.c.expires_at < now))
+                        .values(**values)).rowcount
+                    return node if taken else None
+
+                top = connection.execute(select([func.max(leases.c.node_id)])).scalar()
+                node = 0 if top is None else top + 1
+                if node > MAX_NODE_ID:
+                    raise RuntimeError(f"All {MAX_NODE_ID + 1} message id nodes are leased.")
+                connection.execute(leases.insert().values(node_id=node, **values))
+                return node
+        except exc.IntegrityError:
+            return None
+
+    def renew(self):
+        started = time.monotonic()
+        now = datetime.utcnow()
+        try:
+            with db.get_engine(self.app).begin() as connection:
+                kept = connection.execute(
+                    leases.update()
+                    .where((leases.c.node_id == self.node)
+                           & (leases.c.holder == self.holder))
+                    .values(expires_at=now + timedelta(seconds=self.seconds))).rowcount
+        except exc.SQLAlchemyError as error:
+            # keep the node until the lease runs out; try again meanwhile
+            self.app.logger.warning("Couldn't renew message id node %s: %s",
+                                    self.node, error)
+            return
+        if kept:
+            self.held(started)
+        else:
+            self.acquire()
+
+    def release(self):
+        """Hand the node back, so the next process can lease it at once."""
+
+        if self.node is None or self.pid != os.getpid():
+            return
+        try:
+            with db.get_engine(self.app).begin() as connection:
+                connection.execute(
+                    leases.update()
+                    .where((leases.c.node_id == self.node)
+                           & (leases.c.holder == self.holder))
+                    .values(expires_at=datetime.utcnow()))
+        except exc.SQLAlchemyError:
+            pass
+        self.pid = self.node = None
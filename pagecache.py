@@ -0,0 +1,263 @@
+"""Whole-response cache for pages anonymous visitors see.
+
+Anonymous visitors all get the same home page, profiles and user listing,
+so those views are wrapped in `cache_page`: for a logged-out GET with no
+pending flash messages, the response is stored under its path and query
+string and served from memory for PAGE_CACHE_TTL seconds.
+
+- Stale-while-revalidate: for PAGE_CACHE_STALE seconds after that, the old
+  response is still served at once while one background thread renders a
+  fresh copy.
+- Coalescing: when a key is missing, the first request renders it and
+  concurrent requests for the same key wait for that result instead of
+  all querying the database.
+- Invalidation: each page is tagged with what it shows ('users' for the
+  listing, 'user:<id>' for a profile). Committing a change to a user, or
+  to their messages, follows or likes, drops the pages with those tags.
+  Bulk updates that bypass the session (archiving, timeline rebuilds)
+  and other workers' changes are only picked up when the TTL runs out.
+
+Responses carry X-Cache: HIT, STALE or MISS. The cache is per process and
+holds at most PAGE_CACHE_MAX_ENTRIES responses, dropping the least
+recently used.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import Response, current_app, g, make_response, request, session
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import db, Follows, Likes, Message, User
+
+Entry = namedtuple('Entry', 'body status headers tags fresh_until stale_until')
+
+# headers that belong to one visitor, not the page
+PRIVATE_HEADERS = {'Set-Cookie'}
+
+
+class PageCache:
+    """Flask extension holding cached responses for this process."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config['PAGE_CACHE_MAX_ENTRIES']
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.refreshing = set()
+        self.version = 0
+        self.lock = threading.Lock()
+        app.extensions['page_cache'] = self
+
+    def lookup(self, key):
+        """(entry, state) with state 'fresh', 'stale' or None (missing)."""
+
+        entry = self.entries.get(key)
+        now = time.monotonic()
+        if entry is None or now >= entry.stale_until:
+            return None, None
+        self.entries.move_to_end(key)
+        return entry, 'fresh' if now < entry.fresh_until else 'stale'
+
+    def store(self, key, response, tags, version):
+        """Keep a rendered response, unless something changed meanwhile."""
+
+        if response.status_code != 200:
+            return
+        config = current_app.config
+        now = time.monotonic()
+        entry = Entry(response.get_data(),
+                      response.status_code,
+                      [(name, value) for name, value in response.headers
+                       if name not in PRIVATE_HEADERS],
+                      tags,
+                      now + config['PAGE_CACHE_TTL'],
+                      now + config['PAGE_CACHE_TTL'] + config['PAGE_CACHE_STALE'])
+
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key, tags, render, revalidate):
+        """The response for `key`, rendering it at most once at a time.
+
+        `render()` makes the response in this request; `revalidate()` makes
+        one outside any request, for background refreshes.
+        """
+
+        with self.lock:
+            entry, state = self.lookup(key)
+            if state == 'stale' and key not in self.refreshing:
+                self.refreshing.add(key)
+                threading.Thread(target=self.refresh,
+                                 args=(key, tags, revalidate, self.version),
+                                 daemon=True).start()
+            if entry is not None:
+                return cached_response(entry, 'HIT' if state == 'fresh' else 'STALE')
+
+            waiting = self.pending.get(key)
+            if waiting is None:
+                self.pending[key] = threading.Event()
+            version = self.version
+
+        if waiting is not None:
+            waiting.wait(current_app.config['PAGE_CACHE_WAIT'])
+            with self.lock:
+                entry, _ = self.lookup(key)
+            if entry is not None:
+                return cached_response(entry, 'HIT')
+            return render()
+
+        try:
+            response = render()
+            self.store(key, response, tags, version)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+
+    def refresh(self, key, tags, revalidate, version):
+        try:
+            with revalidate() as response:
+                self.store(key, response, tags, version)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def invalidate(self, tags):
+        """Drop every page tagged with any of `tags`."""
+
+        tags = set(tags)
+        if not tags:
+            return
+        with self.lock:
+            self.version += 1
+            for key in [key for key, entry in self.entries.items()
+                        if tags & entry.tags]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+
+
+def cached_response(entry, state):
+    response = Response(entry.body, entry.status, entry.headers)
+    response.headers['X-Cache'] = state
+    return response
+
+
+def cacheable():
+    return (current_app.config['PAGE_CACHE_ENABLED']
+            and request.method == 'GET'
+            and g.user is None
+            and '_flashes' not in session)
+
+
+class RevalidateContext:
+    """Renders a view for an anonymous GET outside the original request."""
+
+    def __init__(self, app, path, query_string, view, kwargs):
+        self.context = app.test_request_context(path, query_string=query_string)
+        self.app, self.view, self.kwargs = app, view, kwargs
+
+    def __enter__(self):
+        self.context.push()
+        try:
+            self.app.preprocess_request()
+            return make_response(self.view(**self.kwargs))
+        except Exception:
+            self.__exit__()
+            raise
+
+    def __exit__(self, *exc):
+        db.session.remove()
+        self.context.pop()
+
+
+def cache_page(tags=lambda **kwargs: ()):
+    """Cache a view's anonymous responses; `tags(**view_args)` for invalidation."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not cacheable():
+                return view(**kwargs)
+
+            app = current_app._get_current_object()
+            path, query_string = request.path, request.query_string
+
+            return app.extensions['page_cache'].get(
+                (path, query_string),
+                frozenset(tags(**kwargs)),
+                lambda: make_response(view(**kwargs)),
+                lambda: RevalidateContext(app, path, query_string, view, kwargs))
+
+        return wrapper
+    return decorator
+
+
+def invalidate_user(user_id):
+    """Drop cached pages showing this user (their profile and listings)."""
+
+    cache = db.get_app().extensions.get('page_cache')
+    if cache is not None:
+        cache.invalidate({'users', f'user:{user_id}'})
+
+
+##############################################################################
+# Invalidation on commit
+
+
+def tags_for(obj):
+    """Cache tags of the pages showing a changed row."""
+
+    if isinstance(obj, User):
+        tags = {'users', f'user:{obj.id}'}
+        state = inspect(obj)
+        for relationship in ('following', 'followers', 'likes'):
+            history = state.attrs[relationship].history
+            for other in list(history.added or ()) + list(history.deleted or ()):
+                if isinstance(other, User):
+                    tags.add(f'user:{other.id}')
+        return tags
+    if isinstance(obj, Message):
+        return {f'user:{obj.user_id}'}
+    if isinstance(obj, Follows):
+        return {f'user:{obj.user_being_followed_id}', f'user:{obj.user_following_id}'}
+    if isinstance(obj, Likes):
+        return {f'user:{obj.user_id}'}
+    return set()
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_tags(session, flush_context, instances):
+    tags = session.info.setdefault('page_cache_tags', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        tags |= tags_for(obj)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    tags = session.info.pop('page_cache_tags', None)
+    if tags:
+        cache = db.get_app().extensions.get('page_cache')
+        if cache is not None:
+            cache.invalidate(tags)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def forget_tags(session, previous_transaction):
+    session.info.pop('page_cache_tags', None)
@@ -0,0 +1,236 @@
+"""Monthly time partitions for messages, and archival of cold months.
+
+Feed queries read messages newest-first one time window at a time (the
+current month, then windows doubling in length going back), each window a
+range scan on the primary key, since message ids are time-ordered (see
+snowflake.py). Old months are only touched when the
+recent ones don't hold enough rows, which gives the effect of partition
+pruning without partitioning the table itself (the `likes` foreign key
+to messages.id rules that out).
+
+Months nobody reads any more can be archived: their messages are written to
+a gzipped JSON-lines file per month in MESSAGE_ARCHIVE_DIR and deleted from
+the table. Archived messages can still be shown (read-only) by
+`load_archived`. Manage partitions with `flask partitions`.
+"""
+
+import gzip
+import json
+import os
+from datetime import datetime
+
+from flask import current_app
+
+from models import db, Message, Likes, User
+from snowflake import first_id
+
+MANIFEST = 'manifest.json'
+
+# (archive dir, manifest mtime) -> {message id: month}
+_manifest_cache = {}
+
+
+def month_start(when):
+    """First instant of the month containing `when`."""
+
+    return datetime(when.year, when.month, 1)
+
+
+def add_months(month, n):
+    """The month `n` months after (or before, if negative) `month`."""
+
+    index = month.year * 12 + month.month - 1 + n
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def parse_month(key):
+    return datetime.strptime(key, '%Y-%m')
+
+
+def recent_messages(query, limit=100, now=None, before=None):
+    """The newest `limit` rows of `query`, a SELECT from messages, newest first.
+
+    Reads the current month first, then earlier windows of doubling length,
+    stopping as soon as enough rows are found or no older rows remain.
+    Pass the id of the last message of a page as `before` for the next one.
+    """
+
+    if before is not None:
+        query = query.where(Message.id < before)
+
+    oldest = db.session.execute(
+        query.with_only_columns([db.func.min(Message.id)])).scalar()
+    if oldest is None:
+        return []
+
+    end = None
+    start = month_start(now or datetime.utcnow())
+    span = 1
+    found = []
+
+    while True:
+        window = query.where(Message.id >= first_id(start))
+        if end is not None:
+            window = window.where(Message.id < first_id(end))
+
+        found.extend(db.session.execute(window
+                                        .order_by(Message.id.desc())
+                                        .limit(limit - len(found))))
+
+        if len(found) >= limit or first_id(start) <= oldest:
+            return found
+
+        end = start
+        span *= 2
+        start = add_months(start, -span)
+
+
+def live_months():
+    """[(month key, number of messages)] still in the messages table."""
+
+    year = db.extract('year', Message.timestamp)
+    month = db.extract('month', Message.timestamp)
+
+    rows = (db.session
+            .query(year, month, db.func.count())
+            .group_by(year, month)
+            .order_by(year, month))
+    return [(f'{int(y):04d}-{int(m):02d}', count) for y, m, count in rows]
+
+
+def archive_dir():
+    return current_app.config['MESSAGE_ARCHIVE_DIR']
+
+
+def archive_path(key, directory=None):
+    return os.path.join(directory or archive_dir(), f'messages-{key}.jsonl.gz')
+
+
+def read_manifest(directory=None):
+    """{month key: [message ids]} for everything archived so far."""
+
+    path = os.path.join(directory or archive_dir(), MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, directory=None):
+    path = os.path.join(directory or archive_dir(), MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+
+def read_archive(key, directory=None):
+    """Records of one archived month."""
+
+    path = archive_path(key, directory)
+    if not os.path.exists(path):
+        return []
+    with gzip.open(path, 'rt') as f:
+        return [json.loads(line) for line in f]
+
+
+def archive_month(key):
+    """Move one month of messages from the table into its archive file.
+
+    Each record keeps the ids of the users who liked it, since archiving
+    deletes the message's likes along with it. The file is written (merged
+    with any earlier archive of the same month) before the rows are
+    deleted. Returns the number of messages archived.
+    """
+
+    directory = archive_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    start = parse_month(key)
+    in_month = ((Message.id >= first_id(start)) &
+                (Message.id < first_id(add_months(start, 1))))
+
+    messages = Message.query.filter(in_month).order_by(Message.id).all()
+    if not messages:
+        return 0
+
+    liked_by = {}
+    for user_id, message_id in (db.session
+                                .query(Likes.user_id, Likes.message_id)
+                                .join(Message, Likes.message_id == Message.id)
+                                .filter(in_month)):
+        liked_by.setdefault(message_id, []).append(user_id)
+
+    records = read_archive(key, directory)
+    records.extend(dict(id=msg.id,
+                        text=msg.text,
+                        timestamp=msg.timestamp.isoformat(),
+                        user_id=msg.user_id,
+                        liked_by=liked_by.get(msg.id, []))
+                   for msg in messages)
+
+    path = archive_path(key, directory)
+    with gzip.open(path + '.tmp', 'wt') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    os.replace(path + '.tmp', path)
+
+    manifest = read_manifest(directory)
+    manifest[key] = [record['id'] for record in records]
+    write_manifest(manifest, directory)
+
+    Message.query.filter(in_month).delete(synchronize_session=False)
+    db.session.commit()
+
+    return len(messages)
+
+
+def archive_before(key):
+    """Archive every live month before month `key`; {month: count}."""
+
+    # '2020-5' is a valid key too, but doesn't compare as one
+    key = parse_month(key).strftime('%Y-%m')
+    return {month: archive_month(month)
+            for month, _ in live_months()
+            if month < key}
+
+
+class ArchivedMessage:
+    """Read-only stand-in for a Message that has been archived."""
+
+    archived = True
+
+    def __init__(self, record):
+        self.id = record['id']
+        self.text = record['text']
+        self.timestamp = datetime.fromisoformat(record['timestamp'])
+        self.user_id = record['user_id']
+        self.user = User.query.get(self.user_id)
+        self.liked_by_ids = record['liked_by']
+
+
+def load_archived(message_id):
+    """The archived message with this id, or None."""
+
+    directory = archive_dir()
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+
+    cache_key = (directory, os.path.getmtime(path))
+    months = _manifest_cache.get(cache_key)
+    if months is None:
+        months = {archived_id: key
+                  for key, ids in read_manifest(directory).items()
+                  for archived_id in ids}
+        _manifest_cache.clear()
+        _manifest_cache[cache_key] = months
+
+    key = months.get(message_id)
+    if key is None:
+        return None
+
+    for record in read_archive(key, directory):
+        if record['id'] == message_id:
+            message = ArchivedMessage(record)
+            return message if message.user else None
+    return None
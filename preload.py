@@ -0,0 +1,108 @@
+"""Preloading the app in a pre-fork server's master process.
+
+Every worker process building its own app compiles every template,
+configures every mapper and connects to the database once for itself, so
+memory grows with the number of workers. With WARBLER_PRELOAD=1 and the
+server loading the app before it forks, e.g.
+
+    WARBLER_PRELOAD=1 gunicorn --preload --workers 8 wsgi:app
+
+`preload` does that work once in the master:
+
+- loads every template, configures the mappers, and connects to the
+  database once to initialise its dialect;
+- fills the hot-author (celebrity) cache used by home timelines, and the
+  username/email availability filter (see availability.py);
+- closes the master's pooled connections, so no worker inherits a socket;
+- runs a full collection and then `gc.freeze()`, so the collector never
+  touches, and therefore never copies, the objects built so far. Their
+  pages stay shared between the workers until one of them writes to them.
+
+Forked workers must not use connections their parent opened. Engines
+discard any pooled connection made in another process on checkout, and
+each worker starts new thread pools for `gather` and shards, since
+threads don't survive a fork. Measure per-worker memory with
+benchmarks/bench_prefork.py.
+"""
+
+import gc
+import os
+
+from sqlalchemy import event, exc
+from sqlalchemy.orm import configure_mappers
+
+from app import warm_templates
+from gather import QueryExecutor
+from models import db
+from shards import MessageShards
+from timeline import celebrity_ids
+
+
+def engines(app):
+    engines = [db.get_engine(app)]
+    shards = app.extensions.get('shards')
+    if shards is not None:
+        engines.extend(shards.engines)
+    return engines
+
+
+def remember_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def check_pid(dbapi_connection, connection_record, connection_proxy):
+    if connection_record.info.get('pid') != os.getpid():
+        # don't close it: the process that opened it still uses it
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection belongs to another process; reconnecting")
+
+
+def guard_engine(engine):
+    """Make `engine` drop pooled connections opened in another process."""
+
+    if not event.contains(engine, 'checkout', check_pid):
+        event.listen(engine, 'connect', remember_pid)
+        event.listen(engine, 'checkout', check_pid)
+
+
+def warm(app):
+    """Do the per-process setup every worker would otherwise repeat."""
+
+    with app.app_context():
+        warm_templates()
+        configure_mappers()
+        try:
+            for engine in engines(app):
+                engine.connect().close()
+            celebrity_ids()
+            app.extensions['availability'].build()
+        except exc.SQLAlchemyError as error:
+            app.logger.warning("Preloading without the database: %s", error)
+
+
+def after_fork(app):
+    """Start the worker's own thread pools (and shard engines)."""
+
+    QueryExecutor(app)
+    if app.extensions.get('shards') is not None:
+        MessageShards(app)
+        for engine in app.extensions['shards'].engines:
+            guard_engine(engine)
+
+
+def preload(app):
+    """Warm `app` and freeze the heap before the server forks workers."""
+
+    for engine in engines(app):
+        guard_engine(engine)
+
+    warm(app)
+
+    for engine in engines(app):
+        engine.dispose()
+
+    os.register_at_fork(after_in_child=lambda: after_fork(app))
+
+    gc.collect()
+    gc.freeze()
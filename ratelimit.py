@@ -0,0 +1,185 @@
+"""Token-bucket rate limiting for write and auth endpoints.
+
+Each limited endpoint has a budget such as "10/minute": a bucket holding up
+to 10 tokens per client (the logged-in user, or the remote address),
+refilled at 10 tokens a minute. A request takes one token; with none left
+it gets a 429 with a Retry-After header. GET requests for an endpoint
+that also takes POSTs (showing the login form, say) aren't limited; the
+POSTs are, since those hash passwords or write. GET-only endpoints with
+a budget, such as /users/available, are limited on every request.
+
+A check is a single key lookup and some arithmetic, in one of two
+backends:
+
+- MemoryBackend: a dict in this process (limits are per worker)
+- SharedBackend: any store with atomic compare-and-set, so all workers
+  share one budget. LocalStore is an in-process stand-in for tests; a real
+  deployment plugs in an adapter with the same get/compare_and_set methods
+  around Redis or memcached.
+"""
+
+import math
+import threading
+import time
+
+from flask import Response, current_app, g, request
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_budget(budget):
+    """'10/minute' -> (capacity 10, refill rate in tokens per second)."""
+
+    count, _, period = budget.partition('/')
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period.strip()]
+
+
+def refill(state, capacity, rate, now):
+    """Bucket state (tokens, updated at) brought forward to `now`."""
+
+    if state is None:
+        return float(capacity), now
+    tokens, updated = state
+    return min(capacity, tokens + (now - updated) * rate), now
+
+
+class MemoryBackend:
+    """Buckets in a dict in this process.
+
+    Once more than `max_keys` buckets exist, those that have refilled
+    completely (and so carry no information) are dropped.
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        """Take a token; returns seconds to wait, or 0 if allowed."""
+
+        with self.lock:
+            bucket = self.buckets.get(key)
+            tokens, _ = refill(bucket and bucket[:2], capacity, rate, now)
+            if tokens < 1:
+                return (1 - tokens) / rate
+
+            tokens -= 1
+            full_at = now + (capacity - tokens) / rate
+            self.buckets[key] = (tokens, now, full_at)
+            if len(self.buckets) > self.max_keys:
+                self.prune(now)
+            return 0
+
+    def prune(self, now):
+        self.buckets = {key: bucket for key, bucket in self.buckets.items()
+                        if bucket[2] > now}
+
+
+class LocalStore:
+    """In-process stand-in for a shared store with compare-and-set."""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def compare_and_set(self, key, expected, value):
+        """Set `key` to `value` if it still holds `expected`."""
+
+        with self.lock:
+            if self.data.get(key) != expected:
+                return False
+            self.data[key] = value
+            return True
+
+
+class SharedBackend:
+    """Buckets in a store shared by every worker.
+
+    Updates use optimistic compare-and-set, retried if another worker
+    changed the bucket in between.
+    """
+
+    def __init__(self, store, retries=5):
+        self.store = store
+        self.retries = retries
+
+    def take(self, key, capacity, rate, now):
+        """Take a token; returns seconds to wait, or 0 if allowed."""
+
+        for _ in range(self.retries):
+            old = self.store.get(key)
+            tokens, _ = refill(old, capacity, rate, now)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            if self.store.compare_and_set(key, old, (tokens - 1, now)):
+                return 0
+
+        # heavy contention on one key: let the request through rather
+        # than fail it for a reason that isn't the client's budget
+        return 0
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'local': lambda: SharedBackend(LocalStore()),
+}
+
+
+class RateLimiter:
+    """Flask extension checking RATE_LIMITS before each request.
+
+    RATE_LIMIT_BACKEND names a backend in BACKENDS, or is a backend object
+    (e.g. a SharedBackend around a Redis adapter).
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the check; call after the blueprint so g.user is set."""
+
+        backend = app.config['RATE_LIMIT_BACKEND']
+        self.backend = BACKENDS[backend]() if isinstance(backend, str) else backend
+        self.budgets = {endpoint: parse_budget(budget)
+                        for endpoint, budget in app.config['RATE_LIMITS'].items()}
+
+        app.extensions['ratelimiter'] = self
+        app.before_request(self.check)
+
+    def client_key(self):
+        user = getattr(g, 'user', None)
+        if user is not None:
+            return f'user:{user.id}'
+        return f'ip:{request.remote_addr}'
+
+    def form_view(self):
+        """Whether this is a GET of an endpoint that also takes POSTs."""
+
+        rule = request.url_rule
+        return (request.method == 'GET' and rule is not None
+                and bool(rule.methods - {'GET', 'HEAD', 'OPTIONS'}))
+
+    def check(self):
+        """Answer 429 if the client is out of budget for this endpoint."""
+
+        if not current_app.config['RATE_LIMIT_ENABLED'] or self.form_view():
+            return None
+
+        budget = self.budgets.get(request.endpoint)
+        if budget is None:
+            return None
+
+        capacity, rate = budget
+        key = f'{request.endpoint}:{self.client_key()}'
+        wait = self.backend.take(key, capacity, rate, time.time())
+        if not wait:
+            return None
+
+        return Response("Too many requests, please try again later.", 429,
+                        {'Retry-After': str(math.ceil(wait))})
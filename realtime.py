@@ -0,0 +1,255 @@
+"""New warbles pushed to open home pages, as Server-Sent Events.
+
+The home page opens /stream with an EventSource. The view subscribes the
+connection to a channel per author it shows (the user and everyone they
+follow), and messages_add publishes each new message to its author's
+channel, so a follower's page prepends it without reloading the feed.
+
+Within a worker, the Hub hands each published event to the queues of the
+connections subscribed to its channel. Queues hold at most
+REALTIME_QUEUE_SIZE events: a connection that falls that far behind is
+told to reload (a `reset` event) and closed, rather than holding events
+or slowing the publisher. A worker takes at most REALTIME_MAX_SUBSCRIBERS
+connections; each is closed after REALTIME_STREAM_SECONDS (browsers
+reconnect by themselves), with a comment line every
+REALTIME_HEARTBEAT_SECONDS meanwhile so proxies keep it open.
+
+Messages are posted in any worker, so publishing goes through a broker
+shared by all of them, which hands every event to every worker's hub:
+
+- LocalBroker: an in-process stand-in, for tests and a single process
+  serving everything;
+- RedisBroker: Redis pub/sub, with the optional `redis` package;
+- or any object with the same publish/listen methods.
+
+Each open stream holds a connection (and with sync workers, a thread) for
+as long as it is open, so only the cooperative server (serve_async.py)
+serves /stream; elsewhere it is a 404. That server takes no posts itself,
+so it refuses to start with a broker that isn't shared between processes
+unless REALTIME_SINGLE_PROCESS is set.
+`python benchmarks/bench_sse.py` measures how many subscribers one such
+worker holds.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+from flask import current_app
+from werkzeug.wsgi import ClosingIterator
+
+from snowflake import id_time
+from tags import link_tags
+
+
+def channel(user_id):
+    return f'user:{user_id}'
+
+
+class LocalBroker:
+    """In-process stand-in for a pub/sub service shared by all workers."""
+
+    shared = False
+
+    def __init__(self, app=None):
+        self.listeners = []
+
+    def publish(self, channel, data):
+        """Send `data` (a string) to every listener, in every worker."""
+
+        for listener in self.listeners:
+            listener(channel, data)
+
+    def listen(self, callback):
+        """Call `callback(channel, data)` for everything published."""
+
+        self.listeners.append(callback)
+
+
+class RedisBroker:
+    """Redis pub/sub at REALTIME_REDIS_URL, shared by every process.
+
+    Each process listens from a thread of its own, started by its first
+    `listen`, and resubscribes if the connection drops.
+    """
+
+    shared = True
+    prefix = 'warbler:'
+
+    def __init__(self, app):
+        import redis
+
+        self.redis = redis
+        self.client = redis.Redis.from_url(app.config['REALTIME_REDIS_URL'])
+        self.listeners = []
+        self.listening = None
+
+    def publish(self, channel, data):
+        self.client.publish(self.prefix + channel, data)
+
+    def listen(self, callback):
+        self.listeners.append(callback)
+        if self.listening != os.getpid():
+            self.listening = os.getpid()
+            threading.Thread(target=self.receive, daemon=True).start()
+
+    def receive(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for message in pubsub.listen():
+                    channel = message['channel'].decode()[len(self.prefix):]
+                    data = message['data'].decode()
+                    for listener in self.listeners:
+                        listener(channel, data)
+            except self.redis.ConnectionError:
+                # events published meanwhile are lost; pages catch up on reload
+                time.sleep(1)
+
+
+BACKENDS = {
+    'local': LocalBroker,
+    'redis': RedisBroker,
+}
+
+
+class Subscription:
+    """One open stream's channels and queue of events."""
+
+    def __init__(self, channels, size):
+        self.channels = channels
+        self.queue = queue.Queue(size)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def events(self, heartbeat, lifetime):
+        """The stream's text: events as they come, then the end after `lifetime`."""
+
+        yield 'retry: 3000\n\n'
+        closes_at = time.monotonic() + lifetime
+        while not self.overflowed:
+            remaining = closes_at - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                yield self.queue.get(timeout=min(heartbeat, remaining))
+            except queue.Empty:
+                yield ': keepalive\n\n'
+        yield 'event: reset\ndata: {}\n\n'
+
+
+class Hub:
+    """This worker's open streams, by channel."""
+
+    def __init__(self, queue_size, max_subscribers):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.count = 0
+
+    def subscribe(self, channels):
+        """A Subscription to `channels`, or None if the worker is full."""
+
+        with self.lock:
+            if self.count >= self.max_subscribers:
+                return None
+            subscription = Subscription(channels, self.queue_size)
+            for name in channels:
+                self.channels.setdefault(name, set()).add(subscription)
+            self.count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for name in subscription.channels:
+                subscribers = self.channels.get(name)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.channels[name]
+            self.count -= 1
+
+    def deliver(self, channel, event):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+
+class Realtime:
+    """Flask extension with this worker's hub and the shared broker.
+
+    REALTIME_BACKEND names a broker in BACKENDS, or is a broker object.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        backend = config['REALTIME_BACKEND']
+        self.broker = BACKENDS[backend](app) if isinstance(backend, str) else backend
+        self.hub = Hub(config['REALTIME_QUEUE_SIZE'], config['REALTIME_MAX_SUBSCRIBERS'])
+        self.heartbeat = config['REALTIME_HEARTBEAT_SECONDS']
+        self.lifetime = config['REALTIME_STREAM_SECONDS']
+        # only processes holding streams listen, from their first one
+        self.listening = False
+        self.listen_lock = threading.Lock()
+        app.extensions['realtime'] = self
+
+    def enable_streams(self, app):
+        """Serve /stream from `app`, hearing of posts through the broker.
+
+        Streams only ever see posts published to their own process unless
+        the broker is shared, so that is required unless everything is
+        served by this one process (REALTIME_SINGLE_PROCESS).
+        """
+
+        if not (app.config['REALTIME_SINGLE_PROCESS']
+                or getattr(self.broker, 'shared', True)):
+            raise RuntimeError("/stream needs a REALTIME_BACKEND shared by all "
+                               "processes, e.g. 'redis'.")
+        app.config['REALTIME_STREAMS_ENABLED'] = True
+
+    def publish_message(self, user, message_id, text):
+        """Send a new message to its author's followers' open pages."""
+
+        data = json.dumps({
+            'id': message_id,
+            'user_id': user.id,
+            'username': user.username,
+            'image': current_app.extensions['images'].url_for(user.image_url, 'timeline'),
+            'timestamp': id_time(message_id).strftime('%d %B %Y'),
+            'html': str(link_tags(text)),
+        })
+        self.broker.publish(channel(user.id),
+                            f'id: {message_id}\nevent: warble\ndata: {data}\n\n')
+
+    def stream(self, user_ids):
+        """Events for new messages by `user_ids`, or None if the worker is full."""
+
+        with self.listen_lock:
+            if not self.listening:
+                self.listening = True
+                self.broker.listen(self.hub.deliver)
+        subscription = self.hub.subscribe([channel(user_id) for user_id in user_ids])
+        if subscription is None:
+            return None
+        # the server closes the response however the stream ends, even
+        # if the client left before it started
+        return ClosingIterator(subscription.events(self.heartbeat, self.lifetime),
+                               lambda: self.hub.unsubscribe(subscription))
+
+
+def realtime():
+    return current_app.extensions['realtime']
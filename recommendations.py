@@ -0,0 +1,132 @@
+"""Offline "who to follow" job for Warbler.
+
+Suggestions come from two sparse products over the social graph:
+
+- friends-of-friends: F x F, where F is the user -> followed-user matrix
+- co-likes: L x L^T, where L is the user -> liked-message matrix
+
+Both are computed row by row over adjacency lists, so no dense matrix is
+ever built. Each intermediate row is capped (`max_fanout`), which bounds
+the work per edge and keeps the job linear in the number of edges even
+when a few accounts have huge follower or like counts.
+
+Results are written to the `recommendations` table in one transaction and
+served from there; run the job with `flask recommend`.
+"""
+
+from collections import Counter, defaultdict
+from heapq import nlargest
+
+from models import db, Follows, Likes, Recommendation
+
+FOF_WEIGHT = 1.0
+COLIKE_WEIGHT = 0.5
+
+
+def adjacency(edges, max_fanout=None):
+    """Build {row: [cols]} from (row, col) pairs, capping each row."""
+
+    rows = defaultdict(list)
+    for row, col in edges:
+        cols = rows[row]
+        if max_fanout is None or len(cols) < max_fanout:
+            cols.append(col)
+    return rows
+
+
+def friends_of_friends(following, max_fanout=100):
+    """Sparse F x F: {user: Counter(candidate -> number of paths)}."""
+
+    scores = defaultdict(Counter)
+    for user_id, followed in following.items():
+        row = scores[user_id]
+        for followed_id in followed:
+            row.update(following.get(followed_id, ())[:max_fanout])
+    return scores
+
+
+def co_likes(likers, max_fanout=100):
+    """Sparse L x L^T: {user: Counter(candidate -> messages liked in common)}.
+
+    `likers` maps message id -> ids of users who liked it.
+    """
+
+    scores = defaultdict(Counter)
+    for users in likers.values():
+        users = users[:max_fanout]
+        for user_id in users:
+            scores[user_id].update(users)
+    return scores
+
+
+def compute_recommendations(follows, likes, top_n=10, max_fanout=100):
+    """Score candidates for every user and keep the best `top_n`.
+
+    `follows` is an iterable of (follower id, followed id) pairs and `likes`
+    of (user id, message id) pairs. Returns {user: [(candidate, score)]},
+    excluding the user themself and anyone they already follow.
+    """
+
+    following = adjacency(follows)
+    likers = adjacency(((m, u) for u, m in likes), max_fanout)
+
+    fof = friends_of_friends(following, max_fanout)
+    colike = co_likes(likers, max_fanout)
+
+    results = {}
+    for user_id in fof.keys() | colike.keys():
+        scores = Counter()
+        for candidate, n in fof.get(user_id, {}).items():
+            scores[candidate] += FOF_WEIGHT * n
+        for candidate, n in colike.get(user_id, {}).items():
+            scores[candidate] += COLIKE_WEIGHT * n
+
+        scores.pop(user_id, None)
+        for followed_id in following.get(user_id, ()):
+            scores.pop(followed_id, None)
+
+        best = nlargest(top_n, scores.items(), key=lambda item: (item[1], -item[0]))
+        if best:
+            results[user_id] = best
+
+    return results
+
+
+def refresh_recommendations(top_n=10, max_fanout=100, batch_size=1000):
+    """Recompute the `recommendations` table from `follows` and `likes`.
+
+    Replaces all rows in a single transaction, so readers see either the
+    previous suggestions or the new ones. Returns the number of rows written.
+    """
+
+    follows = (db.session
+               .query(Follows.user_following_id, Follows.user_being_followed_id)
+               .yield_per(batch_size))
+    likes = (db.session
+             .query(Likes.user_id, Likes.message_id)
+             .yield_per(batch_size))
+
+    results = compute_recommendations(follows, likes, top_n, max_fanout)
+
+    table = Recommendation.__table__
+    db.session.execute(table.delete())
+
+    batch = []
+    written = 0
+    for user_id, best in results.items():
+        for rank, (candidate, score) in enumerate(best, start=1):
+            batch.append(dict(user_id=user_id,
+                              recommended_user_id=candidate,
+                              rank=rank,
+                              score=score))
+        if len(batch) >= batch_size:
+            db.session.execute(table.insert(), batch)
+            written += len(batch)
+            batch = []
+
+    if batch:
+        db.session.execute(table.insert(), batch)
+        written += len(batch)
+
+    db.session.commit()
+    return written
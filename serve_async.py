@@ -0,0 +1,84 @@
+"""Cooperative serving mode for the read-heavy routes.
+
+Run with:
+
+    WARBLER_ENV=production python serve_async.py --port 5001
+
+Serves the same app (and models) as the sync workers, but on gevent's event
+loop: psycopg2 is made cooperative with psycogreen, so a request waiting on
+the database yields to the others instead of pinning a worker. One process
+can then hold many more concurrent connections for the read routes.
+
+Only the endpoints in READ_ENDPOINTS are answered here; the front proxy
+should send those paths (GET /, /users, /users/<id>, /messages/<id>,
+/stream, /static) to this server and everything else to the sync workers,
+which keeps bcrypt and write transactions off the event loop. Only this
+server answers /stream, and since messages are posted elsewhere it needs
+a shared REALTIME_BACKEND such as 'redis' (see realtime.py).
+
+Requires the optional `gevent` and `psycogreen` packages.
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse
+
+from flask import abort, request
+from gevent.pywsgi import WSGIServer
+from psycogreen.gevent import patch_psycopg
+
+from app import create_app
+
+READ_ENDPOINTS = {
+    'warbler.homepage',
+    'warbler.users_show',
+    'warbler.messages_show',
+    'warbler.list_users',
+    'warbler.stream',
+    'static',
+}
+
+# Greenlets share the process's connection pool, so it must be large enough
+# for the connections we expect to be waiting on the database at once.
+POOL_SIZE = 50
+
+
+def create_async_app(profile=None, pool_size=POOL_SIZE):
+    """Build the app for cooperative serving of the read routes."""
+
+    patch_psycopg()
+
+    app = create_app(profile)
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': pool_size,
+            'max_overflow': pool_size,
+        }
+
+    app.extensions['realtime'].enable_streams(app)
+
+    @app.before_request
+    def only_read_routes():
+        """Leave everything but the read routes to the sync workers."""
+
+        if request.endpoint not in READ_ENDPOINTS or request.method != 'GET':
+            abort(404)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE)
+    args = parser.parse_args()
+
+    app = create_async_app(pool_size=args.pool_size)
+    WSGIServer((args.host, args.port), app).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
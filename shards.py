@@ -0,0 +1,313 @@
+"""Horizontal sharding of messages and likes by user id.
+
+With MESSAGE_SHARDS set to a list of database URLs, a user's messages, and
+the likes they make, are stored in shard number `user_id % len(shards)`
+instead of the main database. Users, follows and everything else stay in
+the main database. Shards only hold `messages` and `likes` tables, without
+foreign keys, since the users they refer to live elsewhere; create them
+with `flask shards init`. The number of shards can't change once data is
+written, as that would move users to other shards.
+
+The helpers at the bottom are what views use for sharded data. Each picks
+the user's shard, or for a home feed queries every shard holding a
+followed user in parallel and merges the results newest first. Message ids
+are time-ordered and unique across shards (see snowflake.py), so a merge
+only compares ids.
+
+Writes to shards don't go through the main session, so the helpers drop
+cached pages for the user themselves (see pagecache.py).
+
+Without MESSAGE_SHARDS the helpers use the main database as before, with
+pushed timelines, monthly windows and idempotency keys. Those rely on
+joins and foreign keys to messages that don't cross databases, so they
+are not used for sharded messages (nor are likes in recommendations).
+"""
+
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import (BigInteger, Column, DateTime, Index, Integer, MetaData,
+                        String, Table, create_engine, func, select)
+
+from feeds import feed_messages, feed_select, load_feed, with_authors
+from idempotency import add_message_once
+from models import db, Follows, Likes, Message, User
+from pagecache import invalidate_user
+from partitions import recent_messages
+from snowflake import id_time
+from timeline import home_timeline
+
+metadata = MetaData()
+
+messages = Table(
+    'messages', metadata,
+    Column('id', BigInteger, primary_key=True, autoincrement=False),
+    Column('text', String(140), nullable=False),
+    Column('timestamp', DateTime, nullable=False),
+    Column('user_id', Integer, nullable=False),
+    Index('ix_messages_user_id_id', 'user_id', 'id'),
+)
+
+likes = Table(
+    'likes', metadata,
+    Column('user_id', Integer, primary_key=True),
+    Column('message_id', BigInteger, primary_key=True),
+)
+
+
+class ShardedMessage:
+    """Read-only stand-in for a Message stored in a shard, for its own page."""
+
+    archived = False
+
+    def __init__(self, row, user=None):
+        self.id = row.id
+        self.text = row.text
+        self.timestamp = row.timestamp
+        self.user_id = row.user_id
+        self.user = user
+
+
+class MessageShards:
+    """Flask extension holding an engine per shard, if MESSAGE_SHARDS is set.
+
+    Queries that go to several shards run on a thread pool, one task per
+    shard, each on its own pooled connection.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        urls = app.config['MESSAGE_SHARDS']
+        if not urls:
+            app.extensions.pop('shards', None)
+            return
+
+        self.engines = [create_engine(url) for url in urls]
+        self.executor = ThreadPoolExecutor(max_workers=len(urls),
+                                           thread_name_prefix='shard')
+        app.extensions['shards'] = self
+
+    def create_all(self):
+        for engine in self.engines:
+            metadata.create_all(engine)
+
+    def drop_all(self):
+        for engine in self.engines:
+            metadata.drop_all(engine)
+
+    def shard_of(self, user_id):
+        return self.engines[user_id % len(self.engines)]
+
+    def scatter(self, queries):
+        """Run {engine: query} in parallel; returns a list of row lists."""
+
+        def run(engine, query):
+            with engine.connect() as connection:
+                return connection.execute(query).fetchall()
+
+        futures = [self.executor.submit(run, engine, query)
+                   for engine, query in queries.items()]
+        return [future.result() for future in futures]
+
+    def add_message(self, user_id, text):
+        message_id = current_app.extensions['message_ids'].next_id()
+        with self.shard_of(user_id).begin() as connection:
+            connection.execute(messages.insert().values(
+                id=message_id, text=text, timestamp=id_time(message_id),
+                user_id=user_id))
+        return message_id
+
+    def delete_message(self, user_id, message_id):
+        with self.shard_of(user_id).begin() as connection:
+            connection.execute(messages.delete().where(
+                (messages.c.id == message_id) & (messages.c.user_id == user_id)))
+
+    def delete_user(self, user_id):
+        """Delete a user's messages and the likes they made."""
+
+        with self.shard_of(user_id).begin() as connection:
+            connection.execute(messages.delete().where(messages.c.user_id == user_id))
+            connection.execute(likes.delete().where(likes.c.user_id == user_id))
+
+    def feed(self, user_ids, limit, before=None):
+        """Newest `limit` rows by any of `user_ids`, from every shard needed."""
+
+        by_shard = {}
+        for user_id in user_ids:
+            by_shard.setdefault(self.shard_of(user_id), []).append(user_id)
+
+        queries = {}
+        for engine, ids in by_shard.items():
+            query = select([messages]).where(messages.c.user_id.in_(ids))
+            if before is not None:
+                query = query.where(messages.c.id < before)
+            queries[engine] = query.order_by(messages.c.id.desc()).limit(limit)
+
+        merged = heapq.merge(*self.scatter(queries),
+                             key=lambda row: row.id, reverse=True)
+        return [row for _, row in zip(range(limit), merged)]
+
+    def find(self, message_ids):
+        """Rows for these message ids, looked up on every shard."""
+
+        if not message_ids:
+            return []
+        query = select([messages]).where(messages.c.id.in_(message_ids))
+        rows = self.scatter({engine: query for engine in self.engines})
+        return [row for shard_rows in rows for row in shard_rows]
+
+    def toggle_like(self, user_id, message_id):
+        """Like or unlike; returns True if the message is now liked."""
+
+        mine = (likes.c.user_id == user_id) & (likes.c.message_id == message_id)
+        with self.shard_of(user_id).begin() as connection:
+            if connection.execute(likes.delete().where(mine)).rowcount:
+                return False
+            connection.execute(likes.insert().values(user_id=user_id,
+                                                     message_id=message_id))
+            return True
+
+    def liked_ids(self, user_id, message_ids=None):
+        """Ids of the messages `user_id` likes (among `message_ids`, if given)."""
+
+        query = select([likes.c.message_id]).where(likes.c.user_id == user_id)
+        if message_ids is not None:
+            query = query.where(likes.c.message_id.in_(message_ids))
+        with self.shard_of(user_id).connect() as connection:
+            return {message_id for message_id, in connection.execute(query)}
+
+    def count(self, table, user_id):
+        query = select([func.count()]).where(table.c.user_id == user_id)
+        with self.shard_of(user_id).connect() as connection:
+            return connection.execute(query).scalar()
+
+    def message_count(self, user_id):
+        return self.count(messages, user_id)
+
+    def like_count(self, user_id):
+        return self.count(likes, user_id)
+
+
+def message_shards():
+    """The app's MessageShards, or None if messages aren't sharded."""
+
+    return db.get_app().extensions.get('shards')
+
+
+def with_users(rows):
+    """ShardedMessages for `rows`, with their authors loaded in one query."""
+
+    user_ids = {row.user_id for row in rows}
+    users = {user.id: user for user in
+             User.query.filter(User.id.in_(user_ids))} if user_ids else {}
+    return [ShardedMessage(row, users[row.user_id])
+            for row in rows if row.user_id in users]
+
+
+def user_messages(user_id, limit, before=None):
+    """A user's newest messages, as FeedMessages, for users_show."""
+
+    shards = message_shards()
+    if shards is None:
+        query = feed_select().where(Message.user_id == user_id)
+        return feed_messages(recent_messages(query, limit=limit, before=before))
+    return with_authors(shards.feed([user_id], limit, before))
+
+
+def home_messages(user, limit, before=None):
+    """Newest messages by `user` and the people they follow, as FeedMessages."""
+
+    shards = message_shards()
+    if shards is None:
+        return home_timeline(user, limit=limit, before=before)
+
+    followed = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == user.id))
+    user_ids = [user.id] + [user_id for user_id, in followed]
+    return with_authors(shards.feed(user_ids, limit, before))
+
+
+def post_message(user, text, key=None):
+    """Post a message for messages_add.
+
+    Returns (message id, created), as add_message_once. Keys are ignored
+    when messages are sharded, since they only refer to the main database.
+    """
+
+    shards = message_shards()
+    if shards is None:
+        message, created = add_message_once(user, text, key)
+        return message.id, created
+    message_id = shards.add_message(user.id, text)
+    invalidate_user(user.id)
+    return message_id, True
+
+
+def find_message(message_id):
+    """The message with this id, or None."""
+
+    shards = message_shards()
+    if shards is None:
+        return Message.query.get(message_id)
+    found = with_users(shards.find([message_id]))
+    return found[0] if found else None
+
+
+def delete_user_messages(user):
+    """Before deleting `user`, delete their sharded messages and likes.
+
+    Unsharded, the database cascades the delete instead.
+    """
+
+    shards = message_shards()
+    if shards is not None:
+        shards.delete_user(user.id)
+
+
+def delete_message(message):
+    shards = message_shards()
+    if shards is None:
+        db.session.delete(message)
+        db.session.commit()
+    else:
+        shards.delete_message(message.user_id, message.id)
+        invalidate_user(message.user_id)
+
+
+def toggle_like(user, message):
+    """Like or unlike `message` as `user`; returns True if now liked."""
+
+    shards = message_shards()
+    if shards is not None:
+        liked = shards.toggle_like(user.id, message.id)
+        invalidate_user(user.id)
+        return liked
+
+    # both a primary key lookup, rather than loading all of user.likes
+    like = Likes.query.get((user.id, message.id))
+    if like is None:
+        db.session.add(Likes(user_id=user.id, message_id=message.id))
+    else:
+        db.session.delete(like)
+    db.session.commit()
+    return like is None
+
+
+def liked_messages(user):
+    """The messages `user` likes, as FeedMessages, for the likes page."""
+
+    shards = message_shards()
+    if shards is None:
+        # walks the user's range of the likes primary key, newest first
+        query = (feed_select(Likes.__table__.join(Message.__table__,
+                                                  Likes.message_id == Message.id))
+                 .where(Likes.user_id == user.id)
+                 .order_by(Likes.message_id.desc()))
+        return load_feed(query)
+    rows = shards.find(list(shards.liked_ids(user.id)))
+    return with_authors(sorted(rows, key=lambda row: row.id, reverse=True))
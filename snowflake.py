@@ -0,0 +1,171 @@
+"""Time-ordered 64-bit message ids, generated in-process.
+
+An id is the milliseconds since EPOCH, then the id of the node (app
+process) that made it, then a per-node sequence number:
+
+    | 41 bits: ms since 2010-01-01 | 10 bits: node | 12 bits: sequence |
+
+Ordering messages by id therefore orders them by time (k-sorted: ids from
+different nodes in the same millisecond are in no particular order), so
+feeds sort and page on the primary key, and a time range is an id range
+(see first_id). Nodes never need to talk to each other or the database to
+hand out ids; they only need distinct node ids, either configured (NODE_ID)
+or leased from the database (see node_leases.py).
+
+The app's generator is app.extensions['message_ids'], chosen by the
+MESSAGE_ID_GENERATOR setting: a name in GENERATORS, or any object with a
+`next_id(when=None)` method returning ids in this layout.
+"""
+
+import os
+import threading
+from datetime import datetime, timedelta
+
+EPOCH = datetime(2010, 1, 1)
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+# ids for "now" rarely need more sequences than this in one millisecond;
+# the generator remembers the milliseconds where they did
+BUSY_SEQUENCE = 1 << (SEQUENCE_BITS - 1)
+TIMESTAMP_SHIFT = NODE_BITS + SEQUENCE_BITS
+
+
+def millis(when):
+    """Whole milliseconds from EPOCH to `when`."""
+
+    if when < EPOCH:
+        raise ValueError(f"{when} is before the id epoch {EPOCH}")
+    return (when - EPOCH) // timedelta(milliseconds=1)
+
+
+def now_millis():
+    return millis(datetime.utcnow())
+
+
+def first_id(when):
+    """The lowest id a message created at `when` can have (0 before EPOCH)."""
+
+    return millis(max(when, EPOCH)) << TIMESTAMP_SHIFT
+
+
+def id_time(message_id):
+    """When the message with this id was created, to the millisecond."""
+
+    return EPOCH + timedelta(milliseconds=message_id >> TIMESTAMP_SHIFT)
+
+
+def id_node(message_id):
+    """The node that generated this id."""
+
+    return (message_id >> SEQUENCE_BITS) & MAX_NODE_ID
+
+
+class SnowflakeGenerator:
+    """Thread-safe id generator for one node.
+
+    Ids for "now" always increase, even if the clock steps back (ids keep
+    using the last millisecond seen) or more than 4096 are needed in one
+    millisecond (ids borrow the next one). Ids for a time before the last
+    one issued, as in backfills, take that time's millisecond with a
+    separate sequence counting down from the top, and move on to the next
+    millisecond once it meets the sequences "now" ids used there (or runs
+    out). This remembers each backdated millisecond, so a long backfill
+    costs memory in proportion to the distinct times it covers. Only this
+    generator remembers them: a new process, or a new lease on the same
+    node, starts again from the top, so two runs backdating ids to the
+    same millisecond on one node can repeat ids. Backfill each period in
+    one run (renumber_legacy_ids moves each message once).
+
+    The node is either `node_id`, which must be unique per process, or
+    whatever `lease.node_id()` returns when each id is made (see
+    node_leases.py); a new node starts its sequences afresh.
+    """
+
+    def __init__(self, node_id=None, clock=now_millis, lease=None):
+        if (node_id is None) == (lease is None):
+            raise ValueError("a generator needs either a node id or a lease")
+        if node_id is not None and not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f"node id must be between 0 and {MAX_NODE_ID}")
+
+        self.clock = clock
+        self.lease = lease
+        self.lock = threading.Lock()
+        self.reset(node_id)
+
+    def reset(self, node_id):
+        self.node_id = node_id
+        self.last_ms = -1
+        self.sequence = 0
+        # first millisecond with "now" ids; those with more than
+        # BUSY_SEQUENCE of them -> highest sequence used
+        self.first_ms = None
+        self.busy = {}
+        # backdated millisecond -> lowest sequence used
+        self.past = {}
+
+    def next_id(self, when=None):
+        """A new id for a message created at `when` (default now)."""
+
+        with self.lock:
+            if self.lease is not None:
+                node_id = self.lease.node_id()
+                if node_id != self.node_id:
+                    self.reset(node_id)
+
+            ms = self.clock() if when is None else millis(when)
+            if ms < self.last_ms and when is not None:
+                return self.past_id(ms)
+            return self.now_id(ms)
+
+    def now_id(self, ms):
+        if ms > self.last_ms:
+            self.leave_ms()
+            self.last_ms = ms
+            self.sequence = 0
+            if self.first_ms is None:
+                self.first_ms = ms
+        elif self.sequence == SEQUENCE_MASK:
+            self.leave_ms()
+            self.last_ms += 1
+            self.sequence = 0
+        else:
+            self.sequence += 1
+        return self.compose(self.last_ms, self.sequence)
+
+    def leave_ms(self):
+        if self.sequence >= BUSY_SEQUENCE:
+            self.busy[self.last_ms] = self.sequence
+
+    def past_id(self, ms):
+        # counts down from the top, away from the low sequences "now" ids
+        # used; "now" ids only ever take milliseconds after these
+        while ms < self.last_ms:
+            low = self.past.get(ms, SEQUENCE_MASK + 1)
+            if self.first_ms is not None and ms >= self.first_ms:
+                floor = self.busy.get(ms, BUSY_SEQUENCE - 1)
+            else:
+                floor = -1
+            if low - 1 > floor:
+                self.past[ms] = low - 1
+                return self.compose(ms, low - 1)
+            ms += 1
+        return self.now_id(ms)
+
+    def compose(self, ms, sequence):
+        return ms << TIMESTAMP_SHIFT | self.node_id << SEQUENCE_BITS | sequence
+
+
+GENERATORS = {
+    'snowflake': SnowflakeGenerator,
+}
+
+
+def make_generator(setting, node_id=None, lease=None):
+    """The generator named by MESSAGE_ID_GENERATOR, or the object itself."""
+
+    if isinstance(setting, str):
+        return GENERATORS[setting](node_id, lease=lease)
+    return setting
@@ -0,0 +1,162 @@
+"""#tags and @mentions, indexed for their feeds.
+
+A message's text is parsed when it is added, in a Message `after_insert`
+hook (like timeline fan-out), and each #tag it uses gets a row in
+`message_tags`, each user it @mentions a row in `mentions`. Both are
+keyed (tag or user id, message id), and message ids are time-ordered, so
+/tags/<tag> and /users/<id>/mentions are range scans of a primary key,
+newest first, paged with `before`.
+
+Tags are case-insensitive and stored lowercased. Mentions are of existing
+usernames, matched exactly, and stored by user id so they survive renames.
+Deleting a message deletes its rows through the foreign keys.
+
+Messages added before these tables existed, or bulk-inserted (seed.py),
+are indexed with `flask tags backfill`, which parses ranges of message ids
+in parallel. Like pushed timelines, this relies on joins to messages, so
+messages in shards (shards.py) are not indexed.
+"""
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from markupsafe import Markup, escape
+from sqlalchemy import event, select
+
+from feeds import feed_select, load_feed
+from models import db, Mention, Message, MessageTag, User
+
+# not after a word character, so "a#b" and "me@example.com" don't count
+TAG_PATTERN = re.compile(r'(?<![\w#&])#(\w+)')
+MENTION_PATTERN = re.compile(r'(?<![\w@])@(\w+)')
+
+BACKFILL_CHUNK_SIZE = 5000
+BACKFILL_WORKERS = 4
+
+
+def extract_tags(text):
+    """The distinct #tags in `text`, lowercased, in order of use."""
+
+    return list(dict.fromkeys(tag.lower() for tag in TAG_PATTERN.findall(text)))
+
+
+def extract_mentions(text):
+    """The distinct @usernames in `text`, in order of use."""
+
+    return list(dict.fromkeys(MENTION_PATTERN.findall(text)))
+
+
+def index_messages(connection, messages):
+    """Write the tag and mention rows for (id, text) pairs; returns the count."""
+
+    tag_rows = []
+    mentioned = {}
+    for message_id, text in messages:
+        tag_rows.extend(dict(tag=tag, message_id=message_id)
+                        for tag in extract_tags(text))
+        for username in extract_mentions(text):
+            mentioned.setdefault(username, []).append(message_id)
+
+    mention_rows = []
+    if mentioned:
+        users = connection.execute(select([User.id, User.username])
+                                   .where(User.username.in_(list(mentioned))))
+        mention_rows = [dict(user_id=user_id, message_id=message_id)
+                        for user_id, username in users
+                        for message_id in mentioned[username]]
+
+    if tag_rows:
+        connection.execute(MessageTag.__table__.insert(), tag_rows)
+    if mention_rows:
+        connection.execute(Mention.__table__.insert(), mention_rows)
+    return len(tag_rows) + len(mention_rows)
+
+
+@event.listens_for(Message, 'after_insert')
+def index_message(mapper, connection, message):
+    index_messages(connection, [(message.id, message.text)])
+
+
+def tag_messages(tag, limit, before=None):
+    """The newest `limit` messages tagged #`tag`, as FeedMessages."""
+
+    index = MessageTag.__table__
+    query = (feed_select(index.join(Message.__table__,
+                                    index.c.message_id == Message.id))
+             .where(index.c.tag == tag.lower()))
+    if before is not None:
+        query = query.where(index.c.message_id < before)
+    return load_feed(query.order_by(index.c.message_id.desc()).limit(limit))
+
+
+def mention_messages(user_id, limit, before=None):
+    """The newest `limit` messages mentioning a user, as FeedMessages."""
+
+    index = Mention.__table__
+    query = (feed_select(index.join(Message.__table__,
+                                    index.c.message_id == Message.id))
+             .where(index.c.user_id == user_id))
+    if before is not None:
+        query = query.where(index.c.message_id < before)
+    return load_feed(query.order_by(index.c.message_id.desc()).limit(limit))
+
+
+def link_tags(text):
+    """`text`, escaped, with each #tag linked to its feed."""
+
+    return Markup(TAG_PATTERN.sub(
+        lambda match: f'<a href="/tags/{match.group(1).lower()}">#{match.group(1)}</a>',
+        str(escape(text))))
+
+
+##############################################################################
+# Backfill
+
+
+def chunk_bounds(chunk_size):
+    """[start, end) message id ranges of about `chunk_size` messages each.
+
+    The last range ends after the newest message now; messages added
+    later have higher ids and are indexed as they are added.
+    """
+
+    ids = Message.__table__.c.id
+    start = db.session.execute(select([db.func.min(ids)])).scalar()
+    newest = db.session.execute(select([db.func.max(ids)])).scalar()
+    while start is not None:
+        end = db.session.execute(select([ids])
+                                 .where(ids >= start)
+                                 .order_by(ids)
+                                 .offset(chunk_size)
+                                 .limit(1)).scalar()
+        yield start, end if end is not None else newest + 1
+        start = end
+
+
+def backfill_chunk(engine, start, end):
+    """Re-index the messages with ids in [start, end), in one transaction."""
+
+    in_range = lambda column: (column >= start) & (column < end)
+    with engine.begin() as connection:
+        # deleting first also takes SQLite's write lock before reading
+        for index in (MessageTag.__table__, Mention.__table__):
+            connection.execute(index.delete().where(in_range(index.c.message_id)))
+        messages = connection.execute(select([Message.id, Message.text])
+                                      .where(in_range(Message.id))).fetchall()
+        return len(messages), index_messages(connection, messages)
+
+
+def backfill_tags(chunk_size=BACKFILL_CHUNK_SIZE, workers=BACKFILL_WORKERS):
+    """Index every message, `workers` chunks at a time.
+
+    Chunks replace whatever rows their messages had, so the backfill can
+    be rerun. Returns (messages, rows written).
+    """
+
+    engine = db.engine
+    with ThreadPoolExecutor(max_workers=workers,
+                            thread_name_prefix='tags-backfill') as pool:
+        futures = [pool.submit(backfill_chunk, engine, start, end)
+                   for start, end in chunk_bounds(chunk_size)]
+        results = [future.result() for future in futures]
+    return sum(n for n, _ in results), sum(rows for _, rows in results)
@@ -0,0 +1,106 @@
+"""Static asset build and serving tests"""
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from app import create_app
+from assets import build_assets, minify_css, prune_assets
+from images import IMMUTABLE_CACHE_CONTROL
+
+app = create_app('testing')
+
+
+class AssetsTestCase(TestCase):
+    """Test fingerprinted, precompressed static files."""
+
+    def setUp(self):
+        self.assets = app.extensions['assets']
+        self.build_dir = tempfile.mkdtemp()
+        self.assets.build_dir = self.build_dir
+        self.manifest = self.assets.build()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.assets.manifest = {}
+        shutil.rmtree(self.build_dir)
+
+    def built(self, path):
+        with open(os.path.join(self.build_dir, self.manifest[path]), 'rb') as f:
+            return f.read()
+
+    def test_minify_css(self):
+        """Comments and spaces go; descendant selectors stay"""
+
+        css = "/* nav */\n.nav > li a :hover {\n  color: red;\n  margin: 0 auto;\n}\n"
+        self.assertEqual(minify_css(css), ".nav>li a :hover{color:red;margin:0 auto}")
+
+    def test_build(self):
+        """Files get content hashes, and CSS points at built images"""
+
+        css_name = self.manifest['stylesheets/style.css']
+        self.assertRegex(css_name, r'^stylesheets/style\.[0-9a-f]{12}\.css$')
+
+        css = self.built('stylesheets/style.css').decode()
+        self.assertIn(f"url(/assets/{self.manifest['images/nav-bg.png']})", css)
+        self.assertNotIn('/static/', css)
+
+        css_path = os.path.join(self.build_dir, css_name)
+        self.assertTrue(os.path.exists(css_path + '.gz'))
+        png_path = os.path.join(self.build_dir, self.manifest['images/nav-bg.png'])
+        self.assertFalse(os.path.exists(png_path + '.gz'))
+
+    def test_rebuild_keeps_old_files(self):
+        """A rebuild leaves the previous build's files until they are pruned"""
+
+        static_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_dir)
+        with open(os.path.join(static_dir, 'app.css'), 'w') as f:
+            f.write('body { color: red; }' * 50)
+        old = build_assets(static_dir, self.build_dir)['app.css']
+
+        with open(os.path.join(static_dir, 'app.css'), 'w') as f:
+            f.write('body { color: blue; }' * 50)
+        new = build_assets(static_dir, self.build_dir)['app.css']
+
+        self.assertNotEqual(old, new)
+        self.assertTrue(os.path.exists(os.path.join(self.build_dir, old)))
+        self.assertTrue(os.path.exists(os.path.join(self.build_dir, old + '.gz')))
+
+        removed = prune_assets(self.build_dir, {'app.css': new})
+        self.assertGreaterEqual(removed, 2)
+        self.assertFalse(os.path.exists(os.path.join(self.build_dir, old)))
+        self.assertTrue(os.path.exists(os.path.join(self.build_dir, new + '.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.build_dir, 'stylesheets')))
+
+    def test_serve_precompressed(self):
+        """The gzip variant is sent to clients accepting it, cached forever"""
+
+        url = f"/assets/{self.manifest['stylesheets/style.css']}"
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(gzip.decompress(resp.get_data()),
+                         self.built('stylesheets/style.css'))
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.get_data(), self.built('stylesheets/style.css'))
+
+        self.assertEqual(self.client.get('/assets/manifest.json').status_code, 404)
+        self.assertEqual(self.client.get('/assets/../app.py').status_code, 404)
+
+    def test_pages_link_built_assets(self):
+        """Templates link the built stylesheet and default images"""
+
+        html = self.client.get('/signup').get_data(as_text=True)
+
+        self.assertIn(f"/assets/{self.manifest['stylesheets/style.css']}", html)
+        with app.app_context():
+            self.assertEqual(
+                app.extensions['images'].url_for('/static/images/default-pic.png', 'card'),
+                f"/assets/{self.manifest['images/default-pic.png']}")
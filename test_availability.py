@@ -0,0 +1,115 @@
+"""Username/email availability tests"""
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from app import create_app
+from availability import BloomFilter
+from models import db, User, Message, Follows, Likes
+
+app = create_app('testing')
+
+
+class BloomFilterTestCase(TestCase):
+    """Test the filter itself."""
+
+    def test_no_false_negatives(self):
+        """Everything added is found; few other values are"""
+
+        bloom = BloomFilter(1000, 0.01)
+        for n in range(1000):
+            bloom.add(f'user{n}')
+
+        self.assertTrue(all(f'user{n}' in bloom for n in range(1000)))
+        false_positives = sum(f'other{n}' in bloom for n in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class AvailabilityTestCase(TestCase):
+    """Test checking availability before signups and renames."""
+
+    @classmethod
+    def setUpClass(cls):
+        db.create_all()
+
+    def setUp(self):
+        # so the mapper events update this app's filter
+        self.context = app.app_context()
+        self.context.push()
+
+        db.session.rollback()
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.user = User.signup(username="taken", email="taken@test.com",
+                                password="password", image_url=None)
+        db.session.commit()
+        self.user_id = self.user.id
+
+        self.availability = app.extensions['availability']
+        self.availability.build()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.context.pop()
+
+    def available(self, **query):
+        resp = self.client.get('/users/available', query_string=query)
+        self.assertEqual(resp.status_code, 200)
+        return resp.json['available']
+
+    def test_available_endpoint(self):
+        """Taken usernames and emails are reported as such"""
+
+        self.assertFalse(self.available(username="taken"))
+        self.assertFalse(self.available(email="taken@test.com"))
+        self.assertTrue(self.available(username="free"))
+        self.assertTrue(self.available(email="free@test.com"))
+        self.assertEqual(self.client.get('/users/available').status_code, 400)
+
+    def test_free_values_skip_database(self):
+        """Only values the filter may contain are looked up"""
+
+        stats = self.availability.stats
+        before = dict(stats)
+        for n in range(200):
+            self.availability.is_taken('username', f'free{n}')
+        self.availability.is_taken('username', 'taken')
+
+        checks = stats['checks'] - before['checks']
+        queries = stats['queries'] - before['queries']
+        self.assertEqual(checks, 201)
+        self.assertGreaterEqual(queries, 1)
+        self.assertLess(queries, 20)
+
+    def test_signup_taken_skips_hashing(self):
+        """A taken username is refused without hashing the password"""
+
+        with patch('models.bcrypt.generate_password_hash') as generate:
+            resp = self.client.post('/signup', data={
+                "username": "taken", "email": "new@test.com",
+                "password": "password"})
+
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("That username is already taken.", html)
+        generate.assert_not_called()
+        self.assertEqual(User.query.count(), 1)
+
+    def test_signup_and_rename_update_filter(self):
+        """New and changed names are taken straight away"""
+
+        User.signup(username="newbie", email="newbie@test.com",
+                    password="password", image_url=None)
+        db.session.commit()
+        self.assertTrue(self.availability.is_taken('username', 'newbie'))
+
+        user = User.query.get(self.user_id)
+        user.username = "renamed"
+        db.session.commit()
+        self.assertEqual(self.availability.stale, 1)
+        self.assertTrue(self.availability.is_taken('username', 'renamed'))
+        self.assertFalse(self.availability.is_taken('username', 'taken'))
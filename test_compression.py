@@ -0,0 +1,70 @@
+"""Response compression tests"""
+
+import gzip
+import zlib
+from unittest import TestCase
+
+from flask import Response
+
+from app import create_app
+from compression import gzip_chunks
+
+app = create_app('testing')
+
+PAGE = '<li class="list-group-item">warble</li>\n' * 200
+
+
+@app.route('/test-compression/<kind>')
+def compression_page(kind):
+    if kind == 'small':
+        return '<p>hi</p>'
+    if kind == 'image':
+        return Response(b'\x89PNG' + b'\x00' * 4000, mimetype='image/png')
+    if kind == 'streamed':
+        return Response(chunk for chunk in PAGE.splitlines(keepends=True))
+    return PAGE
+
+
+class CompressionTestCase(TestCase):
+    """Test compressing responses on the fly."""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def get(self, kind, encoding='gzip'):
+        return self.client.get(f'/test-compression/{kind}',
+                               headers={'Accept-Encoding': encoding})
+
+    def test_large_page_compressed(self):
+        """Pages over the threshold are gzipped for clients accepting it"""
+
+        resp = self.get('page')
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertLess(len(resp.get_data()), len(PAGE) / 10)
+        self.assertEqual(gzip.decompress(resp.get_data()).decode(), PAGE)
+
+    def test_not_compressed(self):
+        """Small bodies, images and clients not accepting gzip are left alone"""
+
+        for kind, encoding in (('small', 'gzip'), ('image', 'gzip'), ('page', 'identity')):
+            resp = self.get(kind, encoding)
+            self.assertNotIn('Content-Encoding', resp.headers, kind)
+
+    def test_streamed_page_compressed(self):
+        """Streamed pages are compressed chunk by chunk"""
+
+        resp = self.get('streamed')
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', resp.headers)
+        self.assertEqual(gzip.decompress(resp.get_data()).decode(), PAGE)
+
+    def test_chunks_flushed(self):
+        """Each chunk's data is sent before the next chunk is read"""
+
+        chunks = gzip_chunks(iter([b'first ' * 50, b'second ' * 50]), 6)
+
+        self.assertEqual(zlib.decompressobj(31).decompress(next(chunks)),
+                         b'first ' * 50)
@@ -0,0 +1,66 @@
+"""Feed read model tests"""
+
+from collections import namedtuple
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import select
+
+from app import create_app
+from feeds import FeedMessage, feed_select, load_feed, with_authors
+from models import db, Message, User
+
+app = create_app('testing')
+
+# a shard's messages row
+Row = namedtuple('Row', 'id text timestamp user_id')
+
+
+class FeedsTestCase(TestCase):
+    """Test reading feeds into FeedMessages."""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        author = User.signup("author", "author@test.com", "password", None)
+        db.session.commit()
+        for day in (1, 2, 3):
+            db.session.add(Message(text=f"day {day}", user_id=author.id,
+                                   timestamp=datetime(2020, 1, day)))
+        db.session.commit()
+        self.author_id = author.id
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+
+    def test_load_feed(self):
+        """Rows become FeedMessages sharing one Author per user"""
+
+        query = feed_select().order_by(Message.id.desc())
+        feed = load_feed(query)
+
+        self.assertEqual([m.text for m in feed], ["day 3", "day 2", "day 1"])
+        self.assertIsInstance(feed[0], FeedMessage)
+        self.assertEqual(feed[0].timestamp, datetime(2020, 1, 3))
+        self.assertEqual(feed[0].user.username, "author")
+        self.assertIs(feed[0].user, feed[2].user)
+        self.assertFalse(hasattr(feed[0], '__dict__'))
+
+    def test_with_authors(self):
+        """Author-less rows get their authors; rows by missing users are dropped"""
+
+        rows = db.session.execute(
+            select([Message.__table__]).order_by(Message.id)).fetchall()
+        orphan = Row(1, "orphan", datetime(2020, 1, 1), -1)
+
+        feed = with_authors(rows + [orphan])
+
+        self.assertEqual([m.text for m in feed], ["day 1", "day 2", "day 3"])
+        self.assertEqual({m.user.id for m in feed}, {self.author_id})
@@ -0,0 +1,127 @@
+"""Parallel query executor tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+import time
+from unittest import TestCase, mock
+from models import db, User, Message
+from gather import QueryExecutor, QueryTimeout, Task, gather
+
+from app import create_app, CURR_USER_KEY
+
+app = create_app('testing')
+
+# counts to a hundred million: takes many seconds unless cancelled
+SLOW_QUERY = """
+WITH RECURSIVE counter(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM counter)
+SELECT count(*) FROM (SELECT n FROM counter LIMIT 100000000) AS numbers
+"""
+
+
+class GatherTestCase(TestCase):
+    """Test running queries concurrently, with timeouts and cancellation."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
+    def setUp(self):
+        """Add a user with a message."""
+
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        self.user = User(email="gather@test.com", username="gatheruser",
+                         password="HASHED_PASSWORD")
+        db.session.add(self.user)
+        db.session.commit()
+        db.session.add(Message(text="hello", user_id=self.user.id))
+        db.session.commit()
+        self.user_id = self.user.id
+
+    def tearDown(self):
+        app.config['PARALLEL_QUERIES'] = True
+        app.config['QUERY_TIMEOUT'] = 5
+        self.ctx.pop()
+
+    def test_results(self):
+        """Parallel and serial runs give the same results"""
+
+        queries = self.user.count_queries()
+        queries['texts'] = lambda: [m.text for m in
+                                    Message.query.filter_by(user_id=self.user_id)]
+
+        parallel = gather(queries)
+        app.config['PARALLEL_QUERIES'] = False
+        serial = gather(self.user.count_queries())
+
+        self.assertEqual(parallel.pop('texts'), ["hello"])
+        self.assertEqual(parallel, serial)
+        self.assertEqual(parallel['messages'], 1)
+
+    def test_concurrent(self):
+        """Queries run at the same time, not one after another"""
+
+        def slow():
+            time.sleep(0.2)
+            return User.query.count()
+
+        start = time.monotonic()
+        results = gather({n: slow for n in range(4)})
+
+        self.assertEqual(list(results.values()), [1] * 4)
+        self.assertLess(time.monotonic() - start, 0.6)
+
+    def test_timeout_default(self):
+        """A late query with a default gives the default"""
+
+        results = gather({
+            'late': Task(lambda: time.sleep(0.5) or "done", timeout=0.05, default="late"),
+            'quick': lambda: "quick",
+        })
+
+        self.assertEqual(results, {'late': "late", 'quick': "quick"})
+
+    def test_timeout_cancels_query(self):
+        """A late query is cancelled on the database, freeing its worker"""
+
+        size = app.config['QUERY_POOL_SIZE']
+        app.config['QUERY_POOL_SIZE'] = 1
+        QueryExecutor(app)
+        try:
+            start = time.monotonic()
+            with self.assertRaises(QueryTimeout):
+                gather({'slow': Task(lambda: db.session.execute(SLOW_QUERY).scalar(),
+                                     timeout=0.2)})
+
+            # the one worker is free again once the statement is cancelled
+            self.assertEqual(gather({'next': lambda: User.query.count()}),
+                             {'next': 1})
+            self.assertLess(time.monotonic() - start, 3)
+        finally:
+            app.config['QUERY_POOL_SIZE'] = size
+            QueryExecutor(app)
+
+    def test_timeout_page(self):
+        """A page whose feed query times out answers 503"""
+
+        def stuck(user_id, limit, before):
+            time.sleep(0.5)
+            return []
+
+        app.config['QUERY_TIMEOUT'] = 0.05
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            with mock.patch('app.user_messages', stuck):
+                resp = c.get(f'/users/{self.user_id}')
+
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(resp.headers['Retry-After'], '1')
@@ -0,0 +1,146 @@
+"""Idempotent message posting tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+import threading
+from datetime import datetime, timedelta
+from unittest import TestCase, mock
+from models import db, User, Message, IdempotencyKey
+import idempotency
+from idempotency import add_message_once
+
+from app import create_app, CURR_USER_KEY
+
+app = create_app('testing')
+
+
+class IdempotencyTestCase(TestCase):
+    """Test that retried and concurrent posts with one key add one message."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        IdempotencyKey.query.delete()
+        db.session.commit()
+
+        self.client = app.test_client()
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        db.session.commit()
+        self.user_id = self.testuser.id
+
+    def post(self, c, text, key=None, header=None):
+        data = {"text": text}
+        if key:
+            data["idempotency_key"] = key
+        headers = {"Idempotency-Key": header} if header else {}
+        return c.post("/messages/new", data=data, headers=headers)
+
+    def test_form_has_key(self):
+        """The new message form carries a fresh key"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            html = c.get("/messages/new").get_data(as_text=True)
+            self.assertIn('name="idempotency_key" type="hidden" value="', html)
+
+    def test_replay(self):
+        """Reposting with the same key redirects without a second message"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            first = self.post(c, "Hello", key="abc")
+            again = self.post(c, "Hello", key="abc")
+            header = self.post(c, "Hello", header="abc")
+
+            self.assertEqual(first.status_code, 302)
+            self.assertEqual(again.location, first.location)
+            self.assertEqual(header.location, first.location)
+            self.assertEqual(Message.query.count(), 1)
+
+            self.post(c, "Hello", key="def")
+            self.post(c, "Hello")
+            self.post(c, "Hello")
+            self.assertEqual(Message.query.count(), 4)
+
+    def test_invalid_header(self):
+        """A header key too long for the column, or not plain ASCII, is refused"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            self.assertEqual(self.post(c, "Hello", header="k" * 100).status_code, 400)
+            self.assertEqual(self.post(c, "Hello", header="a key").status_code, 400)
+            self.assertEqual(self.post(c, "Hello", header="k" * 64).status_code, 302)
+            self.assertEqual(Message.query.count(), 1)
+
+    def test_expired_keys(self):
+        """An expired key is purged and no longer replays"""
+
+        user = User.query.get(self.user_id)
+        with app.test_request_context():
+            msg, created = add_message_once(user, "old", "abc")
+            self.assertTrue(created)
+            IdempotencyKey.query.update(
+                {"created_at": datetime.utcnow() - timedelta(days=2)})
+            db.session.commit()
+
+            self.assertNotEqual(add_message_once(user, "new", "xyz")[0].id, msg.id)
+            self.assertEqual(IdempotencyKey.query.count(), 1)
+            self.assertEqual(add_message_once(user, "old", "abc")[1], True)
+
+    def test_lost_race(self):
+        """A post that loses the race on its key replays the winner"""
+
+        user = User.query.get(self.user_id)
+        with app.test_request_context():
+            winner, _ = add_message_once(user, "Hello", "abc")
+            winner_id = winner.id
+
+            # as if the other request committed between lookup and insert
+            replays = [None, idempotency.find_replay(user.id, "abc")]
+            with mock.patch('idempotency.find_replay', side_effect=replays):
+                loser, created = add_message_once(user, "Hello", "abc")
+
+            self.assertEqual(loser.id, winner_id)
+            self.assertFalse(created)
+            self.assertEqual(Message.query.count(), 1)
+
+    def test_concurrent_duplicates(self):
+        """Simultaneous posts with one key add exactly one message"""
+
+        start = threading.Barrier(4)
+        statuses = []
+
+        def submit():
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.user_id
+                start.wait()
+                statuses.append(self.post(c, "Hello", key="same").status_code)
+
+        threads = [threading.Thread(target=submit) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [302] * 4)
+        self.assertEqual(Message.query.filter_by(user_id=self.user_id).count(), 1)
+        self.assertEqual(IdempotencyKey.query.count(), 1)
@@ -0,0 +1,183 @@
+"""Image proxy tests"""
+
+import io
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+from unittest import TestCase, mock, skipUnless
+
+from app import create_app
+from images import (DiskCache, ImageError, IMMUTABLE_CACHE_CONTROL,
+                    check_host, content_type, fetch_http)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+app = create_app('testing')
+
+AVATAR_URL = 'https://images.example.com/avatar.png'
+
+
+def png(width, height):
+    """A blank RGB PNG of this size."""
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+
+    rows = b''.join(b'\x00' + b'\x80' * width * 3 for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows))
+            + chunk(b'IEND', b''))
+
+
+class StubUpstream:
+    """Serves fixed images by URL, counting fetches."""
+
+    def __init__(self, images):
+        self.images = images
+        self.fetched = []
+
+    def __call__(self, url):
+        self.fetched.append(url)
+        if url not in self.images:
+            raise ImageError(f"{url} not found")
+        return self.images[url]
+
+
+class ImageProxyTestCase(TestCase):
+    """Test thumbnails of external images."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.proxy = app.extensions['images']
+        self.proxy.cache = DiskCache(self.cache_dir, 1024 * 1024)
+        self.proxy.failures.clear()
+        self.upstream = self.proxy.fetch = StubUpstream({AVATAR_URL: png(300, 200)})
+        self.client = app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_thumbnail_url(self):
+        """External URLs are signed; local ones are left alone"""
+
+        with app.app_context():
+            self.assertEqual(self.proxy.url_for('/static/images/default-pic.png', 'card'),
+                             '/static/images/default-pic.png')
+            url = self.proxy.url_for(AVATAR_URL, 'timeline')
+
+        self.assertTrue(url.startswith('/images/timeline/'))
+        self.assertEqual(self.client.get(url.replace('timeline', 'huge')).status_code, 404)
+        self.assertEqual(self.client.get(url + 'x').status_code, 404)
+
+    def test_fetched_once(self):
+        """The image is fetched once and then served from disk, cacheably"""
+
+        url = self.proxy.url_for(AVATAR_URL, 'timeline')
+
+        first = self.client.get(url)
+        second = self.client.get(url)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(content_type(first.get_data()), first.mimetype)
+        self.assertEqual(second.get_data(), first.get_data())
+        self.assertEqual(self.upstream.fetched, [AVATAR_URL])
+
+        etag = first.headers['ETag']
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+
+    @skipUnless(Image, "Pillow is not installed")
+    def test_sizes(self):
+        """Each size is scaled and cropped to its dimensions"""
+
+        for size, dimensions in (('timeline', (48, 48)), ('header', (1200, 360))):
+            resp = self.client.get(self.proxy.url_for(AVATAR_URL, size))
+            self.assertEqual(Image.open(io.BytesIO(resp.get_data())).size, dimensions)
+        self.assertEqual(len(self.upstream.fetched), 1)
+
+    def test_failure_shows_default(self):
+        """An unavailable image redirects to the default, without refetching"""
+
+        url = self.proxy.url_for('https://images.example.com/missing.png', 'card')
+
+        for _ in range(2):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 302)
+            self.assertTrue(resp.location.endswith('/static/images/default-pic.png'))
+        self.assertEqual(len(self.upstream.fetched), 1)
+
+    def test_private_addresses_refused(self):
+        """Local and private addresses are never fetched"""
+
+        for url in ('http://127.0.0.1/a.png', 'http://10.0.0.5/a.png',
+                    'http://[::1]/a.png', 'file:///etc/passwd'):
+            with self.assertRaises(ImageError):
+                check_host(url)
+
+    def test_connects_to_checked_address(self):
+        """A host that resolves elsewhere after the check is still refused"""
+
+        def resolved(address):
+            return [(2, 1, 6, '', (address, 80))]
+
+        # public when first checked, then rebound to a local address
+        answers = [resolved('93.184.216.34'), resolved('127.0.0.1')]
+        with mock.patch('socket.getaddrinfo', side_effect=answers), \
+                mock.patch('socket.create_connection') as connect:
+            with self.assertRaises(ImageError):
+                fetch_http('http://rebind.example.com/a.png', 5, 1000)
+        connect.assert_not_called()
+
+        with mock.patch('socket.getaddrinfo', return_value=resolved('93.184.216.34')), \
+                mock.patch('socket.create_connection', side_effect=OSError) as connect:
+            with self.assertRaises(ImageError):
+                fetch_http('http://images.example.com/a.png', 5, 1000)
+        self.assertEqual(connect.call_args[0][0], ('93.184.216.34', 80))
+
+    def test_failures_bounded(self):
+        """Only the most recent IMAGE_FAILURE_MAX failed URLs are remembered"""
+
+        self.proxy.max_failures = 3
+        try:
+            for n in range(5):
+                self.proxy.remember_failure(f'https://images.example.com/{n}.png')
+        finally:
+            self.proxy.max_failures = app.config['IMAGE_FAILURE_MAX']
+
+        self.assertEqual(list(self.proxy.failures),
+                         [f'https://images.example.com/{n}.png' for n in (2, 3, 4)])
+
+
+class DiskCacheTestCase(TestCase):
+    """Test the size-bounded disk cache."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_evicts_least_recently_used(self):
+        """Past its size the cache drops the files read least recently"""
+
+        cache = DiskCache(self.cache_dir, 2500)
+        cache.write('aa1', b'x' * 1000)
+        cache.write('aa2', b'x' * 1000)
+        now = time.time()
+        os.utime(cache.path('aa1'), (now - 200, now - 200))
+        os.utime(cache.path('aa2'), (now - 100, now - 100))
+        cache.read('aa1')
+        cache.write('aa3', b'x' * 1000)
+
+        self.assertIsNotNone(cache.read('aa1'))
+        self.assertIsNone(cache.read('aa2'))
+        self.assertIsNotNone(cache.read('aa3'))
@@ -0,0 +1,72 @@
+"""Likes table migration tests"""
+
+from unittest import TestCase
+
+from sqlalchemy import (BigInteger, Column, Integer, MetaData, Table,
+                        inspect)
+
+from app import create_app
+from likes_schema import migrate_likes
+from models import db, Likes, Message, User
+
+app = create_app('testing')
+
+# the likes table as it was before its composite key
+OLD_LIKES = Table(
+    'likes', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer),
+    Column('message_id', BigInteger, unique=True),
+)
+
+
+class LikesSchemaTestCase(TestCase):
+    """Test rebuilding an old likes table."""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        db.session.commit()
+
+        user = User.signup("fan", "fan@test.com", "password", None)
+        db.session.commit()
+        message = Message(text="liked", user_id=user.id)
+        db.session.add(message)
+        db.session.commit()
+        self.user_id, self.message_id = user.id, message.id
+
+        db.session.remove()
+        Likes.__table__.drop(db.engine)
+        OLD_LIKES.create(db.engine)
+
+    def tearDown(self):
+        db.session.remove()
+        if 'id' in [c['name'] for c in inspect(db.engine).get_columns('likes')]:
+            OLD_LIKES.drop(db.engine)
+            Likes.__table__.create(db.engine)
+        self.context.pop()
+
+    def test_migrate(self):
+        """Pairs are kept, rows missing a user are dropped, and keys change"""
+
+        db.engine.execute(OLD_LIKES.insert(), [
+            dict(user_id=self.user_id, message_id=self.message_id),
+            dict(user_id=None, message_id=1),
+        ])
+
+        self.assertEqual(migrate_likes(), 1)
+        self.assertIsNone(migrate_likes())
+
+        schema = inspect(db.engine)
+        self.assertEqual(schema.get_pk_constraint('likes')['constrained_columns'],
+                         ['user_id', 'message_id'])
+        self.assertIn(['message_id', 'user_id'],
+                      [index['column_names'] for index in schema.get_indexes('likes')])
+
+        user = User.query.get(self.user_id)
+        self.assertEqual([m.id for m in user.likes], [self.message_id])
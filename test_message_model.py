@@ -1,13 +1,13 @@
 """Message model tests"""
 
-import os
+from datetime import datetime, timedelta
 from unittest import TestCase
 from models import db, User, Message, Follows, Likes
+from snowflake import first_id, id_time
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+from app import create_app
 
-from app import app
-db.create_all()
+app = create_app('testing')
 
 # Data for creating test users
 
@@ -27,6 +27,12 @@ USER_2_DATA = {
 class MessageModelTestCase(TestCase):
     """Test message model."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
     def setUp(self):
         """Clear any errors, clear tables, create test client."""
 
@@ -55,6 +61,33 @@ class MessageModelTestCase(TestCase):
         self.assertTrue(m.timestamp)
         self.assertTrue(m.id)
 
+    def test_message_timestamps(self):
+        """Each message gets its own time, and ids are ordered by time"""
+
+        u = User(**USER_1_DATA)
+        db.session.add(u)
+        db.session.commit()
+
+        m1 = Message(text="first", user_id=u.id)
+        db.session.add(m1)
+        db.session.commit()
+        m2 = Message(text="second", user_id=u.id)
+        db.session.add(m2)
+        db.session.commit()
+
+        self.assertGreater(m2.id, m1.id)
+        self.assertLessEqual(m1.timestamp, m2.timestamp)
+        self.assertLess(datetime.utcnow() - m2.timestamp, timedelta(minutes=1))
+        self.assertEqual(id_time(m1.id), m1.timestamp)
+
+        old = Message(text="old", user_id=u.id, timestamp=datetime(2015, 6, 1))
+        db.session.add(old)
+        db.session.commit()
+
+        self.assertLess(old.id, m1.id)
+        self.assertGreaterEqual(old.id, first_id(datetime(2015, 6, 1)))
+        self.assertLess(old.id, first_id(datetime(2015, 6, 1, 0, 0, 0, 1000)))
+
     def test_message_like(self):
         """Test one user liking another user's message"""
 
@@ -97,3 +130,19 @@ class MessageModelTestCase(TestCase):
         self.assertNotIn(m, u2.likes)
         self.assertEqual(len(likes), 0)
         self.assertNotIn(u2, m.liked_by)
+
+    def test_message_liked_by_many(self):
+        """Several users can like the same message"""
+
+        u1 = User(**USER_1_DATA)
+        u2 = User(**USER_2_DATA)
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        m = Message(text="Test message", user_id=u1.id)
+        u1.likes.append(m)
+        u2.likes.append(m)
+        db.session.commit()
+
+        self.assertEqual(Likes.query.filter_by(message_id=m.id).count(), 2)
+        self.assertEqual(set(m.liked_by), {u1, u2})
@@ -5,28 +5,18 @@
 #    FLASK_ENV=production python -m unittest test_message_views.py
 
 
-import os
 from unittest import TestCase
 
 from models import db, connect_db, Message, User
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+# Build the app with the 'testing' profile (see config.py), which points
+# at the test database and turns off CSRF. Importing it no longer touches
+# the schema: tables are created once per test case in setUpClass, and in
+# each test we'll delete the data and create fresh new clean test data
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+from app import create_app, CURR_USER_KEY
 
-
-# Now we can import app
-
-from app import app, CURR_USER_KEY
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
+app = create_app('testing')
 
 # Data for creating other user
 USER_DATA = {
@@ -35,14 +25,16 @@ USER_DATA = {
     "password": "password",
     "image_url": "static/images/test.png"}
 
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
-
 
 class MessageViewTestCase(TestCase):
     """Test views for messages."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
     def setUp(self):
         """Create test client, add sample data."""
 
@@ -265,3 +257,35 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn('<p>Sign up now to get your own personalized timeline!</p>', html)
             self.assertIn('<div class="alert alert-danger">Access unauthorized.</div>', html)
+
+    def test_home_feed_streamed(self):
+        """Test home feed renders the same when streamed, flash included"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            m = Message(text="Streamed message", user_id=self.testuser.id)
+            db.session.add(m)
+            db.session.commit()
+
+            app.config['STREAM_TEMPLATES'] = True
+            app.config['STREAM_BUFFER_SIZE'] = 2
+            try:
+                resp = c.post("/login",
+                              data={"username": "testuser", "password": "testuser"},
+                              follow_redirects=True)
+                self.assertTrue(resp.is_streamed)
+                html = resp.get_data(as_text=True)
+
+                # flash was consumed by the streamed page
+                resp = c.get('/')
+                next_html = resp.get_data(as_text=True)
+            finally:
+                app.config['STREAM_TEMPLATES'] = False
+                app.config['STREAM_BUFFER_SIZE'] = 40
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('<p>Streamed message</p>', html)
+            self.assertIn('Hello, testuser!', html)
+            self.assertNotIn('Hello, testuser!', next_html)
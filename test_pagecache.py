@@ -0,0 +1,166 @@
+"""Anonymous page cache tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+import threading
+import time
+from unittest import TestCase
+from flask import Response
+from models import db, User, Message
+
+from app import create_app, CURR_USER_KEY
+
+app = create_app('testing')
+
+
+class PageCacheTestCase(TestCase):
+    """Test caching, invalidation, stale serving and coalescing."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
+    def setUp(self):
+        """Turn the cache on; add a user."""
+
+        # invalidation finds the cache through the current app
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        self.cache = app.extensions['page_cache']
+        self.cache.clear()
+        app.config['PAGE_CACHE_ENABLED'] = True
+
+        self.client = app.test_client()
+        self.user = User(email="cache@test.com", username="cacheuser",
+                         password="HASHED_PASSWORD", bio="first bio")
+        db.session.add(self.user)
+        db.session.commit()
+        self.user_id = self.user.id
+
+    def tearDown(self):
+        app.config['PAGE_CACHE_ENABLED'] = False
+        app.config['PAGE_CACHE_TTL'] = 30
+        self.cache.max_entries = app.config['PAGE_CACHE_MAX_ENTRIES']
+        self.ctx.pop()
+
+    def get(self, url):
+        resp = self.client.get(url)
+        return resp.headers.get('X-Cache'), resp.get_data(as_text=True)
+
+    def test_anonymous_cached(self):
+        """Anonymous pages are cached per path and query string"""
+
+        self.assertEqual(self.get('/users')[0], 'MISS')
+        self.assertEqual(self.get('/users')[0], 'HIT')
+        self.assertEqual(self.get('/users?q=cache')[0], 'MISS')
+        self.assertEqual(self.get('/')[0], 'MISS')
+        self.assertEqual(self.get('/')[0], 'HIT')
+
+    def test_logged_in_not_cached(self):
+        """Logged-in visitors and pending flashes bypass the cache"""
+
+        self.get(f'/users/{self.user_id}')
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            resp = c.get(f'/users/{self.user_id}')
+            self.assertNotIn('X-Cache', resp.headers)
+
+            c.get('/logout')
+            resp = c.get(f'/users/{self.user_id}')
+            self.assertNotIn('X-Cache', resp.headers)
+            self.assertIn('successfully logged out', resp.get_data(as_text=True))
+
+    def test_invalidated_on_change(self):
+        """Changing a user or posting a message drops their cached pages"""
+
+        url = f'/users/{self.user_id}'
+        self.get(url)
+        self.get('/users')
+        self.assertEqual(self.get(url)[0], 'HIT')
+
+        self.user.bio = "second bio"
+        db.session.commit()
+
+        state, html = self.get(url)
+        self.assertEqual(state, 'MISS')
+        self.assertIn('second bio', html)
+        self.assertEqual(self.get('/users')[0], 'MISS')
+
+        db.session.add(Message(text="fresh warble", user_id=self.user_id))
+        db.session.commit()
+
+        state, html = self.get(url)
+        self.assertEqual(state, 'MISS')
+        self.assertIn('fresh warble', html)
+
+    def test_stale_while_revalidate(self):
+        """Expired pages are served stale while refreshed in the background"""
+
+        app.config['PAGE_CACHE_TTL'] = 0.2
+        url = f'/users/{self.user_id}'
+        self.get(url)
+        time.sleep(0.25)
+
+        # a bulk update, which the cache doesn't hear about
+        User.query.filter_by(id=self.user_id).update({'bio': "bulk bio"})
+        db.session.commit()
+
+        state, html = self.get(url)
+        self.assertEqual(state, 'STALE')
+        self.assertIn('first bio', html)
+
+        for _ in range(100):
+            if not self.cache.refreshing:
+                break
+            time.sleep(0.01)
+
+        state, html = self.get(url)
+        self.assertEqual(state, 'HIT')
+        self.assertIn('bulk bio', html)
+
+    def test_coalescing(self):
+        """Concurrent requests for a cold page render it once"""
+
+        renders = []
+
+        def render():
+            renders.append(1)
+            time.sleep(0.2)
+            return Response("page")
+
+        states = []
+
+        def request():
+            with app.test_request_context('/slow'):
+                resp = self.cache.get(('/slow', b''), frozenset(), render, None)
+                states.append(resp.headers['X-Cache'])
+
+        threads = [threading.Thread(target=request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(renders), 1)
+        self.assertEqual(sorted(states), ['HIT'] * 4 + ['MISS'])
+
+    def test_bounded(self):
+        """The least recently used page is dropped over the limit"""
+
+        self.cache.max_entries = 2
+        self.get('/users?q=a')
+        self.get('/users?q=b')
+        self.get('/users?q=a')
+        self.get('/users?q=c')
+
+        self.assertEqual(self.get('/users?q=a')[0], 'HIT')
+        self.assertEqual(self.get('/users?q=b')[0], 'MISS')
@@ -0,0 +1,140 @@
+"""Message partition and archive tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+from sqlalchemy import select
+from models import db, User, Message, Likes
+from partitions import (recent_messages, live_months, archive_month,
+                        archive_before, load_archived, add_months)
+
+from app import create_app, CURR_USER_KEY
+
+app = create_app('testing')
+
+
+class PartitionsTestCase(TestCase):
+    """Test windowed feed reads and archiving months of messages."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
+    def setUp(self):
+        """Create test client, add a user with messages in several months."""
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+        self.archive_dir = tempfile.mkdtemp()
+        app.config['MESSAGE_ARCHIVE_DIR'] = self.archive_dir
+
+        self.user = User(email="part@test.com", username="partuser",
+                         password="HASHED_PASSWORD")
+        self.liker = User(email="liker@test.com", username="likeruser",
+                          password="HASHED_PASSWORD")
+        db.session.add_all([self.user, self.liker])
+        db.session.commit()
+
+        self.now = datetime(2020, 6, 15)
+        for month, day in [(6, 10), (6, 1), (5, 20), (1, 3), (1, 2)]:
+            db.session.add(Message(text=f"{month}/{day}", user_id=self.user.id,
+                                   timestamp=datetime(2020, month, day)))
+        db.session.add(Message(text="2019", user_id=self.user.id,
+                               timestamp=datetime(2019, 3, 1)))
+        db.session.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+
+    def test_add_months(self):
+        """Month arithmetic crosses year boundaries"""
+
+        self.assertEqual(add_months(datetime(2020, 1, 1), -1), datetime(2019, 12, 1))
+        self.assertEqual(add_months(datetime(2020, 11, 1), 3), datetime(2021, 2, 1))
+
+    def test_recent_messages(self):
+        """Windowed reads return the newest messages across months, in order"""
+
+        query = select([Message.__table__]).where(Message.user_id == self.user.id)
+
+        texts = [m.text for m in recent_messages(query, limit=4, now=self.now)]
+        self.assertEqual(texts, ["6/10", "6/1", "5/20", "1/3"])
+
+        texts = [m.text for m in recent_messages(query, limit=100, now=self.now)]
+        self.assertEqual(texts, ["6/10", "6/1", "5/20", "1/3", "1/2", "2019"])
+
+    def test_live_months(self):
+        """Messages are counted per month"""
+
+        with app.app_context():
+            self.assertEqual(live_months(), [("2019-03", 1), ("2020-01", 2),
+                                             ("2020-05", 1), ("2020-06", 2)])
+
+    def test_archive_month(self):
+        """Archiving moves a month's messages, with their likes, to a file"""
+
+        old = Message.query.filter_by(text="1/3").one()
+        self.liker.likes.append(old)
+        db.session.commit()
+        old_id = old.id
+
+        with app.app_context():
+            self.assertEqual(archive_month("2020-01"), 2)
+
+            self.assertEqual(Message.query.filter_by(user_id=self.user.id).count(), 4)
+            self.assertEqual(Likes.query.count(), 0)
+
+            archived = load_archived(old_id)
+            self.assertTrue(archived.archived)
+            self.assertEqual(archived.text, "1/3")
+            self.assertEqual(archived.timestamp, datetime(2020, 1, 3))
+            self.assertEqual(archived.user.username, "partuser")
+            self.assertEqual(archived.liked_by_ids, [self.liker.id])
+
+            self.assertIsNone(load_archived(old_id + 1000))
+
+    def test_archive_before(self):
+        """Every month before the cutoff is archived"""
+
+        with app.app_context():
+            self.assertEqual(archive_before("2020-05"), {"2019-03": 1, "2020-01": 2})
+            self.assertEqual(live_months(), [("2020-05", 1), ("2020-06", 2)])
+
+    def test_archive_before_short_month(self):
+        """A cutoff month without its leading zero compares as a month"""
+
+        with app.app_context():
+            self.assertEqual(archive_before("2020-5"), {"2019-03": 1, "2020-01": 2})
+            self.assertEqual(archive_before("2020-6"), {"2020-05": 1})
+            self.assertEqual(live_months(), [("2020-06", 2)])
+
+    def test_show_archived_message(self):
+        """An archived message can still be viewed, read-only"""
+
+        old_id = Message.query.filter_by(text="2019").one().id
+        user_id = self.user.id
+        with app.app_context():
+            archive_month("2019-03")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            resp = c.get(f'/messages/{old_id}')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('<p class="single-message">2019</p>', html)
+            self.assertIn('Archived', html)
+            self.assertNotIn('<button class="btn btn-outline-danger">Delete</button>', html)
+
+            resp = c.get(f'/messages/{old_id + 1000}')
+            self.assertEqual(resp.status_code, 404)
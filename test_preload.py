@@ -0,0 +1,66 @@
+"""Preload (pre-fork) mode tests"""
+
+import gc
+import os
+from unittest import TestCase
+
+from app import create_app
+from gather import gather
+from models import db, User
+from preload import preload
+
+app = create_app('testing')
+
+
+class PreloadTestCase(TestCase):
+    """Test warming the app before forking workers."""
+
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.create_all()
+        preload(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        gc.unfreeze()
+
+    def test_warmed(self):
+        """Templates are compiled and the heap frozen"""
+
+        self.assertIn('home.html', [name for _, name in app.jinja_env.cache.keys()])
+        self.assertGreater(gc.get_freeze_count(), 0)
+
+    def test_foreign_connection_discarded(self):
+        """A pooled connection from another process is not handed out"""
+
+        engine = db.get_engine(app)
+        connection = engine.connect()
+        record = connection.connection._connection_record
+        record.info['pid'] = -1
+        dbapi_connection = connection.connection.connection
+        connection.close()
+
+        with engine.connect() as connection:
+            self.assertIsNot(connection.connection.connection, dbapi_connection)
+            self.assertEqual(connection.connection._connection_record.info['pid'],
+                             os.getpid())
+
+    def test_worker_after_fork(self):
+        """A forked worker gets working thread pools and connections"""
+
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                with app.app_context():
+                    users = gather({'count': lambda: User.query.count()})
+                os.write(write, str(users['count']).encode())
+            finally:
+                os._exit(0)
+
+        os.close(write)
+        result = os.read(read, 64)
+        os.waitpid(pid, 0)
+        with app.app_context():
+            self.assertEqual(result, str(User.query.count()).encode())
@@ -0,0 +1,155 @@
+"""Rate limiter tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+from unittest import TestCase, mock
+from models import db, User, Message
+from ratelimit import MemoryBackend, SharedBackend, LocalStore, parse_budget
+
+from app import create_app, CURR_USER_KEY
+from config import TestingConfig
+
+app = create_app('testing')
+
+
+class TokenBucketTestCase(TestCase):
+    """Test the backends with explicit clocks."""
+
+    def test_parse_budget(self):
+        """Budgets give a capacity and a refill rate per second"""
+
+        self.assertEqual(parse_budget("10/minute"), (10, 10 / 60))
+        self.assertEqual(parse_budget("2/second"), (2, 2))
+
+    def check_bucket(self, backend):
+        capacity, rate = 3, 1.0
+
+        for _ in range(3):
+            self.assertEqual(backend.take("k", capacity, rate, now=100.0), 0)
+
+        self.assertAlmostEqual(backend.take("k", capacity, rate, now=100.0), 1.0)
+        self.assertAlmostEqual(backend.take("k", capacity, rate, now=100.5), 0.5)
+
+        # refilled one token; other keys have their own bucket
+        self.assertEqual(backend.take("k", capacity, rate, now=101.0), 0)
+        self.assertEqual(backend.take("other", capacity, rate, now=101.0), 0)
+
+    def test_memory_backend(self):
+        """Memory buckets allow bursts up to capacity, then refill"""
+
+        self.check_bucket(MemoryBackend())
+
+    def test_memory_backend_prunes_full_buckets(self):
+        """Buckets that have refilled are dropped once over max_keys"""
+
+        backend = MemoryBackend(max_keys=2)
+        backend.take("a", 1, 1.0, now=0.0)
+        backend.take("b", 1, 1.0, now=0.0)
+        backend.take("c", 1, 1.0, now=5.0)
+
+        self.assertEqual(set(backend.buckets), {"c"})
+
+    def test_shared_backend(self):
+        """Workers sharing a store share one budget"""
+
+        self.check_bucket(SharedBackend(LocalStore()))
+
+        store = LocalStore()
+        worker1, worker2 = SharedBackend(store), SharedBackend(store)
+        self.assertEqual(worker1.take("k", 2, 1.0, now=0.0), 0)
+        self.assertEqual(worker2.take("k", 2, 1.0, now=0.0), 0)
+        self.assertGreater(worker1.take("k", 2, 1.0, now=0.0), 0)
+
+
+class RateLimitViewsTestCase(TestCase):
+    """Test 429 responses from limited endpoints."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
+    def setUp(self):
+        """Create test client and user; turn limiting on with a small budget."""
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        db.session.commit()
+
+        limiter = app.extensions['ratelimiter']
+        limiter.backend = MemoryBackend()
+        self.budgets = limiter.budgets
+        limiter.budgets = dict(self.budgets, **{
+            'warbler.login': parse_budget("2/minute"),
+            'warbler.messages_add': parse_budget("1/minute"),
+            'warbler.users_available': parse_budget("2/minute"),
+        })
+        app.config['RATE_LIMIT_ENABLED'] = True
+
+    def tearDown(self):
+        app.extensions['ratelimiter'].budgets = self.budgets
+        app.config['RATE_LIMIT_ENABLED'] = False
+
+    def test_login_limited_by_ip(self):
+        """Repeated login attempts are refused with Retry-After"""
+
+        data = {"username": "testuser", "password": "wrong-password"}
+        with self.client as c:
+            self.assertEqual(c.post('/login', data=data).status_code, 200)
+            self.assertEqual(c.post('/login', data=data).status_code, 200)
+
+            resp = c.post('/login', data=data)
+            self.assertEqual(resp.status_code, 429)
+            self.assertEqual(resp.headers['Retry-After'], '30')
+
+            # viewing the form is not limited
+            self.assertEqual(c.get('/login').status_code, 200)
+
+    def test_forwarded_clients_limited_apart(self):
+        """Behind a trusted proxy, each forwarded address has its own budget"""
+
+        with mock.patch.object(TestingConfig, 'PROXY_HOPS', 1):
+            proxied = create_app('testing')
+        proxied.config['RATE_LIMIT_ENABLED'] = True
+        proxied.extensions['ratelimiter'].budgets = {
+            'warbler.login': parse_budget("1/minute")}
+
+        data = {"username": "testuser", "password": "wrong-password"}
+        client = proxied.test_client()
+
+        def login(address):
+            return client.post('/login', data=data,
+                               headers={'X-Forwarded-For': address}).status_code
+
+        self.assertEqual(login('203.0.113.1'), 200)
+        self.assertEqual(login('203.0.113.1'), 429)
+        self.assertEqual(login('203.0.113.2'), 200)
+
+    def test_availability_limited(self):
+        """Availability lookups are limited, though they are GETs"""
+
+        with self.client as c:
+            for _ in range(2):
+                resp = c.get('/users/available?email=test@test.com')
+                self.assertEqual(resp.status_code, 200)
+            resp = c.get('/users/available?email=other@test.com')
+            self.assertEqual(resp.status_code, 429)
+
+    def test_messages_limited_by_user(self):
+        """Posting is limited per logged-in user"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            self.assertEqual(c.post("/messages/new", data={"text": "1"}).status_code, 302)
+            self.assertEqual(c.post("/messages/new", data={"text": "2"}).status_code, 429)
+            self.assertEqual(Message.query.count(), 1)
@@ -0,0 +1,149 @@
+"""Real-time feed (Server-Sent Events) tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+import json
+from unittest import TestCase, mock
+
+from models import (db, User, Message, Follows, Likes, MessageTag, Mention,
+                    IdempotencyKey)
+from realtime import Hub, LocalBroker
+
+from app import create_app, CURR_USER_KEY
+
+app = create_app('testing')
+app.extensions['realtime'].enable_streams(app)
+
+
+class HubTestCase(TestCase):
+    """Test delivering events to subscriptions."""
+
+    def test_deliver_by_channel(self):
+        """Events reach the subscriptions to their channel only"""
+
+        hub = Hub(queue_size=10, max_subscribers=10)
+        broker = LocalBroker()
+        broker.listen(hub.deliver)
+        alice = hub.subscribe(['user:1', 'user:2'])
+        bob = hub.subscribe(['user:3'])
+
+        broker.publish('user:2', 'event\n\n')
+
+        self.assertEqual(alice.queue.get_nowait(), 'event\n\n')
+        self.assertTrue(bob.queue.empty())
+
+        hub.unsubscribe(alice)
+        hub.unsubscribe(bob)
+        self.assertEqual((hub.channels, hub.count), ({}, 0))
+
+    def test_slow_subscriber_reset(self):
+        """A subscriber whose queue fills is told to reload and dropped"""
+
+        hub = Hub(queue_size=2, max_subscribers=10)
+        slow = hub.subscribe(['user:1'])
+        for n in range(3):
+            hub.deliver('user:1', f'event {n}\n\n')
+
+        events = list(slow.events(heartbeat=1, lifetime=5))
+        self.assertEqual(events, ['retry: 3000\n\n', 'event: reset\ndata: {}\n\n'])
+
+    def test_streams_need_shared_broker(self):
+        """Streams aren't served with a local broker but by a single process"""
+
+        other = create_app('testing')
+        realtime = other.extensions['realtime']
+        with mock.patch.dict(other.config, REALTIME_SINGLE_PROCESS=False):
+            self.assertRaises(RuntimeError, realtime.enable_streams, other)
+            self.assertFalse(other.config['REALTIME_STREAMS_ENABLED'])
+
+            with mock.patch.object(realtime, 'broker', mock.Mock(shared=True)):
+                realtime.enable_streams(other)
+            self.assertTrue(other.config['REALTIME_STREAMS_ENABLED'])
+
+    def test_max_subscribers(self):
+        """A full worker refuses new subscriptions"""
+
+        hub = Hub(queue_size=2, max_subscribers=1)
+        self.assertIsNotNone(hub.subscribe(['user:1']))
+        self.assertIsNone(hub.subscribe(['user:1']))
+
+
+class StreamViewTestCase(TestCase):
+    """Test /stream with messages posted through messages_add."""
+
+    @classmethod
+    def setUpClass(cls):
+        db.create_all()
+
+    def setUp(self):
+        db.session.rollback()
+        IdempotencyKey.query.delete()
+        MessageTag.query.delete()
+        Mention.query.delete()
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        users = [User.signup(username=name, email=f"{name}@test.com",
+                             password="password", image_url=None)
+                 for name in ('reader', 'author', 'stranger')]
+        db.session.commit()
+        self.reader_id, self.author_id, self.stranger_id = [u.id for u in users]
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.reader_id))
+        db.session.commit()
+
+    def client_for(self, user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        return client
+
+    def test_stream_followed_messages(self):
+        """A follower's open stream gets new messages of people they follow"""
+
+        resp = self.client_for(self.reader_id).get('/stream', buffered=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        events = iter(resp.response)
+        self.assertEqual(next(events), b'retry: 3000\n\n')
+
+        self.client_for(self.stranger_id).post('/messages/new', data={"text": "unseen"})
+        self.client_for(self.author_id).post('/messages/new', data={"text": "Hi #all"})
+
+        event = next(events).decode()
+        self.assertTrue(event.startswith('id: '))
+        self.assertIn('event: warble\n', event)
+        data = json.loads(event.split('data: ', 1)[1])
+        self.assertEqual((data['username'], data['user_id']), ('author', self.author_id))
+        self.assertEqual(data['html'], 'Hi <a href="/tags/all">#all</a>')
+
+        resp.close()
+        self.assertEqual(app.extensions['realtime'].hub.count, 0)
+
+    def test_replay_published_once(self):
+        """A retried post with the same idempotency key sends one event"""
+
+        published = []
+        broker = app.extensions['realtime'].broker
+        broker.listen(lambda channel, data: published.append(channel))
+        self.addCleanup(broker.listeners.pop)
+        author = self.client_for(self.author_id)
+        for _ in range(2):
+            author.post('/messages/new', data={"text": "Hi", "idempotency_key": "abc"})
+
+        self.assertEqual(published, [f'user:{self.author_id}'])
+
+    def test_stream_needs_login(self):
+        """Logged out visitors are sent home"""
+
+        resp = app.test_client().get('/stream')
+        self.assertEqual(resp.status_code, 302)
+
+    def test_stream_only_where_enabled(self):
+        """Apps that don't serve streams (the sync workers) answer 404"""
+
+        with mock.patch.dict(app.config, REALTIME_STREAMS_ENABLED=False):
+            resp = self.client_for(self.reader_id).get('/stream')
+        self.assertEqual(resp.status_code, 404)
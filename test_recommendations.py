@@ -0,0 +1,124 @@
+"""Who-to-follow recommendation tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+from unittest import TestCase
+from models import db, User, Message, Follows, Recommendation
+from recommendations import compute_recommendations, refresh_recommendations
+
+from app import create_app, CURR_USER_KEY
+
+app = create_app('testing')
+
+
+class ComputeRecommendationsTestCase(TestCase):
+    """Test the sparse scoring, without the database."""
+
+    def test_friends_of_friends(self):
+        """Users followed by people I follow are suggested, best first"""
+
+        # 1 follows 2 and 3; both follow 4; 3 also follows 5
+        follows = [(1, 2), (1, 3), (2, 4), (3, 4), (3, 5)]
+        results = compute_recommendations(follows, [])
+
+        self.assertEqual(results[1], [(4, 2.0), (5, 1.0)])
+
+    def test_excludes_self_and_already_followed(self):
+        """Never suggest the user themself or someone they already follow"""
+
+        follows = [(1, 2), (2, 1), (2, 3), (1, 3)]
+        results = compute_recommendations(follows, [])
+
+        self.assertNotIn(1, results)
+
+    def test_co_likes(self):
+        """Users who like the same warbles are suggested to each other"""
+
+        likes = [(1, 100), (2, 100), (1, 101), (2, 101), (3, 101)]
+        results = compute_recommendations([], likes)
+
+        self.assertEqual(results[1], [(2, 1.0), (3, 0.5)])
+        self.assertEqual(results[3], [(1, 0.5), (2, 0.5)])
+
+    def test_top_n(self):
+        """Only the best `top_n` candidates are kept"""
+
+        follows = [(1, 2)] + [(2, n) for n in range(3, 20)]
+        results = compute_recommendations(follows, [], top_n=3)
+
+        self.assertEqual([c for c, _ in results[1]], [3, 4, 5])
+
+    def test_max_fanout(self):
+        """Expansion through one intermediate user is capped"""
+
+        follows = [(1, 2)] + [(2, n) for n in range(3, 20)]
+        results = compute_recommendations(follows, [], max_fanout=2)
+
+        self.assertEqual([c for c, _ in results[1]], [3, 4])
+
+
+class RefreshRecommendationsTestCase(TestCase):
+    """Test the batch job and serving suggestions on the homepage."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
+    def setUp(self):
+        """Create test client, add sample users and follows."""
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        self.client = app.test_client()
+
+        self.u1, self.u2, self.u3 = [
+            User(email=f"rec{n}@test.com", username=f"rec{n}user",
+                 password="HASHED_PASSWORD")
+            for n in range(1, 4)
+        ]
+        db.session.add_all([self.u1, self.u2, self.u3])
+        db.session.commit()
+
+        self.u1.following.append(self.u2)
+        self.u2.following.append(self.u3)
+        db.session.commit()
+
+    def test_refresh_writes_table(self):
+        """Does the job replace the table with fresh suggestions?"""
+
+        written = refresh_recommendations()
+        recs = Recommendation.query.all()
+
+        self.assertEqual(written, 1)
+        self.assertEqual(len(recs), 1)
+        self.assertEqual(recs[0].user_id, self.u1.id)
+        self.assertEqual(recs[0].recommended_user_id, self.u3.id)
+        self.assertEqual(recs[0].rank, 1)
+
+        # following the suggestion removes it on the next run
+        self.u1.following.append(self.u3)
+        db.session.commit()
+        refresh_recommendations()
+
+        self.assertEqual(Recommendation.query.count(), 0)
+
+    def test_who_to_follow_on_home(self):
+        """Are suggestions shown on the signed-in homepage?"""
+
+        refresh_recommendations()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1.id
+
+            resp = c.get('/')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Who to follow', html)
+            self.assertIn('@rec3user', html)
@@ -0,0 +1,140 @@
+"""Message sharding tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from models import db, User, Message, Likes
+from shards import MessageShards, messages, likes
+
+from app import create_app, CURR_USER_KEY
+
+app = create_app('testing')
+
+
+class ShardsTestCase(TestCase):
+    """Test routing of messages and likes to per-user shards."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
+    def setUp(self):
+        """Turn on two SQLite shards; add two users who follow each other."""
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        self.shard_dir = tempfile.mkdtemp()
+        app.config['MESSAGE_SHARDS'] = [
+            f"sqlite:///{os.path.join(self.shard_dir, f'shard{n}.db')}"
+            for n in range(2)]
+        self.shards = MessageShards(app)
+        self.shards.create_all()
+
+        self.client = app.test_client()
+
+        self.alice = User(email="alice@test.com", username="alice",
+                          password="HASHED_PASSWORD")
+        self.bob = User(email="bob@test.com", username="bob",
+                        password="HASHED_PASSWORD")
+        db.session.add_all([self.alice, self.bob])
+        db.session.commit()
+        self.alice.following.append(self.bob)
+        db.session.commit()
+        self.alice_id, self.bob_id = self.alice.id, self.bob.id
+
+    def tearDown(self):
+        app.config['MESSAGE_SHARDS'] = []
+        MessageShards(app)
+        shutil.rmtree(self.shard_dir)
+
+    def rows(self, table, user_id):
+        with self.shards.shard_of(user_id).connect() as connection:
+            return connection.execute(
+                table.select().where(table.c.user_id == user_id)).fetchall()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_post_and_show(self):
+        """Messages are stored on their author's shard and shown from it"""
+
+        self.assertIsNot(self.shards.shard_of(self.alice_id),
+                         self.shards.shard_of(self.bob_id))
+
+        with self.client as c:
+            self.login(c, self.bob_id)
+            resp = c.post("/messages/new", data={"text": "from bob"})
+            self.assertEqual(resp.status_code, 302)
+
+            self.assertEqual([row.text for row in self.rows(messages, self.bob_id)],
+                             ["from bob"])
+            self.assertEqual(Message.query.count(), 0)
+
+            html = c.get(f"/users/{self.bob_id}").get_data(as_text=True)
+            self.assertIn("<p>from bob</p>", html)
+            self.assertIn(f'<a href="/users/{self.bob_id}">1</a>', html)
+
+            message_id = self.rows(messages, self.bob_id)[0].id
+            html = c.get(f"/messages/{message_id}").get_data(as_text=True)
+            self.assertIn('<p class="single-message">from bob</p>', html)
+
+            c.post(f"/messages/{message_id}/delete")
+            self.assertEqual(self.rows(messages, self.bob_id), [])
+
+    def test_home_merges_shards(self):
+        """The home feed merges followed users' shards, newest first"""
+
+        with self.client as c:
+            for user_id, text in [(self.bob_id, "b1"), (self.alice_id, "a2"),
+                                  (self.bob_id, "b3")]:
+                self.login(c, user_id)
+                c.post("/messages/new", data={"text": text})
+
+            self.login(c, self.alice_id)
+            html = c.get("/").get_data(as_text=True)
+            positions = [html.index(f"<p>{text}</p>") for text in ["b3", "a2", "b1"]]
+            self.assertEqual(positions, sorted(positions))
+
+            app.config['FEED_PAGE_SIZE'] = 2
+            try:
+                html = c.get("/").get_data(as_text=True)
+                self.assertNotIn("<p>b1</p>", html)
+                before = self.rows(messages, self.alice_id)[0].id
+                html = c.get(f"/?before={before}").get_data(as_text=True)
+                self.assertIn("<p>b1</p>", html)
+                self.assertNotIn("<p>a2</p>", html)
+            finally:
+                app.config['FEED_PAGE_SIZE'] = 100
+
+    def test_toggle_like(self):
+        """Likes are stored on the liker's shard"""
+
+        with self.client as c:
+            self.login(c, self.bob_id)
+            c.post("/messages/new", data={"text": "like me"})
+            message_id = self.rows(messages, self.bob_id)[0].id
+
+            self.login(c, self.alice_id)
+            c.post(f"/users/add-like/{message_id}", data={"url-redirect": "/"})
+
+            self.assertEqual([row.message_id for row in self.rows(likes, self.alice_id)],
+                             [message_id])
+            self.assertEqual(Likes.query.count(), 0)
+
+            html = c.get(f"/users/{self.alice_id}/likes").get_data(as_text=True)
+            self.assertIn("<p>like me</p>", html)
+            self.assertIn("btn-primary", html)
+
+            c.post(f"/users/add-like/{message_id}", data={"url-redirect": "/"})
+            self.assertEqual(self.rows(likes, self.alice_id), [])
+
+            resp = c.post("/users/add-like/12345", data={"url-redirect": "/"})
+            self.assertEqual(resp.status_code, 404)
@@ -2,16 +2,13 @@
 
 # For explanatory notes on setup, see comments in test_message_views
 
-import os
 from unittest import TestCase
 from models import db, connect_db, Message, User
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+from app import create_app, CURR_USER_KEY
 
-from app import app, CURR_USER_KEY
-
-db.create_all()
+app = create_app('testing')
 
 # Data for creating new user
 USER_DATA = {
@@ -27,12 +24,16 @@ USER_DATA_DUP = {
     "password": "password"
 }
 
-app.config['WTF_CSRF_ENABLED'] = False
-
 
 class UserSignupLoginViewsTestCase(TestCase):
     """Test user sign up and log in views"""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
     def setUp(self):
         """Create test client, add sample data."""
 
@@ -101,16 +102,14 @@ class UserSignupLoginViewsTestCase(TestCase):
                 if CURR_USER_KEY in sess:
                     del sess[CURR_USER_KEY]
 
-            with self.assertRaises(InvalidRequestError):
-
-                resp = c.post("/signup", data=USER_DATA_DUP)
-                html = resp.get_data(as_text=True)
+            resp = c.post("/signup", data=USER_DATA_DUP)
+            html = resp.get_data(as_text=True)
 
-                self.assertEqual(resp.status_code, 200)
-                self.assertIn ('<div class="alert alert-danger">Username already taken</div>', html)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn ('<div class="alert alert-danger">Username already taken</div>', html)
 
-                users = User.query.all()
-                self.assertEqual(len(users), 1)
+            users = User.query.all()
+            self.assertEqual(len(users), 1)
 
 
     def test_login_form_get(self):
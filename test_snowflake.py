@@ -0,0 +1,251 @@
+"""Message id generator and migration tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+import threading
+from datetime import datetime
+from unittest import TestCase, mock
+from models import db, User, Message, Likes, TimelineEntry, NodeLease
+from node_leases import NodeLeaser
+from snowflake import SnowflakeGenerator, id_time, id_node, first_id, MAX_NODE_ID
+from message_ids import renumber_legacy_ids, legacy_count, LEGACY_ID_LIMIT
+
+from app import create_app
+
+app = create_app('testing')
+
+
+class Clock:
+    """Millisecond clock the tests move by hand."""
+
+    def __init__(self, ms):
+        self.ms = ms
+
+    def __call__(self):
+        return self.ms
+
+
+class SnowflakeGeneratorTestCase(TestCase):
+    """Test ordering and uniqueness of generated ids."""
+
+    def test_layout(self):
+        """Ids encode their time and node"""
+
+        generator = SnowflakeGenerator(node_id=7)
+        when = datetime(2020, 5, 17, 12, 30, 0, 123000)
+        message_id = generator.next_id(when)
+
+        self.assertEqual(id_time(message_id), when)
+        self.assertEqual(id_node(message_id), 7)
+        self.assertGreaterEqual(message_id, first_id(when))
+        self.assertLess(message_id, 2 ** 63)
+
+        with self.assertRaises(ValueError):
+            SnowflakeGenerator(node_id=MAX_NODE_ID + 1)
+
+    def test_monotonic(self):
+        """Ids increase through clock steps back and sequence overflow"""
+
+        clock = Clock(1000)
+        generator = SnowflakeGenerator(node_id=1, clock=clock)
+
+        ids = [generator.next_id() for _ in range(5000)]
+        clock.ms = 900
+        ids.extend(generator.next_id() for _ in range(10))
+        clock.ms = 2000
+        ids.append(generator.next_id())
+
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(id_time(ids[4095]), id_time(ids[0]))
+        self.assertGreater(id_time(ids[4096]), id_time(ids[0]))
+
+    def test_past_ids(self):
+        """Backfilled ids don't clash with ids already issued"""
+
+        clock = Clock(1000)
+        generator = SnowflakeGenerator(node_id=1, clock=clock)
+
+        ids = {generator.next_id() for _ in range(100)}
+        clock.ms = 2000
+        ids.add(generator.next_id())
+        past = {generator.next_id(id_time(min(ids))) for _ in range(100)}
+
+        self.assertEqual(len(ids | past), 201)
+
+    def test_many_past_ids_one_time(self):
+        """More than 4096 ids backdated to one time move on to later milliseconds"""
+
+        clock = Clock(10_000)
+        generator = SnowflakeGenerator(node_id=1, clock=clock)
+        when = id_time(5000 << 22)
+
+        now = [generator.next_id() for _ in range(10)]
+        past = [generator.next_id(when) for _ in range(5002)]
+
+        self.assertEqual(len(set(now + past)), 5012)
+        self.assertEqual(id_time(past[4095]), when)
+        self.assertGreater(id_time(past[4096]), when)
+
+    def test_past_ids_among_busy_now_ids(self):
+        """Ids backdated into milliseconds "now" ids used don't clash with them"""
+
+        clock = Clock(1000)
+        generator = SnowflakeGenerator(node_id=1, clock=clock)
+
+        ids = [generator.next_id() for _ in range(3000)]
+        clock.ms = 1001
+        ids += [generator.next_id() for _ in range(10)]
+        clock.ms = 2000
+        ids.append(generator.next_id())
+        ids += [generator.next_id(id_time(ids[0])) for _ in range(3000)]
+
+        self.assertEqual(len(set(ids)), 6011)
+
+    def test_nodes_and_threads(self):
+        """Nodes sharing a clock, and threads sharing a node, get unique ids"""
+
+        clock = Clock(1000)
+        nodes = [SnowflakeGenerator(node_id=n, clock=clock) for n in range(4)]
+        ids = []
+
+        def generate(generator):
+            ids.extend([generator.next_id() for _ in range(2000)])
+
+        threads = [threading.Thread(target=generate, args=(nodes[n % 4],))
+                   for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(ids)), 16000)
+
+    def test_leased_node(self):
+        """A generator with a lease uses its node, starting afresh when it changes"""
+
+        clock = Clock(1000)
+        lease = mock.Mock()
+        lease.node_id.return_value = 3
+        generator = SnowflakeGenerator(clock=clock, lease=lease)
+        first = generator.next_id()
+
+        lease.node_id.return_value = 4
+        second = generator.next_id()
+
+        self.assertEqual((id_node(first), id_node(second)), (3, 4))
+        self.assertEqual(second & 4095, 0)
+        with self.assertRaises(ValueError):
+            SnowflakeGenerator()
+
+
+class NodeLeaserTestCase(TestCase):
+    """Test leasing node ids from the database."""
+
+    @classmethod
+    def setUpClass(cls):
+        db.create_all()
+
+    def setUp(self):
+        NodeLease.query.delete()
+        db.session.commit()
+        self.leasers = [NodeLeaser(app) for _ in range(3)]
+
+    def tearDown(self):
+        for leaser in self.leasers:
+            leaser.release()
+
+    def test_distinct_nodes(self):
+        """Processes lease different nodes, and reuse released ones"""
+
+        first, second, third = self.leasers
+        self.assertEqual([first.node_id(), second.node_id()], [0, 1])
+        first.release()
+        self.assertEqual(third.node_id(), 0)
+
+    def test_leased_at_start(self):
+        """Starting leases a node straight away, outside any flush"""
+
+        leaser = self.leasers[0]
+        leaser.start()
+        self.assertEqual(leaser.node, 0)
+        self.assertEqual(NodeLease.query.get(0).holder, leaser.holder)
+
+    def test_lost_lease(self):
+        """A process whose lease was taken over leases another node"""
+
+        first, second, _ = self.leasers
+        self.assertEqual(first.node_id(), 0)
+
+        # first stalls past its lease, and second takes the node over
+        NodeLease.query.update({'expires_at': datetime(2020, 1, 1)})
+        db.session.commit()
+        self.assertEqual(second.node_id(), 0)
+
+        first.renew()
+        self.assertEqual(first.node_id(), 1)
+
+    def test_forked_child(self):
+        """A forked child leases its own node"""
+
+        leaser = self.leasers[0]
+        self.assertEqual(leaser.node_id(), 0)
+        with mock.patch('os.getpid', return_value=leaser.pid + 1):
+            self.assertEqual(leaser.node_id(), 1)
+
+
+class MigrateIdsTestCase(TestCase):
+    """Test renumbering messages that still have serial ids."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
+    def setUp(self):
+        """Add messages with serial ids, a like and timeline entries."""
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        self.author = User(email="author@test.com", username="author",
+                           password="HASHED_PASSWORD")
+        self.fan = User(email="fan@test.com", username="fan",
+                        password="HASHED_PASSWORD")
+        db.session.add_all([self.author, self.fan])
+        db.session.commit()
+        self.fan.following.append(self.author)
+        db.session.commit()
+
+        for serial, day in [(1, 3), (2, 1), (3, 2)]:
+            db.session.add(Message(id=serial, text=f"day {day}",
+                                   user_id=self.author.id,
+                                   timestamp=datetime(2020, 1, day)))
+        db.session.commit()
+        self.fan.likes.append(Message.query.get(1))
+        db.session.commit()
+        self.fan_id = self.fan.id
+
+    def test_renumber(self):
+        """Old rows get ids for their time; likes and timelines follow them"""
+
+        with app.app_context():
+            self.assertEqual(legacy_count(), 3)
+            self.assertEqual(renumber_legacy_ids(batch_size=2), 3)
+            self.assertEqual(legacy_count(), 0)
+
+            messages = Message.query.order_by(Message.id).all()
+            self.assertEqual([m.text for m in messages], ["day 1", "day 2", "day 3"])
+            for message in messages:
+                self.assertGreater(message.id, LEGACY_ID_LIMIT)
+                self.assertEqual(id_time(message.id), message.timestamp)
+
+            liked = Likes.query.filter_by(user_id=self.fan_id).one()
+            self.assertEqual(Message.query.get(liked.message_id).text, "day 3")
+
+            entries = TimelineEntry.query.filter_by(user_id=self.fan_id).all()
+            self.assertEqual({entry.message_id for entry in entries},
+                             {m.id for m in messages})
+
+            self.assertEqual(renumber_legacy_ids(), 0)
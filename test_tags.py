@@ -0,0 +1,135 @@
+"""Hashtag and mention index tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes, MessageTag, Mention
+from tags import (extract_tags, extract_mentions, link_tags, tag_messages,
+                  mention_messages, backfill_tags)
+
+from app import create_app, CURR_USER_KEY
+
+app = create_app('testing')
+
+
+class ExtractTestCase(TestCase):
+    """Test parsing message text."""
+
+    def test_extract_tags(self):
+        """Tags are lowercased and distinct; anchors and entities aren't tags"""
+
+        self.assertEqual(extract_tags("#Flask and #python, #flask again"),
+                         ['flask', 'python'])
+        self.assertEqual(extract_tags("page#anchor &#39; ##"), [])
+
+    def test_extract_mentions(self):
+        """Mentions are distinct usernames; email addresses aren't mentions"""
+
+        self.assertEqual(extract_mentions("@bob, @alice and @bob"), ['bob', 'alice'])
+        self.assertEqual(extract_mentions("mail me@example.com"), [])
+
+    def test_link_tags(self):
+        """Tags become links, and the rest of the text stays escaped"""
+
+        self.assertEqual(str(link_tags("<b> #Flask")),
+                         '&lt;b&gt; <a href="/tags/flask">#Flask</a>')
+
+
+class TagIndexTestCase(TestCase):
+    """Test indexing messages and reading the tag and mention feeds."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        db.session.rollback()
+        MessageTag.query.delete()
+        Mention.query.delete()
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED_PASSWORD") for name in ('alice', 'bob')]
+        db.session.add_all(users)
+        db.session.commit()
+        self.alice_id, self.bob_id = [user.id for user in users]
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.alice_id
+
+        self.t0 = datetime(2020, 1, 1)
+
+    def tearDown(self):
+        db.session.rollback()
+        self.ctx.pop()
+
+    def post(self, text, minutes):
+        msg = Message(text=text, user_id=self.alice_id,
+                      timestamp=self.t0 + timedelta(minutes=minutes))
+        db.session.add(msg)
+        db.session.commit()
+        return msg.id
+
+    def test_indexed_on_add(self):
+        """Adding a message indexes its tags and the users it mentions"""
+
+        message_id = self.post("hi @bob and @nobody #Flask", 1)
+
+        self.assertEqual([(row.tag, row.message_id) for row in MessageTag.query],
+                         [('flask', message_id)])
+        self.assertEqual([(row.user_id, row.message_id) for row in Mention.query],
+                         [(self.bob_id, message_id)])
+
+    def test_feeds_newest_first(self):
+        """Tag and mention feeds are newest first and page with before"""
+
+        ids = [self.post(f"#flask number {n} for @bob", n) for n in range(5)]
+        self.post("#other", 10)
+
+        self.assertEqual([m.id for m in tag_messages('FLASK', 3)], ids[:-4:-1])
+        self.assertEqual([m.id for m in tag_messages('flask', 3, before=ids[2])],
+                         [ids[1], ids[0]])
+        self.assertEqual([m.id for m in mention_messages(self.bob_id, 10)],
+                         ids[::-1])
+
+    def test_tag_and_mention_pages(self):
+        """The pages list the matching messages"""
+
+        self.post("tagged #flask", 1)
+        self.post("hello @bob", 2)
+
+        html = self.client.get('/tags/Flask').get_data(as_text=True)
+        self.assertIn('<h2>#flask</h2>', html)
+        self.assertIn('tagged <a href="/tags/flask">#flask</a>', html)
+
+        html = self.client.get(f'/users/{self.bob_id}/mentions').get_data(as_text=True)
+        self.assertIn('hello @bob', html)
+        self.assertNotIn('tagged', html)
+
+    def test_backfill(self):
+        """Backfill indexes bulk-inserted messages, in chunks, and can rerun"""
+
+        db.session.bulk_insert_mappings(Message, [
+            dict(text=f"#bulk {n} @bob", user_id=self.alice_id,
+                 timestamp=self.t0 + timedelta(minutes=n))
+            for n in range(25)
+        ])
+        db.session.commit()
+        self.assertEqual(MessageTag.query.count(), 0)
+
+        self.assertEqual(backfill_tags(chunk_size=4, workers=3), (25, 50))
+        self.assertEqual(backfill_tags(chunk_size=10, workers=2), (25, 50))
+
+        self.assertEqual(MessageTag.query.count(), 25)
+        self.assertEqual(len(mention_messages(self.bob_id, 100)), 25)
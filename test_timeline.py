@@ -0,0 +1,186 @@
+"""Hybrid fan-out timeline tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+from models import db, User, Message, Follows, TimelineEntry
+from timeline import (home_timeline, rebuild_timelines, clear_celebrity_cache,
+                      timeline_stats)
+
+from app import create_app, CURR_USER_KEY
+
+app = create_app('testing')
+
+
+class TimelineTestCase(TestCase):
+    """Test push on write, pull for celebrities, and the merged read."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
+    def setUp(self):
+        """Create users: reader follows author and celebrity; fans follow celebrity."""
+
+        # fan-out reads its threshold from the current app
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        app.config['FANOUT_FOLLOWER_THRESHOLD'] = 3
+        clear_celebrity_cache()
+
+        self.client = app.test_client()
+
+        names = ['reader', 'author', 'celeb', 'fan1', 'fan2']
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED_PASSWORD") for name in names]
+        db.session.add_all(users)
+        db.session.commit()
+        self.reader, self.author, self.celeb, fan1, fan2 = users
+
+        self.reader.following.extend([self.author, self.celeb])
+        fan1.following.append(self.celeb)
+        fan2.following.append(self.celeb)
+        db.session.commit()
+
+        self.t0 = datetime(2020, 1, 1)
+
+    def tearDown(self):
+        app.config['FANOUT_FOLLOWER_THRESHOLD'] = 1000
+        clear_celebrity_cache()
+        self.ctx.pop()
+
+    def post(self, user, text, minutes):
+        msg = Message(text=text, user_id=user.id,
+                      timestamp=self.t0 + timedelta(minutes=minutes))
+        db.session.add(msg)
+        db.session.commit()
+        return msg
+
+    def entries_for(self, user):
+        return {entry.message_id for entry in
+                TimelineEntry.query.filter_by(user_id=user.id)}
+
+    def test_push_on_write(self):
+        """A normal author's post is pushed to their followers and themself"""
+
+        msg = self.post(self.author, "pushed", 1)
+
+        self.assertEqual(self.entries_for(self.reader), {msg.id})
+        self.assertEqual(self.entries_for(self.author), {msg.id})
+
+    def test_celebrity_not_pushed(self):
+        """A celebrity's post is only written to their own timeline"""
+
+        msg = self.post(self.celeb, "pulled", 1)
+
+        self.assertEqual(self.entries_for(self.reader), set())
+        self.assertEqual(self.entries_for(self.celeb), {msg.id})
+
+    def test_merged_read(self):
+        """Pushed and celebrity messages are merged newest first"""
+
+        self.post(self.author, "a1", 1)
+        self.post(self.celeb, "c2", 2)
+        r3 = self.post(self.reader, "r3", 3)
+        self.post(self.celeb, "c4", 4)
+
+        merges = timeline_stats().get('merges', 0)
+        texts = [m.text for m in home_timeline(self.reader)]
+
+        self.assertEqual(texts, ["c4", "r3", "c2", "a1"])
+        self.assertEqual(timeline_stats()['merges'], merges + 1)
+
+        texts = [m.text for m in home_timeline(self.reader, limit=2)]
+        self.assertEqual(texts, ["c4", "r3"])
+
+        texts = [m.text for m in home_timeline(self.reader, limit=2, before=r3.id)]
+        self.assertEqual(texts, ["c2", "a1"])
+
+    def test_celebrity_drops_below_threshold(self):
+        """Messages not pushed while an author was a celebrity stay in feeds after"""
+
+        famous = self.post(self.celeb, "famous", 1)
+        self.assertEqual([m.text for m in home_timeline(self.reader)], ["famous"])
+
+        fan = (Follows.query
+               .filter(Follows.user_being_followed_id == self.celeb.id,
+                       Follows.user_following_id != self.reader.id)
+               .first())
+        db.session.delete(fan)
+        db.session.commit()
+        # posted before this worker's cached celebrity set expires
+        stale = self.post(self.celeb, "stale", 2)
+        self.assertNotIn(stale.id, self.entries_for(self.reader))
+
+        clear_celebrity_cache()
+        texts = [m.text for m in home_timeline(self.reader)]
+
+        self.assertEqual(texts, ["stale", "famous"])
+        self.assertEqual(self.entries_for(self.reader), {famous.id, stale.id})
+
+    def test_paging_past_pushed_entries(self):
+        """Older pages reach past trimmed timelines by pulling"""
+
+        texts = [self.post(self.author, f"a{n}", n).text for n in range(1, 6)]
+        rebuild_timelines(limit=2)
+        self.assertEqual(len(self.entries_for(self.reader)), 2)
+
+        page = home_timeline(self.reader, limit=3)
+        self.assertEqual([m.text for m in page], texts[:1:-1])
+        page = home_timeline(self.reader, limit=3, before=page[-1].id)
+        self.assertEqual([m.text for m in page], ["a2", "a1"])
+
+    def test_fan_out_trims_old_entries(self):
+        """Pushing a message drops older entries from the timelines it goes to"""
+
+        old = self.post(self.author, "old", 1)
+        new = self.post(self.author, "new", 60 * 24 * 40)
+
+        self.assertEqual(self.entries_for(self.reader), {new.id})
+        self.assertEqual([m.text for m in home_timeline(self.reader)], ["new", "old"])
+        self.assertEqual(self.entries_for(self.author), {new.id})
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        """Following pushes recent messages; unfollowing takes them out"""
+
+        other = User(email="other@test.com", username="other",
+                     password="HASHED_PASSWORD")
+        db.session.add(other)
+        db.session.commit()
+        msg = self.post(other, "before follow", 1)
+        reader_id, other_id = self.reader.id, other.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = reader_id
+
+            c.post(f'/users/follow/{other_id}', data={"url_redirect": "/"})
+            self.assertIn(msg.id, self.entries_for(self.reader))
+
+            resp = c.get('/')
+            self.assertIn('<p>before follow</p>', resp.get_data(as_text=True))
+
+            c.post(f'/users/stop-following/{other_id}', data={"url_redirect": "/"})
+            self.assertNotIn(msg.id, self.entries_for(self.reader))
+
+    def test_rebuild(self):
+        """Rebuilding recreates pushed entries, skipping celebrities"""
+
+        a = self.post(self.author, "a", 1)
+        self.post(self.celeb, "c", 2)
+        TimelineEntry.query.delete()
+        db.session.commit()
+
+        rebuild_timelines()
+
+        self.assertEqual(self.entries_for(self.reader), {a.id})
+        self.assertEqual(TimelineEntry.query.count(), 3)
@@ -0,0 +1,176 @@
+"""Trending topics tests"""
+
+# For explanatory notes on setup, see comments in test_message_views
+
+import json
+import os
+import random
+import tempfile
+from collections import Counter
+from unittest import TestCase, mock
+
+from models import (db, User, Message, Follows, Likes, MessageTag, Mention,
+                    IdempotencyKey)
+from trending import Trending, tokens
+
+from app import create_app, CURR_USER_KEY
+
+app = create_app('testing')
+
+HOUR = 60 * 60
+
+
+def make_trending(directory):
+    """Another worker's Trending, checkpointing to `directory`."""
+
+    own = app.extensions['trending']
+    trending = Trending(app)
+    app.extensions['trending'] = own
+    trending.directory = directory
+    return trending
+
+
+class TokensTestCase(TestCase):
+    """Test what counts as a token."""
+
+    def test_tokens(self):
+        """Words and tags, not mentions, stopwords, numbers or short words"""
+
+        self.assertEqual(tokens("The #Flask release is out, @bob! 2020 ok flask"),
+                         {'#flask', 'release', 'flask'})
+
+
+class TrendingTestCase(TestCase):
+    """Test counting, decay and checkpoints."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.trending = app.extensions['trending']
+        self.trending.directory = self.directory
+        self.trending.reset()
+        self.now = self.trending.landmark
+
+    def tearDown(self):
+        self.trending.reset()
+
+    def test_heavy_hitters(self):
+        """The most posted tokens trend, in order, with bounded memory"""
+
+        rng = random.Random(1)
+        words = [f'word{n}' for n in range(2000)]
+        posted = Counter()
+        for _ in range(5000):
+            # a few popular words among many rare ones
+            word = words[min(int(rng.paretovariate(1.2)) - 1, 1999)]
+            posted[word] += 1
+            self.trending.ingest(word, now=self.now)
+
+        self.assertLessEqual(len(self.trending.top), self.trending.tracked)
+        expected = [word for word, _ in posted.most_common(5)]
+        topics = self.trending.topics(5, now=self.now)
+        self.assertEqual([token for token, _ in topics], expected)
+        for token, count in topics:
+            self.assertGreaterEqual(count, posted[token] - 1e-6)
+            self.assertLess(count, posted[token] * 1.05)
+
+    def test_decay(self):
+        """Counts halve every half-life, through rescaling too"""
+
+        self.trending.ingest("#old #old2", now=self.now)
+        self.trending.ingest("#old", now=self.now + 1)
+        counts = dict(self.trending.topics(now=self.now + 2 * HOUR))
+        self.assertAlmostEqual(counts['#old'], 0.5, places=3)
+
+        later = self.now + 50 * HOUR
+        self.trending.ingest("#new", now=later)
+        self.assertEqual(self.trending.landmark, later)
+        self.assertEqual(self.trending.topics(now=later), [('#new', 1.0)])
+
+    def test_checkpoints_merged(self):
+        """Other workers' checkpoints are added in, and kept across restarts"""
+
+        self.trending.ingest("#shared #mine", now=self.now)
+        other = make_trending(self.directory)
+        other.path = lambda: os.path.join(self.directory, 'other-1.json')
+        other.ingest("#shared", now=self.now)
+        other.checkpoint()
+
+        counts = dict(self.trending.topics(now=self.now))
+        self.assertAlmostEqual(counts['#shared'], 2)
+        self.assertAlmostEqual(counts['#mine'], 1)
+
+        self.trending.checkpoint()
+        restarted = make_trending(self.directory)
+        restarted.path = lambda: os.path.join(self.directory, 'restarted-2.json')
+        counts = dict(restarted.topics(now=self.now))
+        self.assertAlmostEqual(counts['#shared'], 2)
+
+
+    def test_checkpoint_copies_top(self):
+        """A checkpoint writes a copy, which ingesting meanwhile can't change"""
+
+        self.trending.ingest("#before", now=self.now)
+        written = []
+        dump = json.dump
+
+        def ingest_while_dumping(state, f):
+            written.append(state)
+            self.trending.ingest("#during", now=self.now)
+            dump(state, f)
+
+        with mock.patch('trending.json.dump', side_effect=ingest_while_dumping):
+            self.trending.checkpoint()
+
+        self.assertIn('#before', written[0]['top'])
+        self.assertNotIn('#during', written[0]['top'])
+
+
+class TrendingViewTestCase(TestCase):
+    """Test the trending panel."""
+
+    @classmethod
+    def setUpClass(cls):
+        db.create_all()
+
+    def setUp(self):
+        db.session.rollback()
+        IdempotencyKey.query.delete()
+        MessageTag.query.delete()
+        Mention.query.delete()
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        user = User.signup(username="testuser", email="test@test.com",
+                           password="testuser", image_url=None)
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user.id
+
+        app.extensions['trending'].directory = tempfile.mkdtemp()
+        app.extensions['trending'].reset()
+
+    def tearDown(self):
+        app.extensions['trending'].reset()
+
+    def test_posted_tags_trend(self):
+        """Posting a message puts its tags in the home page panel"""
+
+        self.client.post('/messages/new', data={"text": "Hello #warbler"})
+
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertIn('id="trending"', html)
+        self.assertIn('<a href="/tags/warbler">#warbler</a>', html)
+
+    def test_replay_not_counted(self):
+        """A retried post with the same idempotency key counts once"""
+
+        for _ in range(2):
+            self.client.post('/messages/new',
+                             data={"text": "Hello #warbler", "idempotency_key": "abc"})
+
+        counts = dict(app.extensions['trending'].topics())
+        self.assertAlmostEqual(counts['#warbler'], 1, places=2)
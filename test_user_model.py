@@ -5,29 +5,19 @@
 #    python -m unittest test_user_model.py
 
 
-import os
 from unittest import TestCase
 from models import db, User, Message, Follows
 from forms import UserEditForm
 from sqlalchemy.exc import IntegrityError
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+# Build the app with the 'testing' profile (see config.py), which points
+# at the test database and turns off CSRF. Importing it no longer touches
+# the schema: tables are created once per test case in setUpClass, and in
+# each test we'll delete the data and create fresh new clean test data
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+from app import create_app
 
-
-# Now we can import app
-
-from app import app
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
+app = create_app('testing')
 
 # Data for creating test users
 
@@ -47,6 +37,12 @@ USER_2_DATA = {
 class UserModelTestCase(TestCase):
     """Test user model."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
     def setUp(self):
         """Clear any errors, clear tables, create test client."""
 
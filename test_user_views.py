@@ -2,17 +2,15 @@
 
 # For explanatory notes on setup, see comments in test_message_views
 
-import os
+from datetime import datetime
 from urllib.parse import urlparse
 from unittest import TestCase
 from models import db, connect_db, Message, User
 from flask import jsonify
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+from app import create_app, CURR_USER_KEY
 
-from app import app, CURR_USER_KEY
-
-db.create_all()
+app = create_app('testing')
 
 # Data for creating new user
 USER_DATA = {
@@ -28,12 +26,16 @@ USER_2_DATA = {
     "password": "HASHED_PASSWORD"
 }
 
-app.config['WTF_CSRF_ENABLED'] = False
-
 
 class UserViewsTestCase(TestCase):
     """Test user views"""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create tables once for the test case."""
+
+        db.create_all()
+
     def setUp(self):
         """Create test client, add sample data."""
 
@@ -319,3 +321,132 @@ class UserViewsTestCase(TestCase):
             self.assertIn('<button class="btn btn-primary btn-sm">Unfollow</button>', html)
             self.assertIn('<button class="btn btn-outline-primary btn-sm">Follow</button>', html)
             self.assertIn(f'<input type="hidden" name="url_redirect" value="{url}">', html)
+
+    def test_followers_paginated(self):
+        """Followers are listed in id order, one page at a time"""
+
+        with self.client as c:
+            followers = [User(email=f"page{n}@test.com",
+                              username=f"page{n}user",
+                              password="HASHED_PASSWORD")
+                         for n in range(3)]
+            db.session.add_all(followers)
+            db.session.commit()
+
+            self.testuser.followers.extend(followers)
+            self.testuser.following.append(followers[1])
+            db.session.commit()
+            follower_ids = [follower.id for follower in followers]
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            app.config['FOLLOW_PAGE_SIZE'] = 2
+            try:
+                url = f'/users/{self.testuser.id}/followers'
+                resp = c.get(url)
+                html = resp.get_data(as_text=True)
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn('<p>@page0user</p>', html)
+                self.assertIn('<p>@page1user</p>', html)
+                self.assertNotIn('<p>@page2user</p>', html)
+                self.assertIn(f'{url}?after={follower_ids[1]}', html)
+                self.assertEqual(html.count('>Unfollow</button>'), 1)
+
+                resp = c.get(f'{url}?after={follower_ids[1]}')
+                html = resp.get_data(as_text=True)
+
+                self.assertNotIn('<p>@page1user</p>', html)
+                self.assertIn('<p>@page2user</p>', html)
+                self.assertNotIn('id="next-page"', html)
+            finally:
+                app.config['FOLLOW_PAGE_SIZE'] = 50
+
+    def test_messages_paginated(self):
+        """A user's messages are listed newest first, one page at a time"""
+
+        with self.client as c:
+            for n in range(3):
+                db.session.add(Message(text=f"warble {n}", user_id=self.testuser.id,
+                                       timestamp=datetime(2020, 1, 1 + n)))
+            db.session.commit()
+            ids = [m.id for m in Message.query.order_by(Message.timestamp)]
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            app.config['FEED_PAGE_SIZE'] = 2
+            try:
+                url = f'/users/{self.testuser.id}'
+                html = c.get(url).get_data(as_text=True)
+
+                self.assertLess(html.index('<p>warble 2</p>'), html.index('<p>warble 1</p>'))
+                self.assertNotIn('<p>warble 0</p>', html)
+                self.assertIn(f'{url}?before={ids[1]}', html)
+
+                html = c.get(f'{url}?before={ids[1]}').get_data(as_text=True)
+
+                self.assertNotIn('<p>warble 1</p>', html)
+                self.assertIn('<p>warble 0</p>', html)
+                self.assertNotIn('id="next-page"', html)
+            finally:
+                app.config['FEED_PAGE_SIZE'] = 100
+
+    def test_toggle_like(self):
+        """Likes toggle on and off, and list on the likes page newest first"""
+
+        with self.client as c:
+            other_user = User(**USER_2_DATA)
+            db.session.add(other_user)
+            db.session.commit()
+            for n in range(2):
+                db.session.add(Message(text=f"warble {n}", user_id=other_user.id,
+                                       timestamp=datetime(2020, 1, 1 + n)))
+            db.session.commit()
+            old, new = Message.query.order_by(Message.id).all()
+            old_id, new_id, other_id = old.id, new.id, other_user.id
+            other_user.likes.append(new)
+            db.session.commit()
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            for message_id in (old_id, new_id):
+                c.post(f'/users/add-like/{message_id}', data={'url-redirect': '/'})
+            html = c.get(f'/users/{self.testuser.id}/likes').get_data(as_text=True)
+
+            self.assertLess(html.index('<p>warble 1</p>'), html.index('<p>warble 0</p>'))
+            self.assertEqual(len(Message.query.get(new_id).liked_by), 2)
+
+            c.post(f'/users/add-like/{new_id}', data={'url-redirect': '/'})
+            html = c.get(f'/users/{self.testuser.id}/likes').get_data(as_text=True)
+
+            self.assertNotIn('<p>warble 1</p>', html)
+            self.assertEqual([u.id for u in Message.query.get(new_id).liked_by], [other_id])
+
+    def test_following_streamed(self):
+        """Following page renders the same when streamed"""
+
+        with self.client as c:
+            other_user = User(**USER_DATA)
+            db.session.add(other_user)
+            db.session.commit()
+
+            self.testuser.following.append(other_user)
+            db.session.commit()
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            app.config['STREAM_TEMPLATES'] = True
+            try:
+                resp = c.get(f'/users/{self.testuser.id}/following')
+                self.assertTrue(resp.is_streamed)
+                html = resp.get_data(as_text=True)
+            finally:
+                app.config['STREAM_TEMPLATES'] = False
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('<p>@testnewuser</p>', html)
+            self.assertIn('<button class="btn btn-primary btn-sm">Unfollow</button>', html)
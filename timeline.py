@@ -0,0 +1,304 @@
+"""Hybrid fan-out home timelines.
+
+Most authors are fanned out on write: when they post, a row is pushed into
+`timeline_entries` for each of their followers (and for themselves), so
+reading a home timeline is one range scan of its primary key (message ids
+are time-ordered, see snowflake.py).
+
+Authors with at least FANOUT_FOLLOWER_THRESHOLD followers ("celebrities")
+are not pushed, since one post would write that many rows. Instead their
+recent messages are pulled when a follower reads their timeline and
+k-way merged (heapq.merge) with the pushed entries. When an author drops
+below the threshold, the messages that weren't pushed would no longer be
+pulled either. So once a worker's refreshed celebrity set no longer has
+them, its next home timeline read backfills their recent messages into
+their followers' timelines. This also covers posts made while the
+worker's cached set was out of date.
+
+Only recent entries are kept: each fan-out trims its author's and
+followers' entries older than TIMELINE_DAYS before the new message, a
+rebuild keeps the newest TIMELINE_LENGTH per user, and following someone
+pushes only their newest messages. A page reaching past a user's pushed
+entries is filled by pulling the messages of everyone they follow, so
+"Older" paging goes back as far as the messages do.
+
+Fan-out happens in a Message `after_insert` hook, so every way of adding a
+message is covered except bulk inserts (e.g. seed.py); run
+`flask timeline rebuild` after those.
+"""
+
+import heapq
+import time
+from collections import Counter
+from datetime import timedelta
+
+from sqlalchemy import and_, event, exists, literal, select
+from sqlalchemy.exc import IntegrityError
+from feeds import feed_select, load_feed
+from models import db, Follows, Message, TimelineEntry
+from snowflake import first_id, id_time
+
+TIMELINE_LENGTH = 100
+
+# Pushed entries older than this are trimmed as new ones are pushed.
+TIMELINE_DAYS = 30
+
+# Seconds the set of celebrity ids is reused before being recomputed.
+CELEBRITY_TTL = 60
+
+# Merge cost counters, see timeline_stats().
+stats = Counter()
+
+# threshold -> (expires at, frozenset of celebrity ids)
+_celebrity_cache = {}
+
+# Ids of former celebrities whose messages still need backfilling.
+_demoted = set()
+
+
+def follower_threshold():
+    return db.get_app().config['FANOUT_FOLLOWER_THRESHOLD']
+
+
+def celebrity_ids(connection=None):
+    """Ids of authors with at least the threshold number of followers."""
+
+    threshold = follower_threshold()
+    expires, previous = _celebrity_cache.get(threshold, (0, None))
+    if previous is not None and expires > time.monotonic():
+        return previous
+
+    followed = Follows.user_being_followed_id
+    query = (select([followed])
+             .group_by(followed)
+             .having(db.func.count() >= threshold))
+    ids = frozenset(row[0] for row in (connection or db.session).execute(query))
+
+    if previous is not None:
+        _demoted.update(previous - ids)
+    _celebrity_cache[threshold] = (time.monotonic() + CELEBRITY_TTL, ids)
+    return ids
+
+
+def clear_celebrity_cache():
+    """Recompute the celebrity set on its next use."""
+
+    for threshold, (_, ids) in list(_celebrity_cache.items()):
+        _celebrity_cache[threshold] = (0, ids)
+
+
+def backfill_demoted(limit=TIMELINE_LENGTH):
+    """Push former celebrities' recent messages to their followers' timelines.
+
+    Runs in its own transaction, not the session's. Other workers may be
+    backfilling the same rows; whichever commits second leaves them be.
+    """
+
+    entries = TimelineEntry.__table__
+    while _demoted:
+        try:
+            author_id = _demoted.pop()
+        except KeyError:
+            return
+
+        recent = (select([Message.id])
+                  .where(Message.user_id == author_id)
+                  .order_by(Message.id.desc())
+                  .limit(limit)
+                  .alias('recent'))
+        missing = (select([Follows.user_following_id, recent.c.id])
+                   .where(Follows.user_being_followed_id == author_id)
+                   .where(~exists().where(and_(
+                       entries.c.user_id == Follows.user_following_id,
+                       entries.c.message_id == recent.c.id))))
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(entries.insert().from_select(
+                    ['user_id', 'message_id'], missing))
+        except IntegrityError:
+            pass
+
+
+@event.listens_for(Message, 'after_insert')
+def fan_out(mapper, connection, message):
+    """Push a new message into its author's and followers' timelines."""
+
+    entries = TimelineEntry.__table__
+
+    connection.execute(entries.insert().values(user_id=message.user_id,
+                                               message_id=message.id))
+    stats['pushed_rows'] += 1
+
+    if message.user_id in celebrity_ids(connection):
+        stats['celebrity_posts'] += 1
+        return
+
+    followers = (select([Follows.user_following_id,
+                         literal(message.id, Message.id.type)])
+                 .where(Follows.user_being_followed_id == message.user_id))
+    result = connection.execute(entries.insert().from_select(
+        ['user_id', 'message_id'], followers))
+    stats['pushed_rows'] += result.rowcount
+
+    cutoff = first_id(id_time(message.id) - timedelta(days=TIMELINE_DAYS))
+    follower_ids = (select([Follows.user_following_id])
+                    .where(Follows.user_being_followed_id == message.user_id))
+    result = connection.execute(entries.delete()
+                                .where((entries.c.user_id == message.user_id)
+                                       | entries.c.user_id.in_(follower_ids))
+                                .where(entries.c.message_id < cutoff))
+    stats['trimmed_rows'] += result.rowcount
+
+
+def backfill(follower_id, followed_id, limit=TIMELINE_LENGTH):
+    """Push `followed_id`'s recent messages to a new follower's timeline."""
+
+    if followed_id in celebrity_ids():
+        return
+
+    entries = TimelineEntry.__table__
+    recent = (select([literal(follower_id), Message.id])
+              .where(Message.user_id == followed_id)
+              .where(~exists().where(and_(entries.c.user_id == follower_id,
+                                          entries.c.message_id == Message.id)))
+              .order_by(Message.id.desc())
+              .limit(limit))
+    db.session.execute(entries.insert().from_select(
+        ['user_id', 'message_id'], recent))
+
+
+def unfollow(follower_id, followed_id):
+    """Drop `followed_id`'s messages from a former follower's timeline."""
+
+    in_messages = select([Message.id]).where(Message.user_id == followed_id)
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == follower_id,
+             TimelineEntry.message_id.in_(in_messages))
+     .delete(synchronize_session=False))
+
+
+def recent_followed(user, limit, before=None):
+    """Messages by `user` and everyone they follow, newest first."""
+
+    followed = (select([Follows.user_being_followed_id])
+                .where(Follows.user_following_id == user.id))
+    query = feed_select().where((Message.user_id == user.id)
+                                | Message.user_id.in_(followed))
+    if before is not None:
+        query = query.where(Message.id < before)
+    return load_feed(query.order_by(Message.id.desc()).limit(limit))
+
+
+def recent_by_author(author_id, limit, before=None):
+    query = feed_select().where(Message.user_id == author_id)
+    if before is not None:
+        query = query.where(Message.id < before)
+    return load_feed(query.order_by(Message.id.desc()).limit(limit))
+
+
+def home_timeline(user, limit=TIMELINE_LENGTH, before=None):
+    """The newest `limit` messages by `user` and the people they follow.
+
+    Pass the id of the last message of a page as `before` for the next one.
+    Returns FeedMessages (see feeds.py).
+    """
+
+    celebrities = celebrity_ids()
+    backfill_demoted()
+
+    entries = TimelineEntry.__table__
+    pushed = (feed_select(entries.join(Message.__table__,
+                                       entries.c.message_id == Message.id))
+              .where(entries.c.user_id == user.id))
+    if before is not None:
+        pushed = pushed.where(entries.c.message_id < before)
+    pushed = load_feed(pushed.order_by(entries.c.message_id.desc()).limit(limit))
+
+    sources = [pushed]
+    if len(pushed) < limit:
+        # past the pushed entries (trimmed, or from before a follow)
+        stats['pulled_pages'] += 1
+        oldest = pushed[-1].id if pushed else before
+        sources.append(recent_followed(user, limit - len(pushed), oldest))
+
+    if celebrities:
+        followed = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == user.id,
+                            Follows.user_being_followed_id.in_(celebrities)))
+        sources += [recent_by_author(author_id, limit, before)
+                    for author_id, in followed]
+    if len(sources) == 1:
+        return pushed
+
+    start = time.perf_counter()
+
+    # an author who recently crossed the threshold may be in two sources
+    seen = set()
+    merged = []
+    for message in heapq.merge(*sources, key=lambda m: m.id, reverse=True):
+        if message.id not in seen:
+            seen.add(message.id)
+            merged.append(message)
+            if len(merged) == limit:
+                break
+
+    stats['merges'] += 1
+    stats['merge_sources'] += len(sources)
+    stats['merge_rows'] += sum(len(source) for source in sources)
+    stats['merge_seconds'] += time.perf_counter() - start
+
+    return merged
+
+
+def timeline_stats():
+    """Fan-out and merge counters, plus averages per merge."""
+
+    result = dict(stats)
+    if stats['merges']:
+        result['avg_merge_sources'] = stats['merge_sources'] / stats['merges']
+        result['avg_merge_ms'] = stats['merge_seconds'] * 1000 / stats['merges']
+    return result
+
+
+def rebuild_timelines(limit=TIMELINE_LENGTH):
+    """Recompute all pushed timeline entries from follows and messages.
+
+    Keeps the newest `limit` entries per user. Returns the number of rows.
+    """
+
+    clear_celebrity_cache()
+    celebrities = celebrity_ids()
+    # everyone else is pushed in full below
+    _demoted.clear()
+    entries = TimelineEntry.__table__
+    columns = ['user_id', 'message_id']
+
+    db.session.execute(entries.delete())
+
+    db.session.execute(entries.insert().from_select(
+        columns, select([Message.user_id, Message.id])))
+
+    followed = (select([Follows.user_following_id, Message.id])
+                .select_from(Follows.__table__.join(
+                    Message.__table__,
+                    Message.user_id == Follows.user_being_followed_id)))
+    if celebrities:
+        followed = followed.where(
+            Follows.user_being_followed_id.notin_(celebrities))
+    db.session.execute(entries.insert().from_select(columns, followed))
+
+    ranked = (select([entries.c.user_id,
+                      entries.c.message_id,
+                      db.func.row_number().over(
+                          partition_by=entries.c.user_id,
+                          order_by=entries.c.message_id.desc()).label('position')])
+              .alias('ranked'))
+    db.session.execute(entries.delete().where(exists().where(and_(
+        ranked.c.user_id == entries.c.user_id,
+        ranked.c.message_id == entries.c.message_id,
+        ranked.c.position > limit))))
+
+    db.session.commit()
+    return TimelineEntry.query.count()
@@ -0,0 +1,272 @@
+"""Trending words and #tags from the stream of new messages.
+
+Each posted message's distinct words and tags (`tokens`) are counted in a
+count-min sketch, a fixed TRENDING_SKETCH_DEPTH x TRENDING_SKETCH_WIDTH
+table of counters, each token adding to one counter per row; a token's
+count is the smallest of its counters, which can only overcount. Beside
+it the TRENDING_TRACKED tokens with the highest counts so far are kept by
+name (heavy hitters), replacing the lowest whenever a token's count
+passes it. Memory is the same however many messages go by, and nothing
+scans the messages table.
+
+Counts decay with a half-life of TRENDING_HALF_LIFE seconds, so what
+trends is what is being posted about now. Rather than shrinking every
+counter as time passes, new counts are added with a weight that doubles
+every half-life (forward decay), and everything is rescaled once the
+weights get large.
+
+Each worker counts the messages it posted, and every
+TRENDING_CHECKPOINT_SECONDS writes its sketch to a file of its own in
+TRENDING_CHECKPOINT_DIR. The panel adds up this worker's sketch and the
+other files there, which also keeps counts across restarts: a file whose
+worker is gone decays like the rest, and is deleted once it's negligible.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from array import array
+
+from flask import current_app
+
+from tags import MENTION_PATTERN
+
+TOKEN_PATTERN = re.compile(r'#?\w+')
+
+MIN_WORD_LENGTH = 3
+
+# too common to ever be interesting
+STOPWORDS = frozenset("""
+    about after again all also and any are because been before but can could
+    did does doing don for from get got had has have her here him his how into
+    its just like more most much not now off one only other our out over own
+    said same she should some still such than that the their them then there
+    these they this too under until very was way were what when where which
+    while who why will with would you your
+""".split())
+
+# rescale when weights reach 2 ** RESCALE_HALF_LIVES
+RESCALE_HALF_LIVES = 40
+
+# checkpoints this many half-lives old hold less than 0.1% of their counts
+STALE_HALF_LIVES = 10
+
+
+def tokens(text):
+    """The distinct words and #tags worth counting in `text`, lowercased."""
+
+    found = set()
+    text = MENTION_PATTERN.sub(' ', text)
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        word = token.lstrip('#')
+        if word.isdigit() or not word.strip('_'):
+            continue
+        if token.startswith('#') or (len(word) >= MIN_WORD_LENGTH
+                                     and word not in STOPWORDS):
+            found.add(token)
+    return found
+
+
+class CountMinSketch:
+    """Approximate counts of many keys in depth x width counters."""
+
+    def __init__(self, width, depth, counters=None):
+        self.width = width
+        self.depth = depth
+        self.counters = counters if counters is not None else array('d', bytes(8 * width * depth))
+
+    def cells(self, key):
+        # double hashing, one cell per row: h1 + row * h2
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [row * self.width + (h1 + row * h2) % self.width
+                for row in range(self.depth)]
+
+    def add(self, key, amount):
+        """Count `key` `amount` more times; returns its new estimate."""
+
+        counters = self.counters
+        estimate = None
+        for cell in self.cells(key):
+            counters[cell] += amount
+            if estimate is None or counters[cell] < estimate:
+                estimate = counters[cell]
+        return estimate
+
+    def estimate(self, key):
+        return min(self.counters[cell] for cell in self.cells(key))
+
+    def scale(self, factor):
+        counters = self.counters
+        for i in range(len(counters)):
+            counters[i] *= factor
+
+
+class Trending:
+    """Flask extension counting recent tokens, for the trending panel."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.width = config['TRENDING_SKETCH_WIDTH']
+        self.depth = config['TRENDING_SKETCH_DEPTH']
+        self.tracked = config['TRENDING_TRACKED']
+        self.half_life = config['TRENDING_HALF_LIFE']
+        self.directory = os.path.join(app.root_path, config['TRENDING_CHECKPOINT_DIR'])
+        self.checkpoint_seconds = config['TRENDING_CHECKPOINT_SECONDS']
+        self.lock = threading.RLock()
+        self.reset()
+        app.extensions['trending'] = self
+
+    def reset(self):
+        with self.lock:
+            self.sketch = CountMinSketch(self.width, self.depth)
+            self.top = {}
+            self.floor = 0.0
+            self.landmark = time.time()
+            self.peers = None
+            self.checkpointed_at = time.monotonic()
+
+    def weight(self, now):
+        return 2.0 ** ((now - self.landmark) / self.half_life)
+
+    def ingest(self, text, now=None):
+        """Count the tokens of a newly posted message."""
+
+        now = time.time() if now is None else now
+        with self.lock:
+            if now - self.landmark > RESCALE_HALF_LIVES * self.half_life:
+                self.rescale(now)
+            weight = self.weight(now)
+            for token in tokens(text):
+                self.track(token, self.sketch.add(token, weight))
+        self.maybe_checkpoint()
+
+    def track(self, token, estimate):
+        """Keep `token` among the heavy hitters if its count earns it a place."""
+
+        top = self.top
+        if token in top or len(top) < self.tracked:
+            top[token] = estimate
+            return
+        if estimate <= self.floor:
+            return
+        # counts only grow, so the lowest is at least the floor last found
+        lowest = min(top, key=top.get)
+        self.floor = top[lowest]
+        if estimate > self.floor:
+            del top[lowest]
+            top[token] = estimate
+            self.floor = min(top.values())
+
+    def rescale(self, now):
+        factor = 1 / self.weight(now)
+        self.sketch.scale(factor)
+        self.top = {token: count * factor for token, count in self.top.items()}
+        self.floor *= factor
+        self.landmark = now
+
+    def topics(self, n=10, now=None):
+        """The `n` highest (token, decayed count) pairs across all workers."""
+
+        now = time.time() if now is None else now
+        self.maybe_checkpoint()
+        with self.lock:
+            sources = [(self.sketch.counters, self.top,
+                        2.0 ** ((self.landmark - now) / self.half_life))]
+            for sketch, top, landmark in self.load_peers():
+                sources.append((sketch.counters, top,
+                                2.0 ** ((landmark - now) / self.half_life)))
+
+            candidates = set()
+            for _, top, _ in sources:
+                candidates.update(top)
+            # the sum of each sketch's estimate, all sketches being the same shape
+            counts = {}
+            for token in candidates:
+                cells = self.sketch.cells(token)
+                counts[token] = sum(min(counters[cell] for cell in cells) * decay
+                                    for counters, _, decay in sources)
+        ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        return [(token, count) for token, count in ranked[:n] if count >= 0.5]
+
+    ##########################################################################
+    # Checkpoints
+
+    def path(self):
+        return os.path.join(self.directory, f'{socket.gethostname()}-{os.getpid()}.json')
+
+    def maybe_checkpoint(self):
+        if time.monotonic() - self.checkpointed_at > self.checkpoint_seconds:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Write this worker's counts, and reread the other workers'."""
+
+        with self.lock:
+            state = {
+                'width': self.width,
+                'depth': self.depth,
+                'landmark': self.landmark,
+                'written_at': time.time(),
+                # ingest() changes top in place once the lock is released
+                'top': dict(self.top),
+                'counters': base64.b64encode(self.sketch.counters.tobytes()).decode(),
+            }
+            self.checkpointed_at = time.monotonic()
+            self.peers = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp, self.path())
+
+    def load_peers(self):
+        """(sketch, top, landmark) from the other workers' checkpoints."""
+
+        if self.peers is not None:
+            return self.peers
+
+        self.peers = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return self.peers
+
+        own = os.path.basename(self.path())
+        stale = time.time() - STALE_HALF_LIVES * self.half_life
+        for name in names:
+            if name == own or not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if state['written_at'] < stale:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            elif (state['width'], state['depth']) == (self.width, self.depth):
+                counters = array('d')
+                counters.frombytes(base64.b64decode(state['counters']))
+                self.peers.append((CountMinSketch(self.width, self.depth, counters),
+                                   state['top'], state['landmark']))
+        return self.peers
+
+
+def trending():
+    return current_app.extensions['trending']
@@ -0,0 +1,14 @@
+"""WSGI entry point, e.g. `gunicorn wsgi:app`.
+
+The profile comes from WARBLER_ENV (see config.py). With WARBLER_PRELOAD=1
+the app is warmed for sharing between forked workers; serve it with
+`gunicorn --preload` so that happens once, in the master (see preload.py).
+"""
+
+from app import create_app
+
+app = create_app()
+
+if app.config['PRELOAD']:
+    from preload import preload
+    preload(app)